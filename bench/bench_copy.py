@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# File: ./bench/bench_copy.py
+#
+# Staging benchmark for spal. Generates a source tree of many small files and
+# one of a few large files, then times staging each of them into a build tree
+# with shutil.copytree() (what cp_sources() used to do) and with spal's
+# concurrent copier at various thread counts.
+#
+# Usage: python3 bench/bench_copy.py [<workdir>]
+#
+# Use a <workdir> on the filesystem you build on: results on tmpfs say little
+# about disks. Drop the page cache between runs for cold-cache numbers.
+#
+#
+# Copyright (C) 2025-Present Arijit Kumar Das <arijitkdgit.official@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src"))
+import spal
+
+
+TREES = {
+    # name         : (directories, files per directory, file size)
+    "small-files"  : (50, 100, 4 * 1024),
+    "large-files"  : (1, 4, 64 * 1024 * 1024)
+}
+JOBS = [1, 4, 16]
+
+
+def mk_tree(root: str, dirs: int, files: int, size: int) -> None:
+    block: bytes = os.urandom(min(size, 1024 * 1024))
+    for d in range(dirs):
+        dirpath: str = os.path.join(root, f"dir{d}")
+        os.makedirs(dirpath)
+        for f in range(files):
+            with open(os.path.join(dirpath, f"file{f}"), "wb") as file:
+                for offset in range(0, size, len(block)):
+                    file.write(block[: size - offset])
+
+
+def stage_with_spal(src: str, outdir: str, jobs: int) -> None:
+    buildcfg: dict = spal.CFG_TEMPLATE.copy()
+    buildcfg.update({
+        "pkgmgr"  : "apt",
+        "sources" : [src],
+        "control" : "Package: bench\nVersion: 1.0\n"
+    })
+    options: dict = dict(spal.BUILD_OPTIONS, **{"stage-jobs" : jobs})
+    meta: dict = spal.get_buildmeta(buildcfg, outdir, options)
+    spal.mk_buildtree(buildcfg, meta)
+    spal.cp_sources(buildcfg, meta)
+
+
+def timed(func, *args) -> float:
+    start: float = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    workdir: str = sys.argv[1] if len(sys.argv) > 1 else None
+    print(f"{'tree':<14}{'method':<22}{'time (s)':>10}")
+    with tempfile.TemporaryDirectory(dir = workdir) as tmpdir:
+        for name, (dirs, files, size) in TREES.items():
+            src: str = os.path.join(tmpdir, name)
+            mk_tree(src, dirs, files, size)
+
+            dest: str = os.path.join(tmpdir, "copytree")
+            elapsed: float = timed(shutil.copytree, src, dest)
+            shutil.rmtree(dest)
+            print(f"{name:<14}{'shutil.copytree':<22}{elapsed:>10.3f}")
+
+            for jobs in JOBS:
+                outdir: str = os.path.join(tmpdir, "out")
+                elapsed = timed(stage_with_spal, src, outdir, jobs)
+                shutil.rmtree(outdir)
+                print(f"{name:<14}{f'cp_sources, {jobs} jobs':<22}"
+                      f"{elapsed:>10.3f}")
+            shutil.rmtree(src)
+
+
+if (__name__ == "__main__"):
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# File: ./bench/bench_getcfg.py
+#
+# Parse benchmark for spal build configs. Generates synthetic .spalcfg files
+# with large embedded shell script, man and copyright sections, and times
+# getcfg() on them, along with the peak memory allocated while parsing.
+#
+# Usage: python3 bench/bench_getcfg.py [<size-MiB> ...]
+#
+#
+# Copyright (C) 2025-Present Arijit Kumar Das <arijitkdgit.official@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src"))
+import spal
+
+
+DEFAULT_SIZES_MIB = [1, 8, 32]
+LINE = "This is a line of an embedded payload, repeated to fill the section.\n"
+
+
+def mk_synthetic_cfg(path: str, size_mib: int) -> None:
+    '''
+    Writes a build config whose [SHELLSCRIPT], [MAN] and [COPYRIGHT] sections
+    together hold about size_mib MiB of text.
+    '''
+    lines: int = size_mib * 1024 * 1024 // (3 * len(LINE))
+    payload: str = LINE * lines
+    with open(path, "w") as cfg:
+        cfg.write(
+            "[PACKAGE-MANAGER]\napt\n[END]\n\n\n"
+            "[DISTRIBUTION]\nstable\n[END]\n\n\n"
+            "[COMPONENT]\nmain\n[END]\n\n\n"
+            "[SHELLSCRIPT]\n#!/bin/sh\n" + payload + "[END]\n\n\n"
+            "[CONTROL]\nPackage: bench\nVersion: 1.0\n"
+            "Architecture: all\n[END]\n\n\n"
+            "[SOURCES]\n/dev/null\n[END]\n\n\n"
+            "[MAN]\n" + payload + "[END]\n\n\n"
+            "[COPYRIGHT]\n" + payload + "[END]\n\n\n"
+        )
+
+
+def measure(func, *args) -> tuple:
+    '''
+    Returns the wall time in seconds and the peak traced memory in bytes of
+    func(*args).
+    '''
+    tracemalloc.start()
+    start: float = time.perf_counter()
+    func(*args)
+    elapsed: float = time.perf_counter() - start
+    peak: int = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (elapsed, peak)
+
+
+def main() -> None:
+    sizes: list = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES_MIB
+    print(f"{'size':>8}  {'sections':<12}{'time (s)':>10}"
+          f"{'MiB/s':>10}{'peak (MiB)':>12}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in sizes:
+            path: str = os.path.join(tmpdir, f"bench{size}.spalcfg")
+            mk_synthetic_cfg(path, size)
+            actual: float = os.path.getsize(path) / (1024 * 1024)
+            for label, sections in (("all", None), ("control", {"control"})):
+                elapsed, peak = measure(spal.getcfg, path, sections)
+                print(f"{size:>6}Mi  {label:<12}{elapsed:>10.4f}"
+                      f"{actual / elapsed:>10.1f}{peak / (1024 * 1024):>12.2f}")
+
+
+if (__name__ == "__main__"):
+    main()
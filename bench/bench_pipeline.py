@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+# File: ./bench/bench_pipeline.py
+#
+# Build pipeline benchmark for spal. Generates synthetic build configs and
+# source trees (a tiny package, many small files, a few large files and a
+# large embedded man page), then times every build stage on its own, from
+# getcfg() to build_package() and write_package(), along with the wall time
+# and peak RSS of whole "spal" runs, with the built-in writer and with -d.
+# Each figure is the best of --repeat runs. Results are written as JSON, and
+# two result files (e.g., of two commits) can be compared with --compare.
+#
+# Usage: python3 bench/bench_pipeline.py [--repeat <n>] [--scale <factor>] \
+#            [--compression <type[:level]>] [--output <file.json>] [<workdir>]
+#        python3 bench/bench_pipeline.py --compare <old.json> <new.json>
+#
+# --scale multiplies the number of files, file sizes and man page sizes of
+# every scenario. Use a <workdir> on the filesystem you build on.
+#
+#
+# Copyright (C) 2025-Present Arijit Kumar Das <arijitkdgit.official@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SPAL: str = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "..", "src", "spal.py")
+sys.path.insert(0, os.path.dirname(SPAL))
+import spal
+
+
+SCENARIOS = {
+    # name        : (directories, files per directory, file size, man MiB)
+    "tiny"        : (1, 1, 1024, 0),
+    "small-files" : (20, 250, 4 * 1024, 0),
+    "large-files" : (1, 2, 32 * 1024 * 1024, 0),
+    "large-man"   : (1, 1, 1024, 4)
+}
+STAGES = [
+    "mk_buildtree",
+    "mk_copyright",
+    "mk_shwrapper",
+    "mk_man",
+    "cp_sources",
+    "mk_bytecode",
+    "mk_control",
+    "mk_postrm",
+    "mk_md5sums"
+]
+MAN_LINE = ".PP\nThis is a line of a synthetic man page, repeated to fill it.\n"
+BLOCKSIZE = 1024 * 1024
+
+
+def mk_tree(root: str, dirs: int, files: int, size: int) -> None:
+    # Large files repeat one random block: compressors with a window larger
+    # than the block (e.g., xz) find the repeats, others (e.g., gzip) do not.
+    block: bytes = os.urandom(min(size, BLOCKSIZE))
+    for d in range(dirs):
+        dirpath: str = os.path.join(root, f"dir{d}")
+        os.makedirs(dirpath)
+        for f in range(files):
+            with open(os.path.join(dirpath, f"file{f}"), "wb") as file:
+                for offset in range(0, size, len(block)):
+                    file.write(block[: size - offset])
+
+
+def mk_scenario(root: str, name: str, scale: float) -> str:
+    '''
+    Generates the sources of a scenario under root, and returns the path of
+    its build config, generated with spal's own --generate-buildcfg code.
+    '''
+    dirs, files, size, man_mib = SCENARIOS[name]
+    files = max(1, int(files * scale))
+    size = max(1, int(size * scale))
+    srcroot: str = os.path.join(root, "src")
+    mk_tree(srcroot, dirs, files, size)
+
+    paths: dict = {}
+    texts: dict = {
+        "shellscript" : "#!/bin/sh\nexec /usr/lib/bench/dir0/file0 \"$@\"\n",
+        "control"     : f"Package: bench-{name}\nVersion: 1.0\n"
+                        f"Architecture: all\nMaintainer: Bench <bench@localhost>\n"
+                        f"Description: spal pipeline benchmark ({name})\n",
+        "copyright"   : "Copyright (C) Bench. Public domain.\n",
+        "man"         : MAN_LINE * int(man_mib * scale * 1024 * 1024 /
+                                       len(MAN_LINE)) if man_mib else ""
+    }
+    for key, text in texts.items():
+        if (text == ""):
+            paths[key] = ""
+            continue
+        paths[key] = os.path.join(root, key)
+        with open(paths[key], "w") as file:
+            file.write(text)
+
+    parsed_args: dict = dict(paths, **{
+        "pkgmgr"      : "apt",
+        "dist"        : "stable",
+        "comp"        : "main",
+        "srcroot"     : srcroot,
+        "exclude"     : [],
+        "exclude-pattern" : [],
+        "exclude-from" : "",
+        "compression" : "",
+        "manifest"    : "",
+        "format"      : "",
+        "outfile"     : os.path.join(root, name)
+    })
+    if (spal.mk_cfg(parsed_args) != 0):
+        sys.exit(f"bench_pipeline: {spal.get_last_error()[1]}")
+    return spal.cfgfile
+
+
+def timed(func, *args) -> tuple:
+    start: float = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - start, result)
+
+
+def time_stages(cfgpath: str, outdir: str, options: dict) -> dict:
+    '''
+    Runs every build stage in-process, and returns the time each one took.
+    build_package() builds from the staged tree with dpkg-deb; write_package()
+    streams the package straight from the build config, without a tree.
+    '''
+    times: dict = {}
+    times["getcfg"], buildcfg = timed(spal.getcfg, cfgpath)
+    times["get_buildmeta"], meta = timed(spal.get_buildmeta, buildcfg, outdir,
+                                         options)
+    if (buildcfg == {} or meta == {}):
+        sys.exit(f"bench_pipeline: {spal.get_last_error()[1]}")
+    for stage in STAGES:
+        times[stage], result = timed(getattr(spal, stage), buildcfg, meta)
+        if (result != 0):
+            sys.exit(f"bench_pipeline: {stage}() failed")
+    times["build_package"], debname = timed(spal.build_package, meta)
+    if (debname == ""):
+        sys.exit(f"bench_pipeline: {spal.get_last_error()[1]}")
+    shutil.rmtree(outdir)
+    times["write_package"], debname = timed(spal.write_package, buildcfg, meta)
+    if (debname == ""):
+        sys.exit(f"bench_pipeline: {spal.get_last_error()[1]}")
+    shutil.rmtree(outdir)
+    return times
+
+
+def in_child(func, *args) -> dict:
+    '''
+    Runs func(*args) in a forked child process, and returns its result (which
+    must be serializable to JSON). Linux carries the peak RSS of a process
+    over to the processes it starts, so this process must stay small for the
+    peak RSS of spal runs to be their own.
+    '''
+    rfd, wfd = os.pipe()
+    pid: int = os.fork()
+    if (pid == 0):
+        os.close(rfd)
+        try:
+            with os.fdopen(wfd, "w") as pipe:
+                json.dump(func(*args), pipe)
+        except SystemExit as error:
+            print(error, file = sys.stderr)
+            os._exit(1)
+        os._exit(0)
+    os.close(wfd)
+    with os.fdopen(rfd) as pipe:
+        data: str = pipe.read()
+    if (os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) != 0):
+        sys.exit(1)
+    return json.loads(data)
+
+
+def time_run(args: list) -> dict:
+    '''
+    Runs spal with args, and returns its wall time and peak RSS (in KiB). The
+    build daemon is not used.
+    '''
+    env: dict = dict(os.environ, SPAL_SOCKET = "")
+    start: float = time.perf_counter()
+    proc: subprocess.Popen = subprocess.Popen(
+        [sys.executable, SPAL] + args, stdout = subprocess.DEVNULL, env = env)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall: float = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if (proc.returncode != 0):
+        sys.exit(f"bench_pipeline: spal {' '.join(args)} failed")
+    return {"wall" : wall, "maxrss_kib" : rusage.ru_maxrss}
+
+
+def best(runs: list) -> dict:
+    return {key : min(run[key] for run in runs) for key in runs[0]}
+
+
+def git_commit() -> str:
+    proc: subprocess.CompletedProcess = subprocess.run(
+        ["git", "-C", os.path.dirname(SPAL), "rev-parse", "HEAD"],
+        stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, text = True)
+    return proc.stdout.strip()
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat: dict = {}
+    for key, value in results.items():
+        if (isinstance(value, dict)):
+            flat.update(flatten(value, prefix + key + "/"))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(oldfile: str, newfile: str) -> None:
+    with open(oldfile) as file:
+        old: dict = flatten(json.load(file)["results"])
+    with open(newfile) as file:
+        new: dict = flatten(json.load(file)["results"])
+    print(f"{'metric':<40}{'old':>12}{'new':>12}{'new/old':>10}")
+    for key in old:
+        if (key in new):
+            ratio: str = f"{new[key] / old[key]:.2f}" if old[key] else "-"
+            print(f"{key:<40}{old[key]:>12.4f}{new[key]:>12.4f}{ratio:>10}")
+
+
+def run(repeat: int, scale: float, compression: str, workdir: str) -> dict:
+    options: dict = dict(spal.BUILD_OPTIONS, compression = compression)
+    zargs: list = ["-z", compression] if compression != "" else []
+    results: dict = {}
+    with tempfile.TemporaryDirectory(dir = workdir) as tmpdir:
+        for name in SCENARIOS:
+            root: str = os.path.join(tmpdir, name)
+            os.makedirs(root)
+            cfgpath: str = mk_scenario(root, name, scale)
+            outdir: str = os.path.join(tmpdir, "out")
+            stages: dict = best([in_child(time_stages, cfgpath, outdir,
+                                          options) for _ in range(repeat)])
+            e2e: dict = {}
+            for mode, args in {"native" : [], "dpkg" : ["-d"]}.items():
+                runs: list = []
+                for _ in range(repeat):
+                    runs.append(time_run(args + zargs + [cfgpath, outdir]))
+                    shutil.rmtree(outdir)
+                e2e[mode] = best(runs)
+            results[name] = {"stages" : stages, "e2e" : e2e}
+            shutil.rmtree(root)
+            print(f"{name:<12} stages: " +
+                  ", ".join(f"{stage} {seconds:.4f}s"
+                            for stage, seconds in stages.items()) +
+                  f"\n{'':<12} spal: {e2e['native']['wall']:.3f}s "
+                  f"({e2e['native']['maxrss_kib']} KiB), "
+                  f"spal -d: {e2e['dpkg']['wall']:.3f}s "
+                  f"({e2e['dpkg']['maxrss_kib']} KiB)",
+                  file = sys.stderr)
+    return results
+
+
+def main() -> None:
+    args: list = sys.argv[1:]
+    if (len(args) == 3 and args[0] == "--compare"):
+        compare(args[1], args[2])
+        return
+
+    settings: dict = {"--repeat" : "3", "--scale" : "1", "--compression" : "",
+                      "--output" : ""}
+    workdir: str = None
+    i: int = 0
+    while (i < len(args)):
+        if (args[i] in settings and i + 1 < len(args)):
+            settings[args[i]] = args[i + 1]
+            i += 2
+        elif (workdir is None and not args[i].startswith("-")):
+            workdir = args[i]
+            i += 1
+        else:
+            sys.exit("bench_pipeline: invalid arguments (see the header of "
+                     "this script for usage)")
+
+    report: dict = {
+        "spal"        : spal.VERSION,
+        "commit"      : git_commit(),
+        "python"      : platform.python_version(),
+        "cpus"        : os.cpu_count(),
+        "repeat"      : int(settings["--repeat"]),
+        "scale"       : float(settings["--scale"]),
+        "compression" : settings["--compression"] or spal.DEFAULT_COMPRESSION,
+        "results"     : run(int(settings["--repeat"]),
+                            float(settings["--scale"]),
+                            settings["--compression"], workdir)
+    }
+    if (settings["--output"] == ""):
+        json.dump(report, sys.stdout, indent = 2)
+        print()
+    else:
+        with open(settings["--output"], "w") as file:
+            json.dump(report, file, indent = 2)
+            file.write("\n")
+
+
+if (__name__ == "__main__"):
+    main()
@@ -22,11 +22,108 @@
 # along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 
-import subprocess
 import sys
 import os
+import json
+import socket
+
+SERVE_ENV = ("SOURCE_DATE_EPOCH",)
+
+
+def get_socket_path() -> str:
+    '''
+    Returns the path of the Unix socket of the build daemon (see serve()):
+    $SPAL_SOCKET if it is set (to an empty value to disable the daemon), else
+    spal-<uid>.sock in $XDG_RUNTIME_DIR, or in /tmp.
+    '''
+    if ("SPAL_SOCKET" in os.environ):
+        return os.environ["SPAL_SOCKET"]
+    return os.path.join(os.environ.get("XDG_RUNTIME_DIR") or "/tmp",
+                        f"spal-{os.getuid()}.sock")
+
+
+def serve_client(args: list) -> int:
+    '''
+    Runs the command line args on the build daemon, if one is running and
+    owned by the same user, and prints its output. Returns the exit status of
+    the command, or -1 if it must be run locally instead: when no daemon is
+    running, when its queue is full, or for commands other than builds and
+    build config generation.
+    '''
+    if (args == [] or args[0] in {"-h", "--help", "-v", "--version", "serve",
+                                  "repo", "convert", "verify", "-b", "--batch",
+                                  "--cache-stats", "--blob-gc"} or
+        {"-w", "--watch", "--timings", "--timings-trace",
+         "--profile"} & set(args)):
+        return -1
+    path: str = get_socket_path()
+    umask: int = os.umask(0)
+    os.umask(umask)
+    request: dict = {
+        "args"  : args,
+        "cwd"   : os.getcwd(),
+        "umask" : umask,
+        "env"   : {name : os.environ[name] for name in SERVE_ENV
+                   if name in os.environ}
+    }
+    try:
+        if (path == "" or os.stat(path).st_uid != os.getuid()):
+            return -1
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(path)
+            client.sendall(json.dumps(request).encode() + b"\n")
+            response: dict = json.loads(client.makefile("rb").readline())
+    except (OSError, ValueError):
+        return -1
+    if (not isinstance(response, dict) or
+        not isinstance(response.get("output"), str) or
+        not isinstance(response.get("exitcode"), int)):
+        return -1
+    print(response["output"])
+    return response["exitcode"]
+
+
+# Hand the command over to the build daemon, if one is running, before
+# importing anything else: this is all the work a client has to do.
+if (__name__ == "__main__"):
+    exitcode: int = serve_client(sys.argv[1:])
+    if (exitcode >= 0):
+        sys.exit(exitcode)
+
+import subprocess
 import shutil
 import gzip
+import io
+import lzma
+import stat
+import tarfile
+import time
+import zlib
+import concurrent.futures
+import fcntl
+import hashlib
+import mmap
+import ctypes
+import select
+import struct
+import threading
+import queue
+import multiprocessing
+import signal
+import contextlib
+import cProfile
+import resource
+import importlib.util
+import marshal
+import tempfile
+import re
+import sqlite3
+import functools
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
 
 
 CFG_TEMPLATE = {
@@ -35,10 +132,43 @@ CFG_TEMPLATE = {
     "comp"         : "",
     "shellscript"  : "",
     "sources"      : [],
+    "exclude"      : [],
     "man"          : "",
     "control"      : "",
-    "copyright"    : ""
+    "copyright"    : "",
+    "compression"  : "",
+    "manifest"     : [],
+    "embedded"     : {}
+}
+
+# In the order mk_cfg() writes them.
+CFG_SECTIONS = {
+    b"[PACKAGE-MANAGER]" : "pkgmgr",
+    b"[DISTRIBUTION]"    : "dist",
+    b"[COMPONENT]"       : "comp",
+    b"[SHELLSCRIPT]"     : "shellscript",
+    b"[CONTROL]"         : "control",
+    b"[SOURCES]"         : "sources",
+    b"[EXCLUDE]"         : "exclude",
+    b"[MANIFEST]"        : "manifest",
+    b"[MAN]"             : "man",
+    b"[COPYRIGHT]"       : "copyright",
+    b"[COMPRESSION]"     : "compression"
 }
+CFG_SCALAR_KEYS = {"pkgmgr", "dist", "comp", "compression"}
+CFG_FORMATS = ["text", "packed", "packed+sources"]
+CFG_EXTENSIONS = (".spalcfg", ".spalpack")
+
+# Packed build configs: a header (magic, version, number of records and
+# offset of the record table), the payloads, then the record table. Each
+# record is the name length, mode, mtime (in ns), offset and size of a
+# payload, followed by its name: a CFG_TEMPLATE key, or PACK_FILE_PREFIX and
+# the path of an embedded source relative to the source root.
+PACK_MAGIC = b"SPALPACK"
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct("<8sIIQ")
+PACK_RECORD = struct.Struct("<HIqQQ")
+PACK_FILE_PREFIX = "file:"
 
 SUPPORTED_PACKAGE_MANAGERS = ["apt", "pkg"]
 USR_DIR = {
@@ -46,6 +176,78 @@ USR_DIR = {
     "pkg" : "data/data/com.termux/files/usr"
 }
 
+DEB_FORMAT_VERSION = "2.0\n"
+AR_MAGIC = b"!<arch>\n"
+TAR_BLOCKSIZE = tarfile.BLOCKSIZE
+TAR_RECORDSIZE = tarfile.RECORDSIZE
+COPY_BUFSIZE = 1024 * 1024
+# Compression types: member name suffix, supported levels, default level.
+COMPRESSION_TYPES = {
+    "none" : ("",     range(0, 1),  0),
+    "gzip" : (".gz",  range(1, 10), 9),
+    "xz"   : (".xz",  range(0, 10), 6)
+}
+if (zstd is not None):
+    COMPRESSION_TYPES["zstd"] = (".zst", range(1, 23), 3)
+DEFAULT_COMPRESSION = "xz:6"
+COMPRESSION_BLOCKSIZE = 8 * 1024 * 1024
+PIPELINE_DEPTH = 8
+PIPELINE_TIMEOUT = 0.1
+
+REPO_INDEX_FILE = ".spal-repo-index.db"
+FILES_SUFFIX = ".files"
+DPKG_ADMINDIR = "var/lib/dpkg"
+REPO_HASHES = {
+    "MD5Sum" : "md5",
+    "SHA1"   : "sha1",
+    "SHA256" : "sha256",
+    "SHA512" : "sha512"
+}
+MANIFEST_HASHES = ["none"] + list(REPO_HASHES.values())
+# The sums files of the control archive, by hashlib algorithm.
+SUMS_FILES = {
+    "md5"    : "md5sums",
+    "sha256" : "sha256sums"
+}
+
+DEPENDS_FIELDS = ("Pre-Depends", "Depends")
+
+BUILD_OPTIONS = {
+    "keep-buildtree" : False,
+    "use-debstdname" : False,
+    "use-dpkg"       : False,
+    "cache-dir"      : "",
+    "cache-size"     : 1024,
+    "stage-mode"     : "copy",
+    "stage-jobs"     : 0,
+    "compression"    : "",
+    "compress-threads" : 1,
+    "pkgmgrs"        : [],
+    "precompile"     : False,
+    "sha256sums"     : False,
+    "file-list"      : False,
+    "blob-store"     : ""
+}
+STAGE_MODES = ["copy", "hardlink", "reflink", "auto"]
+FICLONE = 0x40049409
+BLOB_HASHES = ("md5", "sha256")
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+    IN_MOVED_TO | IN_CREATE | IN_DELETE
+WATCH_POLL_INTERVAL = 0.5
+WATCH_SETTLE_TIME = 0.05
+SERVE_QUEUE_SIZE = 64
+
 VERSION = "1.1"
 VERSION_TEXT = \
 f'''spal {VERSION}
@@ -69,13 +271,44 @@ into distributable packages. Currently supports building .deb packages only.
          --comp <comp> \\
          --shellscript <shell-script> \\
          --control <control-file> \\
-         [--srcroot <src-rootdir> [--exclude <file-1> ... <file-n>]] \\
+         [--srcroot <src-rootdir> [--exclude <file-1> ... <file-n>] \\
+                                  [--exclude-pattern <pattern-1> ... \\
+                                                     <pattern-n>] \\
+                                  [--exclude-from <pattern-file>] \\
+                                  [--manifest <hash>]] \\
          [--man <man-filename>] \\
          [--copyright <copyright-filename>] \\
+         [--compression <type[:level]>] \\
+         [--format <format>] \\
          [--outfile <output-filename>]
-  2. spal [{-k | --keep-buildtree}] [{-s | --debstdname}] <buildcfg> <outdir>
-  3. spal [{-h | --help}]
-  4. spal {-v | --version}
+  2. spal [{-k | --keep-buildtree}] [{-s | --debstdname}] \\
+         [{-d | --use-dpkg}] [--stage-mode <mode>] [--stage-jobs <n>] \\
+         [{-z | --compression} <type[:level]>] [--compress-threads <n>] \\
+         [{-c | --cache-dir} <cachedir> [--cache-size <MiB>]] \\
+         [--blob-store <storedir>] [--pkgmgrs <pkg-mgr>,...] \\
+         [--precompile] [--sha256sums] [--file-list] [--timings] \\
+         [--timings-trace <tracefile>] [--profile <statsfile>] \\
+         [{-w | --watch}] <buildcfg> <outdir>
+  3. spal {-b | --batch} [{-j | --jobs} <jobs>] [--keep-going] \\
+         [{-k | --keep-buildtree}] [{-d | --use-dpkg}] \\
+         [--stage-mode <mode>] [--stage-jobs <n>] \\
+         [{-z | --compression} <type[:level]>] [--compress-threads <n>] \\
+         [{-c | --cache-dir} <cachedir> [--cache-size <MiB>]] \\
+         [--blob-store <storedir>] [--pkgmgrs <pkg-mgr>,...] \\
+         [--precompile] [--sha256sums] [--file-list] \\
+         <outdir> <buildcfg | dir> ...
+  4. spal --cache-stats <cachedir>
+  5. spal --blob-gc <storedir>
+  6. spal repo [--dist <dist>] <repodir>
+  7. spal repo add [--dist <dist>] [--comp <comp>] <repodir> <deb> ...
+  8. spal repo remove [--dist <dist>] [--comp <comp>] <repodir> \\
+         <package>[=<version>] ...
+  9. spal repo prune [--dist <dist>] [--comp <comp>] --keep <n> <repodir>
+ 10. spal convert [--embed-sources] <buildcfg> <output-filename>
+ 11. spal verify [{-j | --jobs} <jobs>] <deb | package>
+ 12. spal serve [--socket <socket>] [{-j | --jobs} <jobs>] [--queue <n>]
+ 13. spal [{-h | --help}]
+ 14. spal {-v | --version}
 
 #2 Meanings of notations used above:
   - <...>       :  A mandatory value for the preceding option. A
@@ -117,39 +350,345 @@ f'''
                                  that would be excluded. May be specified only
                                  when --srcroot is specified.
 
-  9. --man                    :  Specify the man file, if any. Would appear
+  9. --exclude-pattern        :  Specify gitignore-style patterns of the paths
+                                 under the source root that would be excluded
+                                 (e.g., ".git/", "__pycache__/", "*.o",
+                                 "/build/**"; quote them from the shell). A
+                                 pattern with a "/" other than a trailing one
+                                 matches from the source root, others match
+                                 at any depth; "**" matches any number of
+                                 directories, a trailing "/" matches
+                                 directories only, and "!" re-includes what
+                                 an earlier pattern excluded (but not under
+                                 an excluded directory). The patterns are
+                                 stored in the build config and applied while
+                                 the sources are walked, so excluded
+                                 directories are never descended into, staged
+                                 or hashed. May be specified only when
+                                 --srcroot is specified.
+
+ 10. --exclude-from           :  Specify a file of exclude patterns (one per
+                                 line, e.g., a .gitignore file), read before
+                                 the ones of --exclude-pattern. May be
+                                 specified only when --srcroot is specified.
+
+ 11. --manifest               :  Specify to record a manifest of every file and
+                                 directory under the sources (mode, size,
+                                 mtime and a hash) in the build config, with
+                                 <hash> one of: {", ".join(MANIFEST_HASHES)}.
+                                 Builds then plan and stage the sources from
+                                 the manifest instead of walking them, key the
+                                 build cache by its hashes, and add an
+                                 Installed-Size field to the control file; md5
+                                 also spares hashing the files for
+                                 DEBIAN/md5sums. Files are checked against it
+                                 with one stat() each, and files added after
+                                 the manifest was generated are not packaged.
+                                 May be specified only when --srcroot is
+                                 specified.
+
+ 12. --man                    :  Specify the man file, if any. Would appear
                                  when "man <package-name>" is used.
 
- 10. --copyright              :  Specify the copyright file, if any.
+ 13. --copyright              :  Specify the copyright file, if any.
+
+ 14. --compression            :  Specify the compression of the package
+                                 archives, as <type> or <type>:<level>. See
+                                 option -z, --compression.
+
+ 15. --format                 :  Specify the format of the build config, one
+                                 of: {", ".join(CFG_FORMATS)}. "text"
+                                 (default) writes the sections as text, with
+                                 the extension .spalcfg. "packed" writes them
+                                 in an indexed binary container, with the
+                                 extension .spalpack, from which sections and
+                                 large man pages are read in place, without
+                                 being parsed or copied. "packed+sources" also
+                                 embeds the files of the sources in it, so
+                                 that the build config alone is enough to
+                                 build the package.
 
- 11. --outfile                :  Specify the file to which output build config
-                                 would be written to. File extension: .spalcfg.
-                                 If unspecified, the name would be:
-                                 <shellscript>.<pkgmgr>.<dist>.<comp>.spalcfg.
+ 16. --outfile                :  Specify the file to which output build config
+                                 would be written to. File extension: .spalcfg
+                                 (.spalpack if packed). If unspecified, the
+                                 name would be:
+                                 <shellscript>.<pkgmgr>.<dist>.<comp>.spalcfg
+                                 (or .spalpack).
 
- 12. -k, --keep-buildtree     :  Specify whether to keep the build tree in the
+ 17. -k, --keep-buildtree     :  Specify whether to keep the build tree in the
                                  output directory after the package has been
                                  built. Build tree is removed by default.
 
- 13. -s, --use-debstdname     :  Use the standard debian package naming scheme
+ 18. -s, --use-debstdname     :  Use the standard debian package naming scheme
                                  for the output package file
                                  (<pkg-name>_<ver>_all.deb). The package would
                                  be put in the directory:
                                  <outdir>/<pkgmgr>.<dist>.<comp>/
 
- 14. -h, --help               :  Show this help section and exit.
+ 19. -d, --use-dpkg           :  Build the package by staging the build tree
+                                 and running "dpkg --build" on it, instead of
+                                 using the built-in .deb writer. By default,
+                                 spal writes the .deb archive itself, straight
+                                 from the build config, without staging a
+                                 build tree (unless -k is specified).
+
+ 20. -b, --batch              :  Build many packages in one invocation. Each
+                                 argument after <outdir> is either a build
+                                 config file or a directory, in which case all
+                                 the *.spalcfg and *.spalpack files in it are
+                                 built. Packages are named and placed as with
+                                 -s. Packages are built after the packages of
+                                 the batch named in their Pre-Depends and
+                                 Depends fields, as many at a time as their
+                                 dependencies allow; dependency cycles are
+                                 errors (see --keep-going). A failed package
+                                 only skips the packages that depend on it:
+                                 the others are still built. The critical
+                                 path of the batch, the chain of dependent
+                                 builds that took the longest, is printed to
+                                 stderr at the end.
+
+ 21. --keep-going             :  Keep building the packages of a batch that are
+                                 not in a dependency cycle, nor depend on one,
+                                 instead of failing the batch before anything
+                                 is built.
+
+ 22. -j, --jobs               :  Specify the number of packages built in
+                                 parallel in batch mode, or by the build daemon
+                                 (see serve), or the number of files hashed in
+                                 parallel by verify. Defaults to the number of
+                                 CPUs.
+
+ 23. -c, --cache-dir          :  Specify a build cache directory. Packages are
+                                 cached by a hash of the build config, the
+                                 contents of the sources and the compression
+                                 settings. If a package for the same inputs is
+                                 already cached, it is copied (cloned where
+                                 the filesystem supports it) to the output and
+                                 nothing is built. On a cache hit, no build
+                                 tree is created even if -k is specified.
+
+ 24. --cache-size             :  Specify the maximum size of the build cache in
+                                 MiB (default: 1024). Least recently used
+                                 packages are evicted when it is exceeded.
+
+ 25. --cache-stats            :  Show the number of entries, size, hits and
+                                 misses of a build cache directory, then exit.
+
+ 26. --blob-store             :  Specify a blob store directory, shared by
+                                 builds, to stage the sources from (with -k or
+                                 -d). Source files are stored once per
+                                 content, permissions and modification time,
+                                 and hardlinked from the store into build
+                                 trees, so identical files across packages,
+                                 versions and package managers are only
+                                 written once. The store must be on the
+                                 filesystem of the build trees, otherwise the
+                                 staging mode is used. Do not edit staged
+                                 files in place, as that edits the store.
+
+ 27. --blob-gc                :  Remove the blobs of a blob store that no build
+                                 tree links to any more, then exit.
+
+ 28. repo                     :  Generate or refresh the APT repository indexes
+                                 (Packages, Packages.xz, Contents-all,
+                                 Contents-all.xz and Release) of every
+                                 component in <repodir>/dists/<dist>, from the
+                                 .deb packages in their binary-all directories.
+                                 Package metadata, hashes and file lists are
+                                 kept in the SQLite index
+                                 <repodir>/.spal-repo-index.db, so only new or
+                                 modified packages are read. Fields other than
+                                 Date, Components and the checksums of an
+                                 existing Release file are kept.
+
+ 29. repo add                 :  Publish .deb packages in a component of the
+                                 repository, as <package>_<version>_<arch>.deb
+                                 in its binary-all directory (replacing the
+                                 same version), then update the indexes from
+                                 the package index: only the packages added
+                                 are read, and only their component is
+                                 indexed again.
+
+ 30. repo remove              :  Remove packages (all their versions, or the
+                                 given one) from a component of the
+                                 repository, then update the indexes.
+
+ 31. repo prune               :  Remove all but the newest versions of every
+                                 package of a component of the repository,
+                                 then update the indexes.
+
+ 32. --dist                   :  Specify the distribution of the repository
+                                 (default: "stable").
+
+ 33. --comp                   :  Specify the component of the repository to
+                                 add packages to, remove packages from or
+                                 prune (default: "main").
+
+ 34. --keep                   :  Specify the number of versions of every
+                                 package kept by repo prune.
+
+ 35. convert                  :  Convert a build config to the format given by
+                                 the extension of <output-filename>: packed if
+                                 .spalpack, else text. Embedded sources are
+                                 kept in packed build configs, and written to
+                                 the directory <output-filename>.sources
+                                 (without its extension) when converting to
+                                 text, from where the text build config lists
+                                 them.
+
+ 36. --embed-sources          :  Embed the sources listed in the build config in
+                                 the packed build config written by convert.
+
+ 37. verify                   :  Check the files of a package against its
+                                 DEBIAN/md5sums (and DEBIAN/sha256sums, if
+                                 present), then report the files that differ,
+                                 are missing or are not listed, and exit with
+                                 1 if there are any. <deb> is a .deb file,
+                                 whose data archive is streamed and hashed in
+                                 a single pass, without being extracted.
+                                 Otherwise, the installed package named
+                                 <package> is checked, from the sums files
+                                 dpkg keeps in its database (under
+                                 $DPKG_ROOT/var/lib/dpkg, or $DPKG_ADMINDIR),
+                                 hashing its files in parallel.
+
+ 38. --stage-mode             :  Specify how the sources are staged in the build
+                                 tree (with -k or -d). Supported modes are:
+                                 {STAGE_MODES}.
+                                 "copy" (default) copies every file,
+                                 "hardlink" and "reflink" link or clone files
+                                 (copy-on-write) instead, falling back to
+                                 copying when not possible. "auto"
+                                 tries reflink, then hardlink, then copy. Only
+                                 files owned by the building user are
+                                 hardlinked, so the package is the same in all
+                                 modes. Do not edit staged files in place
+                                 with "hardlink", as that edits the sources.
+
+ 39. --stage-jobs             :  Specify the number of threads staging the
+                                 source files in the build tree. Defaults to
+                                 the number of CPUs plus 4, at most 32.
+
+ 40. -z, --compression        :  Specify the compression of the package
+                                 archives, as <type> or <type>:<level>.
+                                 Supported types are:
+                                 {list(COMPRESSION_TYPES)}.
+                                 Overrides the compression of the build config,
+                                 if any (see --generate-buildcfg). Defaults to
+                                 {DEFAULT_COMPRESSION}. The man page is gzipped
+                                 at the same level with gzip, at level 1 with
+                                 none, and at level 9 otherwise.
+
+ 41. --compress-threads       :  Specify the number of threads compressing the
+                                 data archive (default: 1). With more than one
+                                 thread, the archive is compressed in
+                                 independent blocks of 8 MiB, at a small cost
+                                 in compression ratio. Ignored with -d.
+
+ 42. --pkgmgrs                :  Build the package for each of the given package
+                                 managers (comma-separated, e.g., apt,pkg) in
+                                 place of the one of the build config. Without
+                                 -k and -d, every source file is read and
+                                 hashed once for all of them, and only the
+                                 compression is done for each package, as the
+                                 paths in their archives differ. Not available
+                                 with -w. The packages are printed one per
+                                 line.
+
+ 43. --precompile             :  Compile the Python sources (*.py files under the
+                                 sources) to bytecode at build time, over a
+                                 pool of processes, and ship it in the package
+                                 (in __pycache__ directories), sparing the
+                                 compilation on the first run. The bytecode
+                                 uses checked-hash invalidation and dates
+                                 clamped to the build time, so builds are
+                                 reproducible. It is only used by the Python
+                                 version that built it; sources that do not
+                                 compile are shipped without bytecode. A
+                                 postrm script removing leftover __pycache__
+                                 directories is added to the package.
+
+ 44. --sha256sums             :  Add DEBIAN/sha256sums to the package, listing
+                                 the SHA-256 sums of its files like
+                                 DEBIAN/md5sums does with MD5 sums. Both are
+                                 computed while the files are archived (or
+                                 copied into the build tree), without reading
+                                 them again.
+
+ 45. --file-list              :  Write <package>.deb.files along with the .deb
+                                 package: the list of the files in the
+                                 package, from which repo add indexes its
+                                 Contents without reading the package again.
+                                 With -c, the list is also cached with the
+                                 package.
+
+ 46. -w, --watch              :  Build the package, then watch the build config
+                                 file and the sources, and rebuild the package
+                                 whenever they change, until interrupted (with
+                                 Ctrl+C). The build tree is kept (as with -k),
+                                 only the changed sources are restaged in it,
+                                 and the build cache is not used. Uses inotify,
+                                 or polls for changes where it is unavailable.
+                                 Use a fast compression (e.g., -z gzip:1) for
+                                 the quickest rebuilds.
+
+ 47. --timings                :  Print a table of the build stages to stderr
+                                 after the build, with the wall and CPU time of
+                                 each (including that of dpkg-deb with -d), the
+                                 bytes read and written, the number of files
+                                 staged, generated or archived, and the time
+                                 spent compressing the package archives.
+                                 Nested stages are indented. Ignored with -w.
+
+ 48. --timings-trace          :  Write the timings of the build stages (see
+                                 --timings) to a file in the Chrome trace event
+                                 format, for chrome://tracing or Perfetto.
+
+ 49. --profile                :  Profile the build with cProfile, and write the
+                                 statistics to a file, for
+                                 "python3 -m pstats <statsfile>". Work done on
+                                 other threads (e.g., --compress-threads) only
+                                 shows as the main thread waiting for it.
+
+ 50. serve                    :  Run a build daemon listening on a Unix socket,
+                                 until interrupted. While it runs, builds and
+                                 build config generations of the same user are
+                                 handed over to it by spal, which saves their
+                                 startup time, and run on its pool of worker
+                                 processes. When its queue is full, or it is
+                                 not running, spal runs them itself. Other
+                                 commands (e.g., -b or -w) are always run by
+                                 spal itself. Requests are JSON objects with
+                                 the command line arguments ("args"), working
+                                 directory ("cwd"), umask ("umask") and
+                                 SOURCE_DATE_EPOCH ("env") of the command.
+
+ 51. --socket                 :  Specify the socket of the build daemon.
+                                 Defaults to $SPAL_SOCKET, else
+                                 spal-<uid>.sock in $XDG_RUNTIME_DIR or /tmp.
+                                 Setting SPAL_SOCKET to an empty value stops
+                                 spal from using the daemon.
+
+ 52. --queue                  :  Specify the number of requests that may wait
+                                 for a worker of the build daemon (default:
+                                 {SERVE_QUEUE_SIZE}).
+
+ 53. -h, --help               :  Show this help section and exit.
  
- 15. -v, --version            :  Show the version & copyright notice, then exit.
+ 54. -v, --version            :  Show the version & copyright notice, then exit.
 
 ## NOTE:
   - On successful generation of build config file, spal prints the file name
     to stdout along with its path.
 
   - On build success, spal prints the .deb package name to stdout along with
-    its path.
+    its path. In batch mode, this is done for every package built.
 
   - If an error occurs, relevant errorcode is displayed along with an error
     message.
+
+  - The build daemon prints its socket path to stdout once it is listening.
 '''
 
 ERR_FILE_NOT_FOUND = -2
@@ -159,12 +698,23 @@ ERR_NO_VERSION_STRING = -5
 ERR_SRCROOT_UNSPECIFIED = -6
 ERR_SUBPROCESS_FAILED = -7
 ERR_SRCROOT_IS_CWD = -8
+ERR_WRITE_FAILED = -9
+ERR_BAD_PACKAGE = -10
+ERR_BAD_COMPRESSION = -11
+ERR_DAEMON_RUNNING = -12
+ERR_BAD_MANIFEST = -13
+ERR_BAD_CONFIG = -14
+ERR_DEPENDENCY_CYCLE = -15
+ERR_BUILD_FAILED = -16
 
 errno: int = 0
 errdesc: str = ""
 
 cfgfile: str = ""
 
+timings: list = None
+file_count: int = 0
+
 
 def get_last_error() -> tuple:
     global errdesc, errno
@@ -177,39 +727,198 @@ def get_last_error() -> tuple:
     return (last_errno, last_errdesc)
 
 
-def get_package_name(control_text: str) -> str:
+def count_files(count: int) -> None:
+    '''
+    Adds count to the number of files staged, generated or archived so far,
+    as reported by --timings.
+    '''
+    global file_count
+    file_count += count
+
+
+def timing_counters() -> dict:
+    '''
+    Returns the current time, CPU time used by spal and its finished child
+    processes, bytes read and written (including those of finished child
+    processes, from /proc/self/io, where available) and file count (see
+    count_files()).
+    '''
+    usage: resource.struct_rusage = resource.getrusage(resource.RUSAGE_SELF)
+    children: resource.struct_rusage = resource.getrusage(
+        resource.RUSAGE_CHILDREN)
+    io: dict = {}
+    try:
+        with open("/proc/self/io") as iofile:
+            for line in iofile:
+                key, value = line.split(":")
+                io[key] = int(value)
+    except OSError:
+        pass
+    return {
+        "time"    : time.perf_counter(),
+        "cpu"     : usage.ru_utime + usage.ru_stime +
+                    children.ru_utime + children.ru_stime,
+        "read"    : io.get("rchar", 0),
+        "written" : io.get("wchar", 0),
+        "files"   : file_count
+    }
+
+
+@contextlib.contextmanager
+def timed_stage(name: str):
+    '''
+    Context manager timing the build stage name, if timings is a list (with
+    --timings): a dictionary of the stage is appended to it, with its name,
+    nesting depth, start time, and the differences of the counters of
+    timing_counters() between its start and end. Yields a dictionary to which
+    the stage may add fields of its own (e.g., "compress", the seconds spent
+    compressing).
+    '''
+    if (timings is None):
+        yield {}
+        return
+    stage: dict = {"name" : name, "depth" : sum(1 for stage in timings
+                                                if "wall" not in stage)}
+    timings.append(stage)
+    start: dict = timing_counters()
+    try:
+        yield stage
+    finally:
+        end: dict = timing_counters()
+        stage["start"] = start["time"]
+        stage["wall"] = end["time"] - start["time"]
+        for key in ("cpu", "read", "written", "files"):
+            stage[key] = end[key] - start[key]
+
+
+def show_timings(tracefile: str = "") -> None:
+    '''
+    Prints the timings of the build stages as a table on stderr, or writes
+    them to tracefile in the Chrome trace event format (for chrome://tracing
+    or Perfetto), if given.
+    '''
+    if (timings == []):
+        return
+    if (tracefile != ""):
+        origin: float = min(stage["start"] for stage in timings)
+        events: list = [{
+            "name" : stage["name"],
+            "cat"  : "spal",
+            "ph"   : "X",
+            "ts"   : (stage["start"] - origin) * 1e6,
+            "dur"  : stage["wall"] * 1e6,
+            "pid"  : os.getpid(),
+            "tid"  : 1,
+            "args" : {key : stage[key] for key in stage
+                      if key not in {"name", "depth", "start", "wall"}}
+        } for stage in timings]
+        with open(tracefile, "w") as trace:
+            json.dump({"traceEvents" : events, "displayTimeUnit" : "ms"},
+                      trace)
+        return
+    mib: int = 1024 * 1024
+    lines: list = [
+        f"{'stage':<28}{'wall (s)':>10}{'cpu (s)':>10}{'read (MiB)':>12}"
+        f"{'written (MiB)':>15}{'files':>8}{'compress (s)':>14}"
+    ]
+    for stage in timings:
+        compress: str = f"{stage['compress']:.3f}" if "compress" in stage \
+            else ""
+        lines.append(
+            f"{'  ' * stage['depth'] + stage['name']:<28}"
+            f"{stage['wall']:>10.3f}{stage['cpu']:>10.3f}"
+            f"{stage['read'] / mib:>12.2f}{stage['written'] / mib:>15.2f}"
+            f"{stage['files']:>8}{compress:>14}"
+        )
+    top: list = [stage for stage in timings if stage["depth"] == 0]
+    lines.append(f"{'total':<28}{sum(stage['wall'] for stage in top):>10.3f}"
+                 f"{sum(stage['cpu'] for stage in top):>10.3f}")
+    print("\n".join(lines), file = sys.stderr)
+
+
+def parse_control(control_text: str) -> dict:
+    '''
+    Parses the control text (a single deb822 paragraph) into a dictionary of
+    fields, in order of appearance. Continuation lines (starting with a space
+    or tab) are appended as they are to the value of the preceding field,
+    separated by a newline, as for the extended description in "Description",
+    so that "Field: value" reproduces the original field. Comment lines
+    (starting with "#") are ignored, and parsing stops at the first blank line
+    following a field.
+    '''
+    fields: dict = {}
+    field: str = ""
+    for line in control_text.splitlines():
+        if (line.startswith("#")):
+            continue
+        if (line.strip() == ""):
+            if (fields != {}):
+                break
+            continue
+        if (line[0] in " \t"):
+            if (field != ""):
+                fields[field] += "\n" + line.rstrip()
+            continue
+        if (":" not in line):
+            continue
+        field, value = line.split(":", 1)
+        field = field.strip()
+        fields[field] = value.strip()
+    return fields
+
+
+def get_package_name(control_text: str, fields: dict = None) -> str:
     global errno, errdesc
-    lines: list = control_text.split('\n')
-    package: str = ""
-    for line in lines:
-        line = line.strip()
-        if (line.startswith("Package:")):
-            package = line[line.index(':') + 1 :].strip()
+    if (fields is None):
+        fields = parse_control(control_text)
+    package: str = fields.get("Package", "")
     if (package == ""):
         errno = ERR_NO_PACKAGE_NAME
         errdesc = "Control text has no package name"
     return package
 
 
-def get_version(control_text: str) -> str:
+def get_version(control_text: str, fields: dict = None) -> str:
     global errno, errdesc
-    lines: list = control_text.split('\n')
-    version: str = ""
-    for line in lines:
-        line = line.strip()
-        if (line.startswith("Version:")):
-            version = line[line.index(':') + 1 :].strip()
+    if (fields is None):
+        fields = parse_control(control_text)
+    version: str = fields.get("Version", "")
     if (version == ""):
         errno = ERR_NO_VERSION_STRING
         errdesc = "Control text has no version string"
     return version
 
 
-def getcfg(cfg: str) -> dict:
+def find_section_end(cfgmap: mmap.mmap, pos: int) -> tuple:
+    '''
+    Returns the offsets of the start and the end of the first "[END]" line at
+    or after pos in the memory-mapped build config, as a tuple. If there is
+    none, the section extends to the end of the file: both offsets are then
+    the file size.
+    '''
+    size: int = len(cfgmap)
+    while (True):
+        endpos: int = cfgmap.find(b"[END]", pos)
+        if (endpos == -1):
+            return (size, size)
+        line_start: int = cfgmap.rfind(b"\n", 0, endpos) + 1
+        line_end: int = cfgmap.find(b"\n", endpos)
+        line_end = size if line_end == -1 else line_end + 1
+        if (cfgmap[line_start : line_end].strip() == b"[END]"):
+            return (max(line_start, pos), line_end)
+        pos = endpos + len(b"[END]")
+
+
+def getcfg(cfg: str, sections: set = None) -> dict:
     '''
     Returns the build configuration from the configuration file a.k.a cfg.
     If the file is not found, sets errno and errdesc and returns an empty
     dictionary.
+
+    The file is memory-mapped and scanned once: multi-line sections are
+    located by searching for their "[END]" line, and only then sliced and
+    decoded. If sections (a set of CFG_TEMPLATE keys) is given, only those
+    sections are decoded; the others keep their CFG_TEMPLATE values.
     '''
     global errno, errdesc
     if (not os.path.isfile(cfg)):
@@ -218,448 +927,4527 @@ def getcfg(cfg: str) -> dict:
         return {}
 
     buildcfg: dict = CFG_TEMPLATE.copy()
-    with open(cfg) as cfgfile:
-        lines: list = cfgfile.readlines()
-        total_lines: int = len(lines)
-        i: int = 0
-        while (i < total_lines):
-            line = lines[i].strip()
-
-            if (line == "[PACKAGE-MANAGER]" and
-                i + 1 != total_lines):
-                buildcfg["pkgmgr"] = lines[i + 1].strip()
-
-            elif (line == "[DISTRIBUTION]" and
-                i + 1 != total_lines):
-                buildcfg["dist"] = lines[i + 1].strip()
-
-            elif (line == "[COMPONENT]" and
-                i + 1 != total_lines):
-                buildcfg["comp"] = lines[i + 1].strip()
-
-            elif (line == "[SHELLSCRIPT]" and
-                i + 1 != total_lines):
-                j = i + 1
-                while (lines[j].strip() != "[END]" and
-                    j + 1 != total_lines):
-                    buildcfg["shellscript"] += lines[j]
-                    j += 1
-                i = j + 1
-                continue
+    buildcfg["sources"] = []
+    buildcfg["exclude"] = []
+    buildcfg["manifest"] = []
+    buildcfg["embedded"] = {}
+    if (os.path.getsize(cfg) == 0):
+        return buildcfg
+    with open(cfg, "rb") as cfgfile:
+        packed: bool = cfgfile.read(len(PACK_MAGIC)) == PACK_MAGIC
+    if (packed):
+        return getcfg_packed(cfg, buildcfg, sections)
 
-            elif (line == "[SOURCES]" and
-                i + 1 != total_lines):
-                j = i + 1
-                while (lines[j].strip() != "[END]" and
-                    j + 1 != total_lines):
-                    buildcfg["sources"].append(lines[j].strip())
-                    j += 1
-                i = j + 1
+    with open(cfg, "rb") as cfgfile, \
+        mmap.mmap(cfgfile.fileno(), 0, access = mmap.ACCESS_READ) as cfgmap:
+        size: int = len(cfgmap)
+        while (cfgmap.tell() < size):
+            key: str = CFG_SECTIONS.get(cfgmap.readline().strip(), "")
+            if (key == "" or cfgmap.tell() == size):
                 continue
+            wanted: bool = sections is None or key in sections
 
-            elif (line == "[CONTROL]" and
-                i + 1 != total_lines):
-                j = i + 1
-                while (lines[j].strip() != "[END]" and
-                    j + 1 != total_lines):
-                    buildcfg["control"] += lines[j]
-                    j += 1
-                i = j + 1
+            if (key in CFG_SCALAR_KEYS):
+                value: bytes = cfgmap.readline()
+                if (wanted):
+                    buildcfg[key] = value.decode().strip()
                 continue
 
-            elif (line == "[MAN]" and
-                i + 1 != total_lines):
-                j = i + 1
-                while (lines[j].strip() != "[END]" and
-                    j + 1 != total_lines):
-                    buildcfg["man"] += lines[j]
-                    j += 1
-                i = j + 1
+            start: int = cfgmap.tell()
+            end, next_pos = find_section_end(cfgmap, start)
+            cfgmap.seek(next_pos)
+            if (not wanted):
                 continue
+            set_cfg_section(buildcfg, key, cfgmap[start : end].decode())
 
-            elif (line == "[COPYRIGHT]" and
-                i + 1 != total_lines):
-                j = i + 1
-                while (lines[j].strip() != "[END]" and
-                    j + 1 != total_lines):
-                    buildcfg["copyright"] += lines[j]
-                    j += 1
-                i = j + 1
-                continue
+    return buildcfg
 
-            i += 1
 
+def set_cfg_section(buildcfg: dict, key: str, text: str) -> None:
+    '''
+    Sets the section key (a CFG_TEMPLATE key) of the build configuration from
+    its text in the build config. Line endings are normalized to "\n", as
+    reading the build config in text mode would.
+    '''
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if (key in CFG_SCALAR_KEYS):
+        buildcfg[key] = text.strip()
+    elif (key == "sources"):
+        buildcfg["sources"] = [line.strip() for line in text.splitlines()]
+    elif (key == "exclude"):
+        buildcfg["exclude"] = [line for line in text.splitlines()
+                               if line.strip() != ""]
+    elif (key == "manifest"):
+        buildcfg["manifest"] = parse_manifest(text)
+    else:
+        buildcfg[key] = text
+
+
+def getcfg_packed(cfg: str, buildcfg: dict, sections: set = None) -> dict:
+    '''
+    Reads the packed build config cfg (see write_packed_cfg()) into buildcfg
+    (as getcfg() does), and returns it. The file is memory-mapped and only its
+    record table is read: each section is sliced through its offset, and
+    embedded sources are kept as memoryviews of the mapping, without copying
+    them, in buildcfg["embedded"], which maps the name of every embedded
+    source to its entries (see resolve_manifest()). Sets errno and errdesc and
+    returns an empty dictionary if the file is malformed.
+    '''
+    global errno, errdesc
+    with open(cfg, "rb") as cfgfile:
+        cfgmap: mmap.mmap = mmap.mmap(cfgfile.fileno(), 0,
+                                      access = mmap.ACCESS_READ)
+    view: memoryview = memoryview(cfgmap)
+    try:
+        _, version, count, pos = PACK_HEADER.unpack_from(cfgmap, 0)
+        if (version != PACK_VERSION):
+            raise ValueError(version)
+        for _ in range(count):
+            namelen, mode, mtime, offset, size = \
+                PACK_RECORD.unpack_from(cfgmap, pos)
+            pos += PACK_RECORD.size
+            name: str = str(view[pos : pos + namelen], "utf-8")
+            pos += namelen
+            if (offset + size > len(cfgmap)):
+                raise ValueError(name)
+            if (name.startswith(PACK_FILE_PREFIX)):
+                if (sections is not None and "sources" not in sections):
+                    continue
+                path: str = name[len(PACK_FILE_PREFIX) :]
+                isdir: bool = stat.S_ISDIR(mode)
+                buildcfg["embedded"].setdefault(path.partition("/")[0],
+                                                []).append({
+                    "type"  : "d" if isdir else "f",
+                    "mode"  : stat.S_IMODE(mode),
+                    "size"  : size,
+                    "mtime" : mtime,
+                    "hash"  : "",
+                    "path"  : path,
+                    "src"   : "",
+                    "data"  : None if isdir else view[offset : offset + size]
+                })
+            elif (name in CFG_SECTIONS.values() and
+                  (sections is None or name in sections)):
+                set_cfg_section(buildcfg, name,
+                                str(view[offset : offset + size], "utf-8"))
+    except (struct.error, ValueError):
+        errno = ERR_BAD_CONFIG
+        errdesc = f"Malformed packed build config \"{cfg}\"."
+        return {}
     return buildcfg
 
 
-def get_rootdir(buildcfg: str, outdir: str) -> str:
+def exclude_regex(pattern: str) -> str:
     '''
-    Get the root directory of the build tree. Sets errno and errdesc if an
-    unsupported package manager is specified in the build configuration.
+    Translates a gitignore-style pattern (without its "!" and trailing "/") to
+    a regular expression matching the paths it excludes, relative to the
+    source root. Patterns with a "/" (other than a trailing one) are anchored
+    to the source root, others match at any depth; "*" and "?" do not match
+    "/", and "**" matches any number of directories as a whole component.
+    '''
+    regex: list = [] if "/" in pattern else ["(?:.*/)?"]
+    if (pattern.startswith("/")):
+        pattern = pattern[1:]
+    i: int = 0
+    while (i < len(pattern)):
+        char: str = pattern[i]
+        if (pattern.startswith("**", i) and (i == 0 or pattern[i - 1] == "/")
+            and pattern[i + 2 : i + 3] in {"", "/"}):
+            if (i + 2 == len(pattern)):
+                regex.append(".*")
+                i += 2
+            else:
+                regex.append("(?:.*/)?")
+                i += 3
+            continue
+        if (char == "*"):
+            regex.append("[^/]*")
+        elif (char == "?"):
+            regex.append("[^/]")
+        elif (char == "[" and pattern.find("]", i + 2) != -1):
+            end: int = pattern.find("]", i + 2)
+            body: str = pattern[i + 1 : end].replace("\\", "\\\\")
+            if (body[0] in {"!", "^"}):
+                body = "^/" + body[1:]
+            regex.append("[" + body + "]")
+            i = end + 1
+            continue
+        elif (char == "\\" and i + 1 < len(pattern)):
+            regex.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        else:
+            regex.append(re.escape(char))
+        i += 1
+    return "".join(regex)
+
+
+def compile_excludes(patterns: list) -> list:
+    '''
+    Compiles the gitignore-style patterns of the [EXCLUDE] section once for
+    is_excluded(): blank lines and "#" comments are skipped, "!" negates a
+    pattern, and a trailing "/" restricts it to directories. Consecutive
+    patterns with the same flags are joined in a single regular expression,
+    and the resulting list of (regex, negated, dironly) tuples is reversed,
+    so that the last matching pattern decides, like in gitignore. Sets errno
+    and errdesc and returns an empty tuple if a pattern is invalid.
+    '''
+    global errno, errdesc
+    groups: list = []
+    for pattern in patterns:
+        if (pattern.strip() == "" or pattern.startswith("#")):
+            continue
+        negated: bool = pattern.startswith("!")
+        if (negated):
+            pattern = pattern[1:]
+        while (pattern.endswith(" ") and not pattern.endswith("\\ ")):
+            pattern = pattern[:-1]
+        dironly: bool = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        if (pattern == ""):
+            continue
+        if (groups != [] and groups[-1][1:] == (negated, dironly)):
+            groups[-1][0].append(exclude_regex(pattern))
+        else:
+            groups.append(([exclude_regex(pattern)], negated, dironly))
+    try:
+        return [(re.compile("|".join(f"(?:{regex})" for regex in regexes)),
+                 negated, dironly)
+                for regexes, negated, dironly in reversed(groups)]
+    except re.error as error:
+        errno = ERR_BAD_CONFIG
+        errdesc = f"Invalid exclude pattern: {error}"
+        return ()
+
+
+def is_excluded(exclude: list, path: str, isdir: bool,
+                parents: bool = False) -> bool:
+    '''
+    Returns whether the path (relative to the source root, with "/"
+    separators) is excluded by the compiled patterns exclude (see
+    compile_excludes()). With parents, the path is also excluded if one of
+    its parent directories is; walks check their directories before
+    descending into them instead.
+    '''
+    if (exclude == []):
+        return False
+    if (parents):
+        parts: list = path.split("/")
+        for i in range(1, len(parts)):
+            if (is_excluded(exclude, "/".join(parts[:i]), True)):
+                return True
+    for regex, negated, dironly in exclude:
+        if ((isdir or not dironly) and regex.fullmatch(path)):
+            return not negated
+    return False
+
+
+def parse_manifest(text: str) -> list:
+    '''
+    Parses the [MANIFEST] section of a build config (see mk_manifest()), and
+    returns its entries as a list of dictionaries with the "type" ("d" or
+    "f"), "mode", "size", "mtime" (in nanoseconds), "hash" ("<algo>:<hex>",
+    or empty) and "path" (relative to the source root) keys. Malformed lines
+    are skipped.
+    '''
+    entries: list = []
+    for line in text.splitlines():
+        fields: list = line.split(" ", 5)
+        if (len(fields) != 6 or fields[0] not in {"d", "f"}):
+            continue
+        try:
+            entries.append({
+                "type"  : fields[0],
+                "mode"  : int(fields[1], 8),
+                "size"  : int(fields[2]),
+                "mtime" : int(fields[3]),
+                "hash"  : "" if fields[4] == "-" else fields[4],
+                "path"  : fields[5]
+            })
+        except ValueError:
+            continue
+    return entries
+
+
+def parse_compression(spec: str) -> dict:
+    '''
+    Parses a compression setting of the form <type>[:<level>] (see
+    COMPRESSION_TYPES) into a dictionary with the "type" and "level" keys.
+    Sets errno and errdesc and returns an empty dictionary if the type or the
+    level is not supported.
+    '''
+    global errno, errdesc
+    ctype, _, level = spec.strip().partition(":")
+    if (ctype not in COMPRESSION_TYPES):
+        errno = ERR_BAD_COMPRESSION
+        errdesc = f"Unsupported compression type \"{ctype}\". Supported " \
+            f"types are: {list(COMPRESSION_TYPES)}."
+        return {}
+    levels: range = COMPRESSION_TYPES[ctype][1]
+    if (level == ""):
+        level = str(COMPRESSION_TYPES[ctype][2])
+    if (not level.isdigit() or int(level) not in levels):
+        errno = ERR_BAD_COMPRESSION
+        errdesc = f"Unsupported {ctype} compression level \"{level}\"."
+        return {}
+    return {"type" : ctype, "level" : int(level)}
+
+
+def resolve_manifest(buildcfg: dict) -> dict:
+    '''
+    Matches the manifest of the build configuration against the sources, and
+    returns its entries as a dictionary mapping the name of every source it
+    covers to the entries under it, in archive order, with their "src" path.
+    Each entry is checked with a single stat() call, and takes the current
+    mode, size and mtime of its file; the hash of a file whose size or mtime
+    changed since the manifest was generated is dropped. Sets errno and errdesc
+    and returns an empty tuple if a listed file is missing or changed type.
+    Sources embedded in a packed build config (see getcfg_packed()) are
+    returned as they are, with their "data" in place of a "src" path.
+    '''
+    global errno, errdesc
+    roots: dict = {os.path.basename(src) : src for src in buildcfg["sources"]}
+    manifest: dict = {name : entries for name, entries in
+                      buildcfg["embedded"].items() if name in roots}
+    for entry in buildcfg["manifest"]:
+        name, _, subpath = entry["path"].partition("/")
+        if (name not in roots or name in buildcfg["embedded"]):
+            continue
+        src: str = roots[name] + ("/" + subpath if subpath != "" else "")
+        try:
+            st: os.stat_result = os.stat(src)
+        except OSError:
+            errno = ERR_FILE_NOT_FOUND
+            errdesc = f"Source \"{src}\" listed in the manifest not found."
+            return ()
+        isdir: bool = stat.S_ISDIR(st.st_mode)
+        if (isdir != (entry["type"] == "d")):
+            errno = ERR_BAD_MANIFEST
+            errdesc = f"Source \"{src}\" does not match the manifest; " \
+                "regenerate the build config."
+            return ()
+        size: int = 0 if isdir else st.st_size
+        changed: bool = (size, st.st_mtime_ns) != (entry["size"],
+                                                   entry["mtime"])
+        manifest.setdefault(name, []).append(dict(entry,
+            src = src,
+            mode = stat.S_IMODE(st.st_mode),
+            size = size,
+            mtime = st.st_mtime_ns,
+            hash = "" if changed else entry["hash"]
+        ))
+    return manifest
+
+
+def get_buildmeta(buildcfg: dict, outdir: str,
+                  options: dict = None) -> dict:
     '''
+    Parses the control text of the build configuration once, and returns the
+    package metadata along with every path the build stages need, relative to
+    outdir:
+      - "fields"  : the control fields (see parse_control()).
+      - "options" : the build options, a copy of BUILD_OPTIONS if None.
+      - "compression" : the payload compression (see parse_compression()),
+                    from the options, else the build configuration.
+      - "package", "version", "pkgmgr", "outdir".
+      - "rootdir" : root directory of the build tree.
+      - "debdir"  : directory of the package with -s/--use-debstdname.
+      - "usrdir"  : USR_DIR of the package manager, relative to rootdir.
+      - "bindir", "libdir", "docdir", "man1dir" : the directories of the
+                    wrapper script, sources, copyright and man page, relative
+                    to rootdir.
+      - "manifest" : the manifest entries of the sources, checked against the
+                    file system (see resolve_manifest()).
+      - "sumcache" : the sums of the files staged in the build tree, filled in
+                    as they are written (see cache_sums()).
+      - "exclude" : the compiled exclude patterns of the sources (see
+                    compile_excludes()).
+    Sets errno and errdesc and returns an empty dictionary if an unsupported
+    package manager is specified, the package name or version is missing, or
+    the manifest does not match the sources.
+    '''
+    if (options is None):
+        options = BUILD_OPTIONS.copy()
     global errno, errdesc
     pkgmgr: str = buildcfg["pkgmgr"]
     if (pkgmgr not in SUPPORTED_PACKAGE_MANAGERS):
         errno = ERR_UNSUPPORTED_PACKAGE_MANAGER
         errdesc = f"Unsupported package manager \"{pkgmgr}\"."
-        return ""
-    package: str = get_package_name(buildcfg["control"])
-    version: str = get_version(buildcfg["control"])
+        return {}
+    compression: dict = parse_compression(
+        options["compression"] or buildcfg["compression"] or
+        DEFAULT_COMPRESSION
+    )
+    if (compression == {}):
+        return {}
+    compression["threads"] = options["compress-threads"]
+    fields: dict = parse_control(buildcfg["control"])
+    package: str = get_package_name(buildcfg["control"], fields)
+    version: str = get_version(buildcfg["control"], fields)
     if ("" in (package, version)):
-        return ""
+        return {}
+    manifest: dict = resolve_manifest(buildcfg)
+    if (manifest == ()):
+        return {}
+    exclude: list = compile_excludes(buildcfg["exclude"])
+    if (exclude == ()):
+        return {}
     dist: str = buildcfg["dist"]
     comp: str = buildcfg["comp"]
-    rootdir: str = os.path.join(
-                        outdir, f"{package}_{version}_all.{pkgmgr}.{dist}.{comp}")
-    return rootdir
+    usrdir: str = USR_DIR[pkgmgr]
+    return {
+        "fields"  : fields,
+        "options" : options,
+        "compression" : compression,
+        "package" : package,
+        "version" : version,
+        "pkgmgr"  : pkgmgr,
+        "outdir"  : outdir,
+        "rootdir" : os.path.join(outdir,
+                        f"{package}_{version}_all.{pkgmgr}.{dist}.{comp}"),
+        "debdir"  : os.path.join(outdir, f"{pkgmgr}.{dist}.{comp}"),
+        "usrdir"  : usrdir,
+        "bindir"  : usrdir + "/bin",
+        "libdir"  : usrdir + "/lib/" + package,
+        "docdir"  : usrdir + "/share/doc/" + package,
+        "man1dir" : usrdir + "/share/man/man1",
+        "manifest" : manifest,
+        "sumcache" : {},
+        "exclude" : exclude
+    }
+
 
+def get_rootdir(buildcfg: dict, outdir: str) -> str:
+    '''
+    Get the root directory of the build tree. Sets errno and errdesc if an
+    unsupported package manager is specified in the build configuration.
+    '''
+    meta: dict = get_buildmeta(buildcfg, outdir)
+    return meta["rootdir"] if meta != {} else ""
 
-def get_usrdir(buildcfg: str, outdir: str) -> str:
-    rootdir: str = get_rootdir(buildcfg, outdir)
-    if (rootdir == ""):
+
+def get_usrdir(buildcfg: dict, outdir: str) -> str:
+    meta: dict = get_buildmeta(buildcfg, outdir)
+    if (meta == {}):
         return ""
-    pkgmgr: str = buildcfg["pkgmgr"]
-    usrdir: str = os.path.join(rootdir, USR_DIR[pkgmgr])
-    return usrdir
+    return os.path.join(meta["rootdir"], meta["usrdir"])
 
 
-def mk_buildtree(buildcfg: dict, outdir: str) -> int:
+def mk_buildtree(buildcfg: dict, meta: dict) -> int:
     '''
-    Creates the build tree for the building the package. Returns -1 if the root
-    directory is empty (an error in call to get_rootdir()).
+    Creates the build tree for the building the package, at the paths given by
+    the build metadata (see get_buildmeta()).
     '''
-    rootdir: str = get_rootdir(buildcfg, outdir)
-    if (rootdir == ""):
-        return -1
-    usrdir: str = get_usrdir(buildcfg, outdir)
-    package: str = get_package_name(buildcfg["control"])
+    rootdir: str = meta["rootdir"]
     os.makedirs(os.path.join(rootdir, "DEBIAN"), 0o755, True)
-    os.makedirs(os.path.join(usrdir, "bin"), 0o755, True)
-    if (buildcfg["sources"] != ""):
-        os.makedirs(os.path.join(usrdir, "lib", package), 0o755, True)
+    os.makedirs(os.path.join(rootdir, meta["bindir"]), 0o755, True)
+    if (buildcfg["sources"] != []):
+        os.makedirs(os.path.join(rootdir, meta["libdir"]), 0o755, True)
     if (buildcfg["copyright"] != ""):
-        os.makedirs(os.path.join(
-                        usrdir, "share", "doc", package), 0o755, True)
+        os.makedirs(os.path.join(rootdir, meta["docdir"]), 0o755, True)
     if (buildcfg["man"] != ""):
-        os.makedirs(os.path.join(
-                        usrdir, "share", "man", "man1"), 0o755, True)
+        os.makedirs(os.path.join(rootdir, meta["man1dir"]), 0o755, True)
     return 0
 
 
-def mk_control(buildcfg: dict, outdir: str) -> int:
+def mk_control(buildcfg: dict, meta: dict) -> int:
     '''
     Creates the control file, assuming the "DEBIAN" directory to be present in
-    the root directory. Returns -1 if the root directory is empty (an error in
-    call to get_rootdir()).
+    the root directory. With a manifest, the Installed-Size field is computed
+    from the staged tree (see get_control_text()), so the payload must be
+    staged first.
     '''
-    rootdir: str = get_rootdir(buildcfg, outdir)
-    if (rootdir == ""):
-        return -1
-    with open(os.path.join(rootdir, "DEBIAN", "control"), 'w') as control:
-        control.write(buildcfg["control"])
+    text: str = buildcfg["control"]
+    if (meta["manifest"] != {}):
+        text = get_control_text(buildcfg, meta,
+                                plan_tree(meta["rootdir"])[1])
+    controlfile: str = os.path.join(meta["rootdir"], "DEBIAN", "control")
+    with open(controlfile, 'w') as control:
+        control.write(text)
+    count_files(1)
     return 0
 
 
-def mk_copyright(buildcfg: dict, outdir: str) -> int:
+def mk_copyright(buildcfg: dict, meta: dict) -> int:
     '''
     Creates the copyright file, assuming the parent directories to be present in
-    the root directory. Returns -1 if the root directory is empty (an error in
-    call to get_rootdir()).
+    the root directory.
     '''
-    usrdir: str = get_usrdir(buildcfg, outdir)
-    if (usrdir == ""):
-        return -1
-    docdir: str = os.path.join(usrdir, "share", "doc")
-    package: str = get_package_name(buildcfg["control"])
+    docdir: str = os.path.join(meta["rootdir"], meta["docdir"])
 
-    if (not os.path.isdir(os.path.join(docdir, package))):
+    if (not os.path.isdir(docdir)):
         return 0
 
-    copyrightfile: str = os.path.join(docdir, package, "copyright")
-    with open(copyrightfile, 'w') as copyright:
-        copyright.write(buildcfg["copyright"])
+    copyrightfile: str = os.path.join(docdir, "copyright")
+    data: bytes = buildcfg["copyright"].encode()
+    with open(copyrightfile, "wb") as copyright:
+        copyright.write(data)
+    cache_sums(meta, copyrightfile, data)
+    count_files(1)
     return 0
 
 
-def mk_shwrapper(buildcfg: dict, outdir: str) -> int:
+def mk_shwrapper(buildcfg: dict, meta: dict) -> int:
     '''
     Creates the wrapper shellscript, assuming the parent directories to be present in
-    the root directory. Returns -1 if the root directory is empty (an error in
-    call to get_rootdir()).
+    the root directory.
     '''
-    usrdir: str = get_usrdir(buildcfg, outdir)
-    if (usrdir == ""):
-        return -1
-    bindir: str = os.path.join(usrdir, "bin")
-    package: str = get_package_name(buildcfg["control"])
-    with open(os.path.join(bindir, package), 'w') as shellscript:
-        shellscript.write(buildcfg["shellscript"])
-    os.chmod(os.path.join(bindir, package), 0o755)
+    shwrapper: str = os.path.join(meta["rootdir"], meta["bindir"],
+                                  meta["package"])
+    data: bytes = buildcfg["shellscript"].encode()
+    with open(shwrapper, "wb") as shellscript:
+        shellscript.write(data)
+    os.chmod(shwrapper, 0o755)
+    cache_sums(meta, shwrapper, data)
+    count_files(1)
     return 0
 
 
-def mk_man(buildcfg: dict, outdir: str) -> int:
+def mk_man(buildcfg: dict, meta: dict) -> int:
     '''
     Creates the man file and gzips it, assuming the parent directories to be present
-    in the root directory. Returns -1 if the root directory is empty (an error in
-    call to get_rootdir()).
+    in the root directory.
     '''
-    usrdir: str = get_usrdir(buildcfg, outdir)
-    if (usrdir == ""):
-        return -1
-    man1dir: str = os.path.join(usrdir, "share", "man", "man1")
+    man1dir: str = os.path.join(meta["rootdir"], meta["man1dir"])
 
     if (not os.path.isdir(man1dir)):
         return 0
 
-    package: str = get_package_name(buildcfg["control"])
+    package: str = meta["package"]
 
     gzman1file: str = os.path.join(man1dir, f"{package}.1") + ".gz"
+    data: bytes = gzip_man(buildcfg["man"], package,
+                           get_man_level(meta["compression"]))
+    with open(gzman1file, "wb") as gzman1:
+        gzman1.write(data)
+    cache_sums(meta, gzman1file, data)
+    count_files(1)
+    return 0
+
+
+def get_man_level(compression: dict) -> int:
+    '''
+    Returns the gzip level of the man page for the payload compression: the
+    payload level if the payload is gzipped, 1 if it is not compressed (fast
+    builds), 9 otherwise.
+    '''
+    if (compression["type"] == "gzip"):
+        return compression["level"]
+    return 1 if compression["type"] == "none" else 9
+
+
+def gzip_man(man_text: str, package: str, level: int = 9) -> bytes:
+    '''
+    Returns the gzipped man page, as it would be put at
+    share/man/man1/<package>.1.gz.
+    '''
+    gzman1data = io.BytesIO()
     gzman1 = gzip.GzipFile(
-                filename = gzman1file,
+                filename = f"{package}.1",
                 mode = "wb",
-                compresslevel = 9,
+                compresslevel = level,
+                fileobj = gzman1data,
                 mtime = 0
             )
-    gzman1.write(buildcfg["man"].encode())
+    gzman1.write(man_text.encode())
     gzman1.close()
-    return 0
+    return gzman1data.getvalue()
+
+
+def reflink_file(src: str, dest: str) -> None:
+    '''
+    Creates dest as a copy-on-write clone of src (FICLONE ioctl), sharing its
+    data blocks. Raises OSError if the filesystem does not support it, or src
+    and dest are on different filesystems.
+    '''
+    with open(src, "rb") as srcfile, open(dest, "wb") as destfile:
+        try:
+            fcntl.ioctl(destfile.fileno(), FICLONE, srcfile.fileno())
+        except OSError:
+            destfile.close()
+            os.remove(dest)
+            raise
+    shutil.copystat(src, dest)
+
+
+def copy_file(src: str, dest: str, algos: tuple = ()) -> dict:
+    '''
+    Copies src to dest along with the metadata shutil.copy2() preserves. The
+    data is copied in the kernel with os.copy_file_range() where available,
+    otherwise with shutil.copyfile(), which uses os.sendfile() on Linux. With
+    algos, the data is copied through a buffer instead, and hashed on the way
+    with every hashlib algorithm in algos; returns the digests (in hex), an
+    empty dictionary without algos.
+    '''
+    if (algos != ()):
+        digests: dict = {algo : hashlib.new(algo) for algo in algos}
+        with open(src, "rb") as srcfile, open(dest, "wb") as destfile:
+            while (chunk := srcfile.read(COPY_BUFSIZE)):
+                for digest in digests.values():
+                    digest.update(chunk)
+                destfile.write(chunk)
+        shutil.copystat(src, dest)
+        return {algo : digest.hexdigest() for algo, digest in digests.items()}
+    copied: bool = False
+    if (hasattr(os, "copy_file_range")):
+        with open(src, "rb") as srcfile, open(dest, "wb") as destfile:
+            try:
+                remaining: int = os.fstat(srcfile.fileno()).st_size
+                while (remaining > 0):
+                    count: int = os.copy_file_range(
+                        srcfile.fileno(), destfile.fileno(), remaining)
+                    if (count == 0):
+                        break
+                    remaining -= count
+                copied = remaining == 0
+            except OSError:
+                pass
+    if (not copied):
+        shutil.copyfile(src, dest)
+    shutil.copystat(src, dest)
+    return {}
+
+
+def stage_file(src: str, dest: str, mode: str, meta: dict = None) -> str:
+    '''
+    Stages the file src at dest with the staging mode (see STAGE_MODES), and
+    returns the method that was actually used: "reflink", "hardlink" or
+    "copy". Link-based methods fall back to the next one when they are not
+    possible. An existing dest is unlinked first, so that a hardlink from a
+    previous build is never written through. Copies are hashed while being
+    written, and their sums cached in meta (see cache_sums()), if given.
 
+    Files are only hardlinked if they are owned by the building user: a
+    hardlink shares the owner of src, while a copy is owned by the building
+    user, and the package must not depend on the staging mode.
 
-def cp_sources(buildcfg: dict, outdir: str) -> int:
+    With a blob store (--blob-store) in the options of meta, files are linked
+    from the store instead (see store_file()), and "store" is returned; the
+    staging mode is only used when that is not possible.
+    '''
+    if (os.path.lexists(dest)):
+        os.remove(dest)
+    if (meta is not None and meta["options"]["blob-store"] != ""):
+        try:
+            if (store_file(src, dest, meta)):
+                return "store"
+        except OSError:
+            pass
+    if (mode in {"reflink", "auto"}):
+        try:
+            reflink_file(src, dest)
+            return "reflink"
+        except OSError:
+            pass
+    if (mode in {"hardlink", "auto"}):
+        st: os.stat_result = os.stat(src)
+        if (st.st_uid == os.geteuid() and st.st_gid == os.getegid()):
+            try:
+                os.link(src, dest)
+                return "hardlink"
+            except OSError:
+                pass
+    if (meta is None):
+        copy_file(src, dest)
+    else:
+        cache_sums(meta, dest, digests = copy_file(
+            src, dest, get_sum_algos(meta["options"])))
+    return "copy"
+
+
+def walk_sources(src: str, dest: str, files: list, dirs: list,
+                 exclude: list = [], name: str = "") -> None:
+    '''
+    Walks the source src (a file or a directory, followed if it is a symbolic
+    link, like shutil.copytree() does) with os.scandir(), creating the
+    directories of its staged copy at dest on the way. Appends the (src, dest)
+    pairs of the files to stage to files, and of the directories to dirs, in
+    top-down order. Paths excluded by exclude (see is_excluded()), with src
+    at name, are skipped, and excluded directories are not descended into.
+    '''
+    isdir: bool = os.path.isdir(src)
+    if (is_excluded(exclude, name, isdir)):
+        return
+    if (not isdir):
+        files.append((src, dest))
+        return
+    os.makedirs(dest, exist_ok = True)
+    dirs.append((src, dest))
+    with os.scandir(src) as it:
+        for child in it:
+            childdest: str = os.path.join(dest, child.name)
+            childname: str = name + "/" + child.name
+            if (child.is_dir()):
+                walk_sources(child.path, childdest, files, dirs, exclude,
+                             childname)
+            elif (not is_excluded(exclude, childname, False)):
+                files.append((child.path, childdest))
+
+
+def cp_sources(buildcfg: dict, meta: dict) -> int:
+    '''
+    Stages the sources in the build tree. Files are staged concurrently with
+    stage_file() over a pool of threads (--stage-jobs); the permissions and
+    times of directories are copied last, once their contents are in place.
+    Sources embedded in the build config are written out from it. The sums of
+    the files written are cached for mk_md5sums(). With a blob store, the
+    store is shared locked while staging, so that blob_gc() does not remove
+    blobs being linked, and its index is updated at the end.
+    '''
     sources: list = buildcfg["sources"]
     if (sources == []):
         return 0
-    usrdir: str = get_usrdir(buildcfg, outdir)
-    if (usrdir == ""):
-        return -1
-    package: str = get_package_name(buildcfg["control"])
-    destroot: str = os.path.join(usrdir, "lib", package)
-    rootdir: str = get_rootdir(buildcfg, outdir)
+    destroot: str = os.path.join(meta["rootdir"], meta["libdir"])
+    mode: str = meta["options"]["stage-mode"]
+    files: list = []
+    dirs: list = []
+    embedded: list = []
     for src in sources:
-        dest: str = os.path.join(destroot, os.path.basename(src))
-        if (os.path.isdir(src)):
-            shutil.copytree(src, dest, dirs_exist_ok = True)
+        name: str = os.path.basename(src)
+        if (name not in meta["manifest"]):
+            walk_sources(src, os.path.join(destroot, name), files, dirs,
+                         meta["exclude"], name)
+            continue
+        for entry in meta["manifest"][name]:
+            dest: str = os.path.join(destroot, entry["path"])
+            if (entry["src"] == ""):
+                embedded.append((entry, dest))
+            elif (entry["type"] == "d"):
+                os.makedirs(dest, exist_ok = True)
+                dirs.append((entry["src"], dest))
+            else:
+                files.append((entry["src"], dest))
+    write_embedded(embedded)
+    for entry, dest in embedded:
+        if (entry["type"] == "f"):
+            cache_sums(meta, dest, entry["data"])
+    jobs: int = meta["options"]["stage-jobs"] or \
+        min(32, (os.cpu_count() or 1) + 4)
+
+    def stage_files(batch: list) -> None:
+        for src, dest in batch:
+            stage_file(src, dest, mode, meta)
+
+    store: str = meta["options"]["blob-store"]
+    if (store != ""):
+        meta["blobindex"] = blob_read_index(store)
+    with (blob_lock(store, fcntl.LOCK_SH) if store != "" else
+          contextlib.nullcontext()):
+        if (jobs == 1 or len(files) < 2):
+            stage_files(files)
         else:
-            shutil.copy2(src, dest)
+            # Hand out the files in batches, a few per thread, rather than
+            # one future per file: with many small files, the bookkeeping of
+            # a future costs as much as staging the file itself.
+            batchsize: int = -(-len(files) // (jobs * 4))
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers = jobs) as pool:
+                for _ in pool.map(stage_files, [files[i : i + batchsize]
+                                  for i in range(0, len(files), batchsize)]):
+                    pass
+    if (store != ""):
+        blob_write_index(store, meta["blobindex"])
+    for src, dest in reversed(dirs):
+        shutil.copystat(src, dest)
+    count_files(len(files))
     return 0
 
 
-def parse_args_gencfg(args: list) -> dict:
-    if (args == [] or args[0] not in {"-g", "--generate-buildcfg"}):
-        return {}
-    compulsory_args: list = [
-        "pkgmgr",
-        "dist",
-        "comp",
-        "shellscript",
-        "control"
-    ]
-    optional_args: list = [
-        "srcroot",
-        "exclude",
-        "man",
-        "copyright",
-        "outfile"
-    ]
-    parsed_args: dict = {}
-    # Avoid KeyError if absent
-    for arg in (compulsory_args + optional_args):
-        if (arg == "exclude"):
-            parsed_args[arg] = []
-        else:
-            parsed_args[arg] = ""
-    i: int = 1
-    arg_count: int = len(args)
-    while (i < arg_count):
-        arg: str = args[i]
-        if (arg.startswith("--") and (i + 1 < arg_count)):
-            j: int = i + 1
-            arg = arg.lstrip("--")
-            if (arg == "exclude"):
-                while (j < arg_count and not args[j].startswith("--")):
-                    parsed_args[arg].append(args[j])
-                    j += 1
-            else:
-                if (args[j].startswith("--")): return {}
-                else: parsed_args[arg]= args[j]
-            i = j
+def write_embedded(entries: list) -> None:
+    '''
+    Writes out the (entry, dest) pairs of sources embedded in a packed build
+    config (see getcfg_packed()), in top-down order, with their modes and
+    times; the times of directories are set last.
+    '''
+    for entry, dest in entries:
+        if (entry["type"] == "d"):
+            os.makedirs(dest, exist_ok = True)
         else:
-            i += 1
-    for arg in compulsory_args:
-        if (parsed_args[arg] == ""):
-            return {}
-    for arg in parsed_args:
-        if (arg not in (compulsory_args + optional_args)):
-            return {}
-    return parsed_args
+            with open(dest, "wb") as file:
+                file.write(entry["data"])
+            count_files(1)
+        os.chmod(dest, entry["mode"])
+    for entry, dest in reversed(entries):
+        os.utime(dest, ns = (entry["mtime"], entry["mtime"]))
 
 
-def parse_args_build(args: list) -> list:
-    parsed_args: dict = {}
-
-    if (len(args) > 4):
-        return {}
+def mk_md5sums(buildcfg: dict, meta: dict) -> int:
+    '''
+    Creates DEBIAN/md5sums, and DEBIAN/sha256sums with --sha256sums, for the
+    files staged in the build tree, assuming every other stage to be done.
+    The files whose sums were cached in meta["sumcache"] as they were staged
+    are not read again (see sums_texts()).
+    '''
+    data_entries: list = plan_tree(meta["rootdir"])[1]
+    texts: dict = sums_texts(data_entries, get_sum_algos(meta["options"]),
+                             meta["sumcache"])
+    for algo, text in texts.items():
+        sumsfile: str = os.path.join(meta["rootdir"], "DEBIAN", SUMS_FILES[algo])
+        with open(sumsfile, 'w') as sums:
+            sums.write(text)
+    count_files(len(texts))
+    return 0
+
+
+def compile_source(src, dfile: str) -> bytes:
+    '''
+    Returns the contents of the .pyc file of the Python source src (a file
+    path, or the source itself as bytes), with checked-hash invalidation (see
+    PEP 552): the bytecode is validated against a hash of the source rather
+    than its mtime, so it is reproducible. dfile is the file name recorded in
+    the code objects. Returns empty bytes if src does not compile.
+    '''
+    source: bytes = src
+    if (isinstance(src, str)):
+        with open(src, "rb") as srcfile:
+            source = srcfile.read()
+    try:
+        code = compile(source, dfile, "exec", dont_inherit = True)
+    except (SyntaxError, ValueError):
+        return b""
+    return importlib.util.MAGIC_NUMBER + struct.pack("<I", 0b11) + \
+        importlib.util.source_hash(source) + marshal.dumps(code)
+
+
+def compile_sources(pairs: list) -> list:
+    '''
+    Compiles the Python sources of the (src, dfile) pairs with compile_source()
+    over a pool of processes (one per CPU), and returns the contents of their
+    .pyc files, in order.
+    '''
+    jobs: int = min(os.cpu_count() or 1, len(pairs))
+    if (jobs <= 1):
+        return [compile_source(src, dfile) for src, dfile in pairs]
+    with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as pool:
+        return list(pool.map(compile_source, *zip(*pairs),
+                             chunksize = -(-len(pairs) // (jobs * 4))))
+
+
+def bytecode_name(name: str) -> str:
+    '''
+    Returns the path of the bytecode of the Python source at path name, in the
+    __pycache__ directory next to it.
+    '''
+    return importlib.util.cache_from_source(name, optimization = "")
+
+
+def mk_bytecode(buildcfg: dict, meta: dict) -> int:
+    '''
+    With --precompile, compiles the Python sources staged in the build tree
+    into their __pycache__ directories, like plan_bytecode() plans them. The
+    times of the directories the __pycache__ directories are created in are
+    kept.
+    '''
+    libroot: str = os.path.join(meta["rootdir"], meta["libdir"])
+    if (not meta["options"]["precompile"] or not os.path.isdir(libroot)):
+        return 0
+    usrroot: str = os.path.join(meta["rootdir"], meta["usrdir"])
+    paths: list = []
+    for dirpath, dirnames, filenames in os.walk(libroot):
+        dirnames.sort()
+        paths.extend(os.path.join(dirpath, filename)
+                     for filename in sorted(filenames)
+                     if filename.endswith(".py"))
+    codes: list = compile_sources([(path, os.path.relpath(path, usrroot))
+                                   for path in paths])
+    mtime: int = get_build_mtime()
+    cachedirs: dict = {}
+    for path, code in zip(paths, codes):
+        if (code == b""):
+            continue
+        pycpath: str = bytecode_name(path)
+        cachedir: str = os.path.dirname(pycpath)
+        if (cachedir in cachedirs):
+            pass
+        elif (os.path.isdir(cachedir)):
+            cachedirs[cachedir] = int(os.stat(cachedir).st_mtime)
+        else:
+            parent: os.stat_result = os.stat(os.path.dirname(cachedir))
+            os.mkdir(cachedir)
+            os.chmod(cachedir, 0o755)
+            os.utime(os.path.dirname(cachedir),
+                     ns = (parent.st_atime_ns, parent.st_mtime_ns))
+            cachedirs[cachedir] = 0
+        if (os.path.lexists(pycpath)):
+            # Never write through a hardlink or reflink to the sources.
+            os.remove(pycpath)
+        with open(pycpath, "wb") as pycfile:
+            pycfile.write(code)
+        os.chmod(pycpath, 0o644)
+        pycmtime: int = min(int(os.stat(path).st_mtime), mtime)
+        os.utime(pycpath, (pycmtime, pycmtime))
+        cache_sums(meta, pycpath, code)
+        cachedirs[cachedir] = max(cachedirs[cachedir], pycmtime)
+    for cachedir, dirmtime in cachedirs.items():
+        os.utime(cachedir, (dirmtime, dirmtime))
+    count_files(len(codes))
+    return 0
+
+
+def postrm_text(meta: dict) -> str:
+    '''
+    Returns the postrm script of a package built with --precompile: on removal,
+    it deletes the __pycache__ directories left under the lib directory of
+    the package (e.g., bytecode written at run time by another version of
+    Python), and the directories left empty. The script is run by the sh of
+    the package manager: /bin/sh for apt, <USR_DIR>/bin/sh elsewhere (e.g.,
+    Termux has no /bin).
+    '''
+    libdir: str = "/" + meta["libdir"]
+    shell: str = "/bin/sh" if meta["usrdir"] == USR_DIR["apt"] \
+        else f"/{meta['usrdir']}/bin/sh"
+    return (
+        f"#!{shell}\n"
+        "set -e\n"
+        "if [ \"$1\" = \"remove\" ] || [ \"$1\" = \"purge\" ]; then\n"
+        f"    if [ -d \"{libdir}\" ]; then\n"
+        f"        find \"{libdir}\" -depth -type d -name __pycache__ "
+        "-exec rm -rf {} +\n"
+        f"        find \"{libdir}\" -depth -type d -empty -delete\n"
+        "    fi\n"
+        "fi\n"
+    )
+
+
+def mk_postrm(buildcfg: dict, meta: dict) -> int:
+    '''
+    With --precompile, creates the postrm script (see postrm_text()), assuming
+    the "DEBIAN" directory to be present in the root directory.
+    '''
+    if (not meta["options"]["precompile"]):
+        return 0
+    postrmfile: str = os.path.join(meta["rootdir"], "DEBIAN", "postrm")
+    with open(postrmfile, 'w') as postrm:
+        postrm.write(postrm_text(meta))
+    os.chmod(postrmfile, 0o755)
+    count_files(1)
+    return 0
+
+
+def get_build_mtime() -> int:
+    '''
+    Returns the modification time to be recorded for files generated by spal
+    itself (control, wrapper script, man page, etc.). Honours
+    SOURCE_DATE_EPOCH for reproducible builds.
+    '''
+    epoch: str = os.environ.get("SOURCE_DATE_EPOCH", "")
+    if (epoch.isdigit()):
+        return int(epoch)
+    return int(time.time())
+
+
+def hash_file(path: str, algos: tuple = tuple(REPO_HASHES.values())) -> dict:
+    '''
+    Returns the digests (in hex) of the file at path for every hashlib
+    algorithm in algos, computed together in a single buffered pass over the
+    file.
+    '''
+    digests: dict = {algo : hashlib.new(algo) for algo in algos}
+    with open(path, "rb") as file:
+        while (chunk := file.read(COPY_BUFSIZE)):
+            for digest in digests.values():
+                digest.update(chunk)
+    return {algo : digest.hexdigest() for algo, digest in digests.items()}
+
+
+def hash_files(paths: list, algos: tuple = tuple(REPO_HASHES.values()),
+               jobs: int = 0) -> dict:
+    '''
+    Returns the digests of many files (see hash_file()) as a dictionary keyed
+    by path. Files are hashed concurrently over a pool of jobs threads (the
+    number of CPUs by default); hashlib releases the GIL while hashing, so
+    this scales with the number of cores and overlaps the reads.
+    '''
+    paths = list(dict.fromkeys(paths))
+    if (len(paths) <= 1):
+        return {path : hash_file(path, algos) for path in paths}
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers = min(jobs or os.cpu_count() or 1, len(paths))
+        ) as pool:
+        return dict(zip(paths, pool.map(
+            lambda path: hash_file(path, algos), paths)))
+
+
+def get_sum_algos(options: dict) -> tuple:
+    '''
+    Returns the hashlib algorithms of the sums files of the package (see
+    SUMS_FILES) for the build options.
+    '''
+    return ("md5", "sha256") if options["sha256sums"] else ("md5",)
+
+
+def cache_sums(meta: dict, path: str, data: bytes = None,
+               digests: dict = None) -> None:
+    '''
+    Caches the sums of the file just written to the build tree at path in
+    meta["sumcache"], keyed by path and validated by size, modification time
+    and inode number (see sums_texts()). The sums are computed from data, the
+    contents of the file, unless its digests (in hex) are given.
+    '''
+    if (digests is None):
+        digests = {algo : hashlib.new(algo, data).hexdigest()
+                   for algo in get_sum_algos(meta["options"])}
+    st: os.stat_result = os.stat(path)
+    meta["sumcache"][path] = (st.st_size, st.st_mtime_ns, st.st_ino, digests)
+
+
+def sums_texts(data_entries: list, algos: tuple = ("md5",),
+               cache: dict = None) -> dict:
+    '''
+    Returns the contents of the sums files (see SUMS_FILES) for the data
+    archive entries, keyed by hashlib algorithm: the sum and path of every
+    regular file, in archive order. Entries carrying their sums (under the
+    algorithm names, e.g. from the manifest or from tar_write_row()) and
+    entries with data are not read; other files are hashed with hash_files(),
+    unless a cache dictionary is given and holds their sums (see cache_sums()),
+    in which case the sums computed are added to it.
+    '''
+    files: list = [entry for entry in data_entries
+                   if entry["type"] == tarfile.REGTYPE]
+    stats: dict = {}
+    pending: list = []
+    for entry in files:
+        if (entry["data"] is not None or
+            all(algo in entry for algo in algos)):
+            continue
+        if (cache is not None):
+            st: os.stat_result = os.stat(entry["src"])
+            stats[entry["src"]] = (st.st_size, st.st_mtime_ns, st.st_ino)
+            cached: tuple = cache.get(entry["src"], ())
+            if (cached[:3] == stats[entry["src"]] and
+                all(algo in cached[3] for algo in algos)):
+                continue
+        pending.append(entry["src"])
+    digests: dict = hash_files(pending, algos)
+    if (cache is not None):
+        for path, digest in digests.items():
+            cache[path] = stats[path] + (digest,)
+    lines: dict = {algo : [] for algo in algos}
+    for entry in files:
+        for algo in algos:
+            if (algo in entry):
+                digest: str = entry[algo]
+            elif (entry["data"] is not None):
+                digest = hashlib.new(algo, entry["data"]).hexdigest()
+            elif (entry["src"] in digests):
+                digest = digests[entry["src"]][algo]
+            else:
+                digest = cache[entry["src"]][3][algo]
+            lines[algo].append(f"{digest}  {entry['name']}\n")
+    return {algo : "".join(lines[algo]) for algo in algos}
+
+
+def mk_entry(name: str, mode: int, mtime: int,
+             data: bytes = None, src: str = "", linkname: str = "") -> dict:
+    '''
+    Returns an archive entry for the .deb writer. An entry with neither data
+    nor src is a directory, unless linkname is given (a symbolic link). Entries
+    with src are streamed from the file at that path while being archived.
+    '''
+    entry: dict = {
+        "name"     : name,
+        "type"     : tarfile.DIRTYPE,
+        "mode"     : mode,
+        "mtime"    : mtime,
+        "data"     : data,
+        "src"      : src,
+        "linkname" : linkname
+    }
+    if (linkname != ""):
+        entry["type"] = tarfile.SYMTYPE
+    elif (data is not None or src != ""):
+        entry["type"] = tarfile.REGTYPE
+    return entry
+
+
+def plan_dirs(entries: list, path: str, mtime: int, seen: set) -> None:
+    '''
+    Appends directory entries for path and each of its parents to entries,
+    skipping the ones already present in seen.
+    '''
+    parts: list = path.split("/")
+    for i in range(1, len(parts) + 1):
+        dirname: str = "/".join(parts[:i])
+        if (dirname not in seen):
+            seen.add(dirname)
+            entries.append(mk_entry(dirname, 0o755, mtime))
+
+
+def plan_source(entries: list, src: str, name: str, exclude: list = [],
+                path: str = "") -> None:
+    '''
+    Appends entries for the source file or directory src, to be archived as
+    name. Symbolic links are followed, like shutil.copytree() and
+    shutil.copy2() do in cp_sources(). Paths excluded by exclude (see
+    is_excluded()), with src at path, are skipped without being descended
+    into.
+    '''
+    st: os.stat_result = os.stat(src)
+    if (is_excluded(exclude, path, stat.S_ISDIR(st.st_mode))):
+        return
+    if (not stat.S_ISDIR(st.st_mode)):
+        entries.append(mk_entry(name, stat.S_IMODE(st.st_mode),
+                                int(st.st_mtime), src = src))
+        return
+    entries.append(mk_entry(name, stat.S_IMODE(st.st_mode), int(st.st_mtime)))
+    with os.scandir(src) as it:
+        children: list = sorted(it, key = lambda child: child.name)
+    for child in children:
+        plan_source(entries, child.path, name + "/" + child.name, exclude,
+                    path + "/" + child.name)
+
+
+def plan_manifest(entries: list, manifest: list, libdir: str) -> None:
+    '''
+    Appends entries for the manifest entries of a source (see
+    resolve_manifest()) to entries, to be archived under libdir. Files carry
+    their "size", and their sum under the name of its algorithm (e.g. "md5")
+    if the manifest has an unchanged hash used by a sums file (see
+    SUMS_FILES).
+    The contents of embedded files are archived from their "data".
+    '''
+    for item in manifest:
+        name: str = libdir + "/" + item["path"]
+        mtime: int = item["mtime"] // 1000000000
+        if (item["type"] == "d"):
+            entries.append(mk_entry(name, item["mode"], mtime))
+            continue
+        entry: dict = mk_entry(name, item["mode"], mtime,
+                               data = item.get("data"), src = item["src"])
+        entry["size"] = item["size"]
+        algo, _, digest = item["hash"].partition(":")
+        if (algo in SUMS_FILES):
+            entry[algo] = digest
+        entries.append(entry)
+
+
+def installed_size(data_entries: list) -> int:
+    '''
+    Returns the Installed-Size (in KiB) of the data archive entries, the way
+    dpkg-gencontrol computes it: the size of every file rounded up to KiB, and
+    1 KiB for every directory and symbolic link.
+    '''
+    size: int = 0
+    for entry in data_entries:
+        if (entry["type"] != tarfile.REGTYPE):
+            size += 1
+        elif (entry["data"] is not None):
+            size += -(-len(entry["data"]) // 1024)
+        elif ("size" in entry):
+            size += -(-entry["size"] // 1024)
+        else:
+            size += -(-os.stat(entry["src"]).st_size // 1024)
+    return size
+
+
+def get_control_text(buildcfg: dict, meta: dict, data_entries: list) -> str:
+    '''
+    Returns the control text of the package. With a manifest, an
+    Installed-Size field computed from the data archive entries is added
+    after the Architecture field (or at the end), unless one is present.
+    '''
+    text: str = buildcfg["control"]
+    if (meta["manifest"] == {} or "Installed-Size" in meta["fields"]):
+        return text
+    field: str = f"Installed-Size: {installed_size(data_entries)}\n"
+    lines: list = text.splitlines(True)
+    for i, line in enumerate(lines):
+        if (line.startswith("Architecture:")):
+            lines.insert(i + 1, field if line.endswith("\n") else
+                         "\n" + field.rstrip("\n"))
+            return "".join(lines)
+    if (text != "" and not text.endswith("\n")):
+        text += "\n"
+    return text + field
+
+
+def plan_data(buildcfg: dict, meta: dict, mtime: int) -> list:
+    '''
+    Returns the data archive entries of the package described by the build
+    configuration and metadata (see get_buildmeta()), with generated files
+    dated mtime. Sources covered by the manifest are planned from it, without
+    walking them. Returns an empty tuple if a source is missing (errno and
+    errdesc are set accordingly).
+    '''
+    global errno, errdesc
+    package: str = meta["package"]
+    data_entries: list = [mk_entry(".", 0o755, mtime)]
+    seen: set = set()
+
+    plan_dirs(data_entries, meta["bindir"], mtime, seen)
+    data_entries.append(mk_entry(meta["bindir"] + "/" + package, 0o755, mtime,
+                                 data = buildcfg["shellscript"].encode()))
+
+    if (buildcfg["sources"] != []):
+        libdir: str = meta["libdir"]
+        plan_dirs(data_entries, libdir, mtime, seen)
+        for src in buildcfg["sources"]:
+            name: str = os.path.basename(src)
+            if (name in meta["manifest"]):
+                plan_manifest(data_entries, meta["manifest"][name], libdir)
+                continue
+            if (not os.path.exists(src)):
+                errno = ERR_FILE_NOT_FOUND
+                errdesc = f"Source \"{src}\" not found."
+                return ()
+            plan_source(data_entries, src, libdir + "/" + name,
+                        meta["exclude"], name)
+        if (meta["options"]["precompile"]):
+            plan_bytecode(data_entries, meta, mtime)
+
+    if (buildcfg["copyright"] != ""):
+        docdir: str = meta["docdir"]
+        plan_dirs(data_entries, docdir, mtime, seen)
+        data_entries.append(mk_entry(docdir + "/copyright", 0o644, mtime,
+                                     data = buildcfg["copyright"].encode()))
+
+    if (buildcfg["man"] != ""):
+        man1dir: str = meta["man1dir"]
+        plan_dirs(data_entries, man1dir, mtime, seen)
+        data_entries.append(mk_entry(man1dir + f"/{package}.1.gz", 0o644,
+                                     mtime,
+                                     data = gzip_man(buildcfg["man"], package,
+                                        get_man_level(meta["compression"]))))
+    return data_entries
+
+
+def plan_bytecode(entries: list, meta: dict, mtime: int) -> None:
+    '''
+    Appends the bytecode of the Python sources among entries (the files under
+    the lib directory ending in .py) to entries, compiled with
+    compile_sources() under their path relative to USR_DIR, which every
+    package manager shares. Each .pyc file goes to the __pycache__ directory
+    next to its source, dated like its source clamped to mtime; the directory
+    is dated like its newest .pyc file. Bytecode already planned from the
+    sources is replaced.
+    '''
+    prefix: str = meta["libdir"] + "/"
+    sources: list = [entry for entry in entries
+                     if entry["type"] == tarfile.REGTYPE and
+                        entry["name"].startswith(prefix) and
+                        entry["name"].endswith(".py")]
+    codes: list = compile_sources([
+        (entry["src"] or bytes(entry["data"]),
+         entry["name"][len(meta["usrdir"]) + 1 :])
+        for entry in sources
+    ])
+    index: dict = {entry["name"] : i for i, entry in enumerate(entries)}
+    for entry, code in zip(sources, codes):
+        if (code == b""):
+            continue
+        name: str = bytecode_name(entry["name"])
+        cachedir: str = os.path.dirname(name)
+        pycmtime: int = min(entry["mtime"], mtime)
+        if (cachedir not in index):
+            index[cachedir] = len(entries)
+            entries.append(mk_entry(cachedir, 0o755, 0))
+        dirs_entry: dict = entries[index[cachedir]]
+        dirs_entry["mtime"] = max(dirs_entry["mtime"], pycmtime)
+        pyc: dict = mk_entry(name, 0o644, pycmtime, data = code)
+        if (name in index):
+            entries[index[name]] = pyc
+        else:
+            index[name] = len(entries)
+            entries.append(pyc)
+
+
+def plan_control(buildcfg: dict, meta: dict, data_entries: list, mtime: int,
+                 cache: dict = None) -> list:
+    '''
+    Returns the control archive entries of the package for its data archive
+    entries, with cache passed on to sums_texts().
+    '''
+    text: str = get_control_text(buildcfg, meta, data_entries)
+    if (not text.endswith("\n")):
+        text += "\n"
+    texts: dict = sums_texts(data_entries, get_sum_algos(meta["options"]),
+                             cache)
+    control_entries: list = [
+        mk_entry(".", 0o755, mtime),
+        mk_entry("control", 0o644, mtime, data = text.encode()),
+        mk_entry("md5sums", 0o644, mtime, data = texts["md5"].encode())
+    ]
+    if (meta["options"]["precompile"]):
+        control_entries.append(mk_entry("postrm", 0o755, mtime,
+                               data = postrm_text(meta).encode()))
+    if ("sha256" in texts):
+        control_entries.append(mk_entry("sha256sums", 0o644, mtime,
+                               data = texts["sha256"].encode()))
+    return control_entries
+
+
+def plan_controls(buildcfg: dict, metas: list, rows: list,
+                  mtime: int) -> list:
+    '''
+    Returns the control archive entries of each target of plan_targets(), for
+    the rows of their data archive entries. Files are hashed once for all the
+    targets, unless the rows carry their sums already (see tar_write_row()).
+    '''
+    cache: dict = {}
+    controls: list = []
+    for i, meta in enumerate(metas):
+        data_entries: list = [row[i] for row in rows if row[i] is not None]
+        controls.append(plan_control(buildcfg, meta, data_entries, mtime,
+                                     cache))
+    return controls
+
+
+def plan_targets(buildcfg: dict, metas: list, mtime: int) -> list:
+    '''
+    Plans the data archives of the package for several targets at once: metas
+    holds the build metadata (see get_buildmeta()) of each, differing only in
+    the package manager, hence in USR_DIR. The data archive entries are
+    planned once, then moved under the USR_DIR of every target. Returns the
+    rows of their entries (see tar_write_row()), to be passed on to
+    plan_controls(), or an empty tuple if a source is missing (errno and
+    errdesc are set accordingly).
+    '''
+    planned: list = plan_data(buildcfg, metas[0], mtime)
+    if (planned == ()):
+        return ()
+    usrdir: str = metas[0]["usrdir"]
+    rows: list = [[planned[0]] * len(metas)]
+    for i, meta in enumerate(metas):
+        parents: list = []
+        if (os.path.dirname(meta["usrdir"]) != ""):
+            plan_dirs(parents, os.path.dirname(meta["usrdir"]), mtime, set())
+        for entry in parents:
+            rows.append([entry if j == i else None
+                         for j in range(len(metas))])
+    for entry in planned[1:]:
+        if (entry["name"] != usrdir and
+            not entry["name"].startswith(usrdir + "/")):
+            continue
+        rows.append([dict(entry, name = meta["usrdir"] +
+                          entry["name"][len(usrdir) :]) for meta in metas])
+    return rows
+
+
+def plan_tree(rootdir: str) -> tuple:
+    '''
+    Returns the control and data archive entries for an already staged build
+    tree (see mk_buildtree()), as a tuple of two lists. Files under
+    <rootdir>/DEBIAN go to the control archive, everything else to the data
+    archive.
+    '''
+    control_entries: list = []
+    data_entries: list = []
+
+    def walk(path: str, name: str, entries: list) -> None:
+        with os.scandir(path) as it:
+            children: list = sorted(it, key = lambda child: child.name)
+        for child in children:
+            childname: str = child.name if name == "." else \
+                name + "/" + child.name
+            if (entries is data_entries and childname == "DEBIAN"):
+                control_entries.append(mk_entry(".", 0o755,
+                    int(child.stat().st_mtime)))
+                walk(child.path, ".", control_entries)
+                continue
+            st: os.stat_result = child.stat(follow_symlinks = False)
+            mode: int = stat.S_IMODE(st.st_mode)
+            if (child.is_symlink()):
+                entries.append(mk_entry(childname, 0o777, int(st.st_mtime),
+                               linkname = os.readlink(child.path)))
+            elif (child.is_dir()):
+                entries.append(mk_entry(childname, mode, int(st.st_mtime)))
+                walk(child.path, childname, entries)
+            else:
+                entries.append(mk_entry(childname, mode, int(st.st_mtime),
+                                        src = child.path))
+
+    data_entries.append(mk_entry(".", 0o755,
+                                 int(os.stat(rootdir).st_mtime)))
+    walk(rootdir, ".", data_entries)
+    return (control_entries, data_entries)
+
+
+class _NullCompressor:
+    '''
+    Compressor object (see mk_compressor()) for uncompressed members.
+    '''
+    def compress(self, data: bytes) -> bytes:
+        return bytes(data)
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def mk_compressor(compression: dict):
+    '''
+    Returns a new compressor object, with compress() and flush() methods, for
+    the compression (see parse_compression()).
+    '''
+    ctype: str = compression["type"]
+    level: int = compression["level"]
+    if (ctype == "gzip"):
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if (ctype == "xz"):
+        return lzma.LZMACompressor(format = lzma.FORMAT_XZ, preset = level)
+    if (ctype == "zstd"):
+        return zstd.ZstdCompressor(level = level)
+    return _NullCompressor()
+
+
+def compress_block(compression: dict, data: bytes) -> bytes:
+    '''
+    Compresses data into a complete, self-contained gzip member, xz stream or
+    zstd frame.
+    '''
+    compressor = mk_compressor(compression)
+    return compressor.compress(data) + compressor.flush()
+
+
+class _CompressedWriter:
+    '''
+    Minimal write-only file object that compresses everything written to it
+    into the underlying file, keeping count of the bytes written to it (insize),
+    of the compressed bytes (size) and of the seconds spent compressing (busy).
+    '''
+    def __init__(self, fileobj, compressor) -> None:
+        self.fileobj = fileobj
+        self.compressor = compressor
+        self.insize: int = 0
+        self.size: int = 0
+        self.busy: float = 0.0
+
+    def write(self, data: bytes) -> None:
+        self.insize += len(data)
+        start: float = time.perf_counter()
+        out: bytes = self.compressor.compress(data)
+        self.busy += time.perf_counter() - start
+        if (out):
+            self.fileobj.write(out)
+            self.size += len(out)
+
+    def close(self) -> None:
+        start: float = time.perf_counter()
+        out: bytes = self.compressor.flush()
+        self.busy += time.perf_counter() - start
+        if (out):
+            self.fileobj.write(out)
+            self.size += len(out)
+
+
+def xz_varint(value: int) -> bytes:
+    out = bytearray()
+    while (value >= 0x80):
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def xz_split_stream(stream: bytes) -> tuple:
+    '''
+    Splits a complete single-stream .xz file into its stream header, its
+    blocks (as one bytes object), and the records of its index, a list of
+    (unpadded size, uncompressed size) tuples, one per block.
+    '''
+    backward_size: int = (int.from_bytes(stream[-8 : -4], "little") + 1) * 4
+    index: bytes = stream[-12 - backward_size : -12]
+    records: list = []
+    values: list = []
+    value: int = 0
+    shift: int = 0
+    pos: int = 1
+    count: int = -1
+    while (count == -1 or len(values) < 2 * count):
+        byte: int = index[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if (byte & 0x80):
+            continue
+        if (count == -1):
+            count = value
+        else:
+            values.append(value)
+        value = shift = 0
+    records = list(zip(values[0::2], values[1::2]))
+    return (stream[: 12], stream[12 : -12 - backward_size], records)
+
+
+def xz_index_and_footer(records: list, stream_flags: bytes) -> bytes:
+    '''
+    Returns the index and the stream footer of an .xz stream with the blocks
+    described by records (see xz_split_stream()).
+    '''
+    index = bytearray(b"\x00" + xz_varint(len(records)))
+    for unpadded, uncompressed in records:
+        index += xz_varint(unpadded) + xz_varint(uncompressed)
+    index += bytes(-len(index) % 4)
+    index += zlib.crc32(index).to_bytes(4, "little")
+    footer: bytes = (len(index) // 4 - 1).to_bytes(4, "little") + stream_flags
+    return bytes(index) + zlib.crc32(footer).to_bytes(4, "little") + \
+        footer + b"YZ"
+
+
+class _ParallelCompressedWriter:
+    '''
+    Write-only file object like _CompressedWriter, compressing on several
+    threads: the input is cut into blocks of COMPRESSION_BLOCKSIZE bytes,
+    compressed independently and written in order. At most two blocks per
+    thread are pending at any time.
+
+    zstd frames (see compress_block()) are simply concatenated, which zstd
+    reads back as a single stream. Neither Python's tarfile nor every dpkg
+    reads past the first of several gzip members or xz streams, so the
+    output is always a single one. As pigz does, gzip blocks are raw deflate
+    data ending on a sync flush, all but the last one unterminated, written
+    between one gzip header and one trailer, with the CRC-32 of the whole
+    input. As "xz --threads" does, the xz blocks are unpacked from their
+    streams and written as the blocks of a single stream, with a rebuilt
+    index. busy adds up the seconds spent compressing on every thread.
+    '''
+    def __init__(self, fileobj, compression: dict) -> None:
+        self.fileobj = fileobj
+        self.compression: dict = compression
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+                        max_workers = compression["threads"])
+        self.pending: list = []
+        self.buffer = bytearray()
+        self.insize: int = 0
+        self.size: int = 0
+        self.busy: float = 0.0
+        self.crc: int = 0
+        self.xz_flags: bytes = b""
+        self.xz_records: list = None
+
+    def compress(self, block: bytes, last: bool) -> tuple:
+        start: float = time.perf_counter()
+        out: bytes = b""
+        if (self.compression["type"] == "gzip"):
+            compressor = zlib.compressobj(self.compression["level"],
+                                          zlib.DEFLATED, -zlib.MAX_WBITS)
+            out = compressor.compress(block) + compressor.flush(
+                      zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+        else:
+            out = compress_block(self.compression, block)
+        return (out, time.perf_counter() - start)
+
+    def submit(self, block: bytes, last: bool = False) -> None:
+        if (self.compression["type"] == "gzip"):
+            self.crc = zlib.crc32(block, self.crc)
+        self.pending.append(self.pool.submit(self.compress, block, last))
+        while (len(self.pending) > 2 * self.compression["threads"]):
+            self.drain_one()
+
+    def drain_one(self) -> None:
+        out, busy = self.pending.pop(0).result()
+        self.busy += busy
+        if (self.compression["type"] == "xz"):
+            header, out, records = xz_split_stream(out)
+            if (self.xz_records is None):
+                out = header + out
+                self.xz_flags = header[6 : 8]
+                self.xz_records = []
+            self.xz_records += records
+        elif (self.compression["type"] == "gzip" and self.size == 0):
+            out = compress_block(self.compression, b"")[: 10] + out
+        self.fileobj.write(out)
+        self.size += len(out)
+
+    def write(self, data: bytes) -> None:
+        self.insize += len(data)
+        self.buffer += data
+        while (len(self.buffer) > COMPRESSION_BLOCKSIZE):
+            self.submit(bytes(self.buffer[: COMPRESSION_BLOCKSIZE]))
+            del self.buffer[: COMPRESSION_BLOCKSIZE]
+
+    def close(self) -> None:
+        self.submit(bytes(self.buffer), last = True)
+        self.buffer.clear()
+        while (self.pending != []):
+            self.drain_one()
+        self.pool.shutdown()
+        out: bytes = b""
+        if (self.xz_records is not None):
+            out = xz_index_and_footer(self.xz_records, self.xz_flags)
+        elif (self.compression["type"] == "gzip"):
+            out = self.crc.to_bytes(4, "little") + \
+                (self.insize & 0xffffffff).to_bytes(4, "little")
+        if (out):
+            self.fileobj.write(out)
+            self.size += len(out)
+
+
+def mk_compressed_writer(fileobj, compression: dict):
+    '''
+    Returns a write-only file object compressing into fileobj (see
+    _CompressedWriter), multi-threaded if the compression has more than one
+    thread and the type is not "none".
+    '''
+    if (compression.get("threads", 1) > 1 and compression["type"] != "none"):
+        return _ParallelCompressedWriter(fileobj, compression)
+    return _CompressedWriter(fileobj, mk_compressor(compression))
+
+
+class _QueueWriter:
+    '''
+    Write-only file object handing what is written to it over to write(),
+    called on a thread of its own: writes are gathered into chunks of
+    COPY_BUFSIZE bytes and passed through a queue of at most PIPELINE_DEPTH
+    chunks, so the writing thread only waits when the other one falls that
+    far behind. Keeps count of the bytes written to it (insize). An error
+    raised by write() is raised again by the next write() or by close().
+    '''
+    def __init__(self, write) -> None:
+        self.queue = queue.Queue(PIPELINE_DEPTH)
+        self.buffer = bytearray()
+        self.insize: int = 0
+        self.error: Exception = None
+        self.thread = threading.Thread(target = self.run, args = (write,),
+                                       daemon = True)
+        self.thread.start()
+
+    def run(self, write) -> None:
+        while ((chunk := self.queue.get()) is not None):
+            if (self.error is None):
+                try:
+                    write(chunk)
+                except Exception as error:
+                    self.error = error
+
+    def check(self) -> None:
+        if (self.error is not None):
+            raise self.error
+
+    def write(self, data: bytes) -> None:
+        self.check()
+        self.insize += len(data)
+        self.buffer += data
+        if (len(self.buffer) >= COPY_BUFSIZE):
+            self.queue.put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def close(self) -> None:
+        if (self.thread is None):
+            return
+        if (self.buffer):
+            self.queue.put(bytes(self.buffer))
+            self.buffer.clear()
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.check()
+
+
+def read_rows(rows: list):
+    '''
+    Generator yielding (row, contents) for the rows of entries (see
+    tar_write_row()), with the files read ahead on a thread of its own:
+    contents is (size, chunks) for the files read from their source, chunks
+    being an iterator over their contents in chunks of at most COPY_BUFSIZE
+    bytes, which must be exhausted before the next row, and None otherwise.
+    Rows are passed in batches of up to COPY_BUFSIZE bytes of contents, so
+    small files do not cost a handover between threads each, and at most
+    PIPELINE_DEPTH batches or chunks are read ahead, so memory stays bounded
+    whatever the size of the files. Files that shrink while being read are
+    padded with zeros to the size they had when opened.
+    '''
+    pipe = queue.Queue(PIPELINE_DEPTH)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while (not stop.is_set()):
+            try:
+                pipe.put(item, timeout = PIPELINE_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read() -> None:
+        batch: list = []
+        batchsize: int = 0
+        try:
+            for row in rows:
+                entry: dict = next(entry for entry in row if entry is not None)
+                if (entry["type"] != tarfile.REGTYPE or
+                    entry["data"] is not None):
+                    batch.append((row, None, b""))
+                    continue
+                with open(entry["src"], "rb") as srcfile:
+                    size: int = os.fstat(srcfile.fileno()).st_size
+                    chunk: bytes = srcfile.read(min(COPY_BUFSIZE, size)) or \
+                        bytes(min(COPY_BUFSIZE, size))
+                    batch.append((row, size, chunk))
+                    batchsize += len(chunk)
+                    remaining: int = size - len(chunk)
+                    if (batchsize < COPY_BUFSIZE and remaining == 0):
+                        continue
+                    if (not put(batch)):
+                        return
+                    batch = []
+                    batchsize = 0
+                    while (remaining > 0):
+                        chunk = srcfile.read(min(COPY_BUFSIZE, remaining)) or \
+                            bytes(min(COPY_BUFSIZE, remaining))
+                        if (not put(chunk)):
+                            return
+                        remaining -= len(chunk)
+        except OSError as error:
+            put(error)
+            return
+        if (batch == [] or put(batch)):
+            put(None)
+
+    def get():
+        item = pipe.get()
+        if (isinstance(item, OSError)):
+            raise item
+        return item
+
+    def chunks(size: int, chunk: bytes):
+        remaining: int = size - len(chunk)
+        yield chunk
+        while (remaining > 0):
+            chunk = get()
+            remaining -= len(chunk)
+            yield chunk
+
+    thread = threading.Thread(target = read, daemon = True)
+    thread.start()
+    try:
+        while ((batch := get()) is not None):
+            for row, size, chunk in batch:
+                yield (row, None if size is None else
+                       (size, chunks(size, chunk)))
+    finally:
+        stop.set()
+        thread.join()
+
+
+def tar_header(entry: dict, size: int = 0) -> bytes:
+    '''
+    Returns the GNU tar header of an entry (see mk_entry()) of size bytes.
+    '''
+    tarinfo = tarfile.TarInfo("./" if entry["name"] == "." else
+                              "./" + entry["name"])
+    tarinfo.type = entry["type"]
+    tarinfo.mode = entry["mode"]
+    tarinfo.mtime = entry["mtime"]
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = "root"
+    tarinfo.linkname = entry["linkname"]
+    tarinfo.size = size
+    return tarinfo.tobuf(tarfile.GNU_FORMAT, "utf-8", "surrogateescape")
+
+
+def tar_write_row(tarstreams: list, row: list, algos: tuple = (),
+                  contents: tuple = None) -> None:
+    '''
+    Writes a row of entries to uncompressed tar streams: row holds one entry
+    (see mk_entry()) per stream, or None to skip that stream. The entries of a
+    row differ only in name, so file contents are read once and written to
+    every stream, in chunks of COPY_BUFSIZE bytes; the size recorded in the
+    headers is the size of the file when it is opened. The contents are
+    hashed on the way with every hashlib algorithm in algos the entry has no
+    sum for yet, and the sums (in hex) are stored in the entries under the
+    names of the algorithms, for sums_texts(). contents, if given, is the
+    (size, chunks) of the file already being read (see read_rows()).
+    '''
+    targets: list = [(tarstream, entry) for tarstream, entry in
+                     zip(tarstreams, row) if entry is not None]
+    entry: dict = targets[0][1]
+    if (entry["type"] != tarfile.REGTYPE):
+        for tarstream, target in targets:
+            tarstream.write(tar_header(target))
+        return
+
+    digests: dict = {algo : hashlib.new(algo) for algo in algos
+                     if algo not in entry}
+    if (entry["data"] is not None):
+        size: int = len(entry["data"])
+        for digest in digests.values():
+            digest.update(entry["data"])
+        for tarstream, target in targets:
+            tarstream.write(tar_header(target, size))
+            tarstream.write(entry["data"])
+    elif (contents is not None):
+        size, chunks = contents
+        for tarstream, target in targets:
+            tarstream.write(tar_header(target, size))
+        for chunk in chunks:
+            for digest in digests.values():
+                digest.update(chunk)
+            for tarstream, _ in targets:
+                tarstream.write(chunk)
+    else:
+        with open(entry["src"], "rb") as srcfile:
+            size = os.fstat(srcfile.fileno()).st_size
+            for tarstream, target in targets:
+                tarstream.write(tar_header(target, size))
+            remaining: int = size
+            while (remaining > 0):
+                chunk: bytes = srcfile.read(min(COPY_BUFSIZE, remaining))
+                if (not chunk):
+                    # File shrank while being archived; keep the archive
+                    # consistent with the recorded header.
+                    chunk = bytes(min(COPY_BUFSIZE, remaining))
+                for digest in digests.values():
+                    digest.update(chunk)
+                for tarstream, _ in targets:
+                    tarstream.write(chunk)
+                remaining -= len(chunk)
+
+    padding: int = -size % TAR_BLOCKSIZE
+    if (padding):
+        for tarstream, _ in targets:
+            tarstream.write(bytes(padding))
+    for algo, digest in digests.items():
+        for _, target in targets:
+            target[algo] = digest.hexdigest()
+    count_files(1)
+
+
+def tar_write_entry(tarstream, entry: dict) -> None:
+    '''
+    Writes a single entry (see mk_entry()) to an uncompressed tar stream (see
+    tar_write_row()).
+    '''
+    tar_write_row([tarstream], [entry])
+
+
+def tar_write_end(tarstream, size: int) -> None:
+    '''
+    Writes the end-of-archive marker and pads the stream (of size bytes so
+    far) to a multiple of TAR_RECORDSIZE, like tar(1) does.
+    '''
+    size += 2 * TAR_BLOCKSIZE
+    tarstream.write(bytes(2 * TAR_BLOCKSIZE + (-size % TAR_RECORDSIZE)))
+
+
+def ar_member_header(name: str, size: int, mtime: int) -> bytes:
+    return (
+        f"{name:<16}{mtime:<12}{0:<6}{0:<6}{'100644':<8}{size:<10}`\n"
+    ).encode()
+
+
+def ar_write_tar_members(debfiles: list, name: str, rows: list, mtime: int,
+                         compression: dict, algos: tuple = ()) -> None:
+    '''
+    Streams the rows of entries (see tar_write_row(), which hashes the files
+    with algos) as a compressed tar archive into each of debfiles, as an ar
+    member named <name>.tar<suffix> (see COMPRESSION_TYPES). The member size
+    is unknown until the archive has been written, so the header is written
+    with a zero size first and patched afterwards.
+
+    The archive is written by a pipeline of stages running on threads of
+    their own, connected by bounded queues (see read_rows() and
+    _QueueWriter): the files are read ahead, the tar stream is generated
+    and hashed on the calling thread, then compressed and written out for
+    each of debfiles. The stages overlap, so the throughput is that of the
+    slowest stage, and memory stays bounded by the depth of the queues.
+    '''
+    name += ".tar" + COMPRESSION_TYPES[compression["type"]][0]
+    header_offsets: list = []
+    for debfile in debfiles:
+        header_offsets.append(debfile.tell())
+        debfile.write(ar_member_header(name, 0, mtime))
+
+    with timed_stage(name) as stage, contextlib.ExitStack() as stack:
+        outputs: list = [_QueueWriter(debfile.write) for debfile in debfiles]
+        writers: list = [mk_compressed_writer(output, compression)
+                         for output in outputs]
+        inputs: list = [_QueueWriter(compressed.write)
+                        for compressed in writers]
+        # Closed in reverse order on errors: inputs first, then outputs.
+        for pipe in outputs + inputs:
+            stack.callback(pipe.close)
+        for row, contents in stack.enter_context(
+            contextlib.closing(read_rows(rows))):
+            tar_write_row(inputs, row, algos, contents)
+        for tarstream, compressed, output in zip(inputs, writers, outputs):
+            tar_write_end(tarstream, tarstream.insize)
+            tarstream.close()
+            compressed.close()
+            output.close()
+        stage["compress"] = sum(compressed.busy for compressed in writers)
+
+    for debfile, compressed, header_offset in zip(debfiles, writers,
+                                                  header_offsets):
+        end_offset: int = debfile.tell()
+        debfile.seek(header_offset)
+        debfile.write(ar_member_header(name, compressed.size, mtime))
+        debfile.seek(end_offset)
+        if (compressed.size % 2):
+            debfile.write(b"\n")
+
+
+def ar_write_tar_member(debfile, name: str, entries: list, mtime: int,
+                        compression: dict) -> None:
+    '''
+    Streams the entries as a compressed tar archive into debfile (see
+    ar_write_tar_members()).
+    '''
+    ar_write_tar_members([debfile], name, [[entry] for entry in entries],
+                         mtime, compression)
+
+
+def append_file(srcfile, destfile) -> None:
+    '''
+    Appends the whole contents of srcfile to destfile (both opened in binary
+    mode), in the kernel with os.copy_file_range() where available (see
+    copy_file()), otherwise with shutil.copyfileobj().
+    '''
+    srcfile.flush()
+    destfile.flush()
+    start: int = destfile.tell()
+    srcfile.seek(0)
+    if (hasattr(os, "copy_file_range")):
+        try:
+            remaining: int = os.fstat(srcfile.fileno()).st_size
+            while (remaining > 0):
+                count: int = os.copy_file_range(
+                    srcfile.fileno(), destfile.fileno(), remaining)
+                if (count == 0):
+                    break
+                remaining -= count
+            if (remaining == 0):
+                destfile.seek(0, os.SEEK_END)
+                return
+        except OSError:
+            pass
+        srcfile.seek(0)
+        destfile.seek(start)
+        destfile.truncate()
+    shutil.copyfileobj(srcfile, destfile, COPY_BUFSIZE)
+
+
+def write_debs(debnames: list, get_controls, rows: list,
+               compression: dict = None, algos: tuple = (),
+               file_list: bool = False) -> int:
+    '''
+    Writes the .deb archives debnames at once, without calling dpkg, from the
+    control archive entries of each, returned by get_controls(), and the rows
+    of their data archive entries (see tar_write_row()): the files shared by
+    several packages are read once. Every archive is compressed with
+    compression (see parse_compression()), DEFAULT_COMPRESSION if None; only
+    the data archives use several threads.
+
+    With algos, the files are hashed with them while the data archives are
+    streamed, and get_controls() is only called afterwards, so the sums files
+    of the control archives need not read them again. As the control archive
+    comes first in a .deb, the data archives are then written to temporary
+    files next to the packages, and appended to them. With file_list, the
+    file list of each package is written next to it (see write_file_list()).
+    Returns -1 (setting
+    errno and errdesc) if an archive could not be written, after removing all
+    of them.
+    '''
+    if (compression is None):
+        compression = parse_compression(DEFAULT_COMPRESSION)
+    global errno, errdesc
+    mtime: int = get_build_mtime()
+    debname: str = debnames[0]
+    try:
+        with contextlib.ExitStack() as stack:
+            debfiles: list = []
+            for debname in debnames:
+                debfiles.append(stack.enter_context(open(debname, "wb")))
+            datafiles: list = []
+            if (algos != ()):
+                for debname in debnames:
+                    datafiles.append(stack.enter_context(
+                        tempfile.TemporaryFile(
+                            dir = os.path.dirname(debname) or ".")))
+                ar_write_tar_members(datafiles, "data", rows, mtime,
+                                     compression, algos)
+            for debfile, control_entries in zip(debfiles, get_controls()):
+                debfile.write(AR_MAGIC)
+                debfile.write(ar_member_header(
+                    "debian-binary", len(DEB_FORMAT_VERSION), mtime))
+                debfile.write(DEB_FORMAT_VERSION.encode())
+                ar_write_tar_member(debfile, "control", control_entries,
+                                    mtime, dict(compression, threads = 1))
+            if (algos != ()):
+                for debfile, datafile in zip(debfiles, datafiles):
+                    append_file(datafile, debfile)
+            else:
+                ar_write_tar_members(debfiles, "data", rows, mtime,
+                                     compression)
+        for i, debname in enumerate(debnames if file_list else []):
+            write_file_list(debname, [row[i] for row in rows
+                                      if row[i] is not None])
+    except OSError as error:
+        errno = ERR_WRITE_FAILED
+        errdesc = f"Could not write \"{debname}\": {error}"
+        for debname in debnames:
+            for path in (debname, debname + FILES_SUFFIX):
+                if (os.path.isfile(path)):
+                    os.remove(path)
+        return -1
+    return 0
+
+
+def write_file_list(debname: str, data_entries: list) -> None:
+    '''
+    Writes the file list sidecar of the package debname, at
+    <debname>FILES_SUFFIX, from its data archive entries (see mk_entry()):
+    the paths of its files and links, one per line, as deb_tar_names()
+    lists them. repo indexes the Contents of the package from it, without
+    reading its data archive again (see read_file_list()). An existing
+    sidecar is replaced, never rewritten in place.
+    '''
+    listpath: str = debname + FILES_SUFFIX
+    with open(listpath + ".tmp", "w") as listfile:
+        listfile.writelines(entry["name"] + "\n" for entry in data_entries
+                            if entry["type"] != tarfile.DIRTYPE)
+    os.replace(listpath + ".tmp", listpath)
+
+
+def read_file_list(debname: str) -> list:
+    '''
+    Returns the file list of the package debname from its sidecar (see
+    write_file_list()), or None if there is none, or if it is older than the
+    package, which was then rebuilt without it.
+    '''
+    try:
+        if (os.stat(debname + FILES_SUFFIX).st_mtime_ns <
+            os.stat(debname).st_mtime_ns):
+            return None
+        with open(debname + FILES_SUFFIX) as listfile:
+            return listfile.read().splitlines()
+    except OSError:
+        return None
+
+
+def write_deb(debname: str, control_entries: list, data_entries: list,
+              compression: dict = None, file_list: bool = False) -> int:
+    '''
+    Writes the .deb archive debname from the control and data archive entries
+    (see write_debs()).
+    '''
+    return write_debs([debname], lambda: [control_entries],
+                      [[entry] for entry in data_entries], compression,
+                      file_list = file_list)
+
+
+def get_debname(meta: dict, use_debstdname: bool) -> str:
+    '''
+    Returns the path of the output .deb package. With use_debstdname, this is
+    <outdir>/<pkgmgr>.<dist>.<comp>/<pkg-name>_<ver>_all.deb, otherwise it is
+    the build tree root directory name suffixed with .deb.
+    '''
+    if (not use_debstdname):
+        return meta["rootdir"] + ".deb"
+    return os.path.join(meta["debdir"],
+                        meta["package"] + "_" + meta["version"] + "_all.deb")
+
+
+def write_package(buildcfg: dict, meta: dict, use_debstdname: bool = False,
+                  staged: bool = False) -> str:
+    '''
+    Builds the package with the built-in .deb writer and returns the path of
+    the .deb file. The payload is streamed straight from the build
+    configuration and the source paths (see write_packages()), unless staged
+    is True, in which case it is read from the build tree at meta["rootdir"].
+    Returns an empty string on error.
+    '''
+    if (not staged):
+        debnames: list = write_packages(buildcfg, [meta], use_debstdname)
+        return debnames[0] if debnames != [] else ""
+    debname: str = get_debname(meta, use_debstdname)
+    with timed_stage("plan_tree"):
+        entries: tuple = plan_tree(meta["rootdir"])
+    os.makedirs(os.path.dirname(debname) or ".", exist_ok = True)
+    if (write_deb(debname, entries[0], entries[1], meta["compression"],
+                  meta["options"]["file-list"]) != 0):
+        return ""
+    return debname
+
+
+def write_packages(buildcfg: dict, metas: list,
+                   use_debstdname: bool = False) -> list:
+    '''
+    Builds the package for several targets at once with the built-in .deb
+    writer (see plan_targets() and write_debs()), and returns the paths of
+    the .deb files. The files are hashed for the sums files while they are
+    archived. Returns an empty list on error.
+    '''
+    debnames: list = [get_debname(meta, use_debstdname) for meta in metas]
+    mtime: int = get_build_mtime()
+    with timed_stage("plan_targets"):
+        rows: list = plan_targets(buildcfg, metas, mtime)
+    if (rows == ()):
+        return []
+    for debname in debnames:
+        os.makedirs(os.path.dirname(debname) or ".", exist_ok = True)
+    if (write_debs(debnames,
+                   lambda: plan_controls(buildcfg, metas, rows, mtime), rows,
+                   metas[0]["compression"],
+                   get_sum_algos(metas[0]["options"]),
+                   metas[0]["options"]["file-list"]) != 0):
+        return []
+    return debnames
+
+
+def parse_args_gencfg(args: list) -> dict:
+    if (args == [] or args[0] not in {"-g", "--generate-buildcfg"}):
+        return {}
+    compulsory_args: list = [
+        "pkgmgr",
+        "dist",
+        "comp",
+        "shellscript",
+        "control"
+    ]
+    optional_args: list = [
+        "srcroot",
+        "exclude",
+        "man",
+        "copyright",
+        "outfile",
+        "compression",
+        "manifest",
+        "format",
+        "exclude-pattern",
+        "exclude-from"
+    ]
+    parsed_args: dict = {}
+    # Avoid KeyError if absent
+    for arg in (compulsory_args + optional_args):
+        if (arg in {"exclude", "exclude-pattern"}):
+            parsed_args[arg] = []
+        else:
+            parsed_args[arg] = ""
+    i: int = 1
+    arg_count: int = len(args)
+    while (i < arg_count):
+        arg: str = args[i]
+        if (arg.startswith("--") and (i + 1 < arg_count)):
+            j: int = i + 1
+            arg = arg.lstrip("--")
+            if (arg in {"exclude", "exclude-pattern"}):
+                while (j < arg_count and not args[j].startswith("--")):
+                    parsed_args[arg].append(args[j])
+                    j += 1
+            else:
+                if (args[j].startswith("--")): return {}
+                else: parsed_args[arg]= args[j]
+            i = j
+        else:
+            i += 1
+    for arg in compulsory_args:
+        if (parsed_args[arg] == ""):
+            return {}
+    for arg in parsed_args:
+        if (arg not in (compulsory_args + optional_args)):
+            return {}
+    return parsed_args
+
+
+def parse_build_option(args: list, i: int, parsed_args: dict) -> int:
+    '''
+    Parses the build option at args[i] (along with its value, if it takes one)
+    into parsed_args. Returns the index of the next argument, or -1 if the
+    option is invalid or its value is missing.
+    '''
+    arg: str = args[i]
+    if (arg in {"-k", "--keep-buildtree"}):
+        parsed_args["keep-buildtree"] = True
+    elif (arg in {"-s", "--use-debstdname"}):
+        parsed_args["use-debstdname"] = True
+    elif (arg in {"-d", "--use-dpkg"}):
+        parsed_args["use-dpkg"] = True
+    elif (arg in {"-c", "--cache-dir"}):
+        if (i + 1 == len(args) or args[i + 1].startswith("-")):
+            return -1
+        parsed_args["cache-dir"] = args[i + 1]
+        return i + 2
+    elif (arg == "--stage-mode"):
+        if (i + 1 == len(args) or args[i + 1] not in STAGE_MODES):
+            return -1
+        parsed_args["stage-mode"] = args[i + 1]
+        return i + 2
+    elif (arg == "--stage-jobs"):
+        if (i + 1 == len(args) or not args[i + 1].isdigit()):
+            return -1
+        parsed_args["stage-jobs"] = int(args[i + 1])
+        return i + 2
+    elif (arg in {"-z", "--compression"}):
+        if (i + 1 == len(args) or args[i + 1].startswith("-")):
+            return -1
+        parsed_args["compression"] = args[i + 1]
+        return i + 2
+    elif (arg == "--compress-threads"):
+        if (i + 1 == len(args) or not args[i + 1].isdigit() or
+            int(args[i + 1]) < 1):
+            return -1
+        parsed_args["compress-threads"] = int(args[i + 1])
+        return i + 2
+    elif (arg == "--cache-size"):
+        if (i + 1 == len(args) or not args[i + 1].isdigit()):
+            return -1
+        parsed_args["cache-size"] = int(args[i + 1])
+        return i + 2
+    elif (arg == "--blob-store"):
+        if (i + 1 == len(args) or args[i + 1].startswith("-")):
+            return -1
+        parsed_args["blob-store"] = args[i + 1]
+        return i + 2
+    elif (arg == "--precompile"):
+        parsed_args["precompile"] = True
+    elif (arg == "--sha256sums"):
+        parsed_args["sha256sums"] = True
+    elif (arg == "--file-list"):
+        parsed_args["file-list"] = True
+    elif (arg == "--pkgmgrs"):
+        if (i + 1 == len(args) or args[i + 1].startswith("-")):
+            return -1
+        parsed_args["pkgmgrs"] = list(dict.fromkeys(
+            pkgmgr for pkgmgr in args[i + 1].split(",") if pkgmgr != ""))
+        return i + 2
+    else:
+        return -1
+    return i + 1
+
+
+def parse_args_build(args: list) -> list:
+    parsed_args: dict = {}
+
+    if (len(args) < 2):
+        return {}
+
+    if (args[-1].startswith("-") or
+        args[-2].startswith("-")):
+        return {}
+
+    parsed_args["outdir"] = args[-1]
+    parsed_args["buildcfg"] = args[-2]
+    parsed_args.update(BUILD_OPTIONS)
+    parsed_args["watch"] = False
+    parsed_args["timings"] = False
+    parsed_args["timings-trace"] = ""
+    parsed_args["profile"] = ""
+
+    options: list = args[0:-2]
+    i: int = 0
+    while (i < len(options)):
+        if (options[i] in {"-w", "--watch"}):
+            parsed_args["watch"] = True
+            i += 1
+            continue
+        if (options[i] == "--timings"):
+            parsed_args["timings"] = True
+            i += 1
+            continue
+        if (options[i] in {"--timings-trace", "--profile"}):
+            if (i + 1 == len(options) or options[i + 1].startswith("-")):
+                return {}
+            parsed_args[options[i][2:]] = options[i + 1]
+            i += 2
+            continue
+        i = parse_build_option(options, i, parsed_args)
+        if (i == -1):
+            return {}
+
+    if (parsed_args["watch"] and parsed_args["pkgmgrs"] != []):
+        return {}
+    return parsed_args
+
+
+def parse_args_batch(args: list) -> dict:
+    if (args == [] or args[0] not in {"-b", "--batch"}):
+        return {}
+    parsed_args: dict = BUILD_OPTIONS.copy()
+    parsed_args.update({
+        "jobs"           : os.cpu_count() or 1,
+        "use-debstdname" : True,
+        "keep-going"     : False,
+        "outdir"         : "",
+        "buildcfgs"      : []
+    })
+    i: int = 1
+    arg_count: int = len(args)
+    while (i < arg_count and args[i].startswith("-")):
+        arg: str = args[i]
+        if (arg in {"-j", "--jobs"}):
+            if (i + 1 == arg_count or not args[i + 1].isdigit() or
+                int(args[i + 1]) < 1):
+                return {}
+            parsed_args["jobs"] = int(args[i + 1])
+            i += 2
+        elif (arg == "--keep-going"):
+            parsed_args["keep-going"] = True
+            i += 1
+        elif (arg in {"-s", "--use-debstdname"}):
+            return {}
+        else:
+            i = parse_build_option(args, i, parsed_args)
+            if (i == -1):
+                return {}
+    if (arg_count - i < 2):
+        return {}
+    parsed_args["outdir"] = args[i]
+    for path in args[i + 1:]:
+        if (os.path.isdir(path)):
+            parsed_args["buildcfgs"].extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.endswith(CFG_EXTENSIONS)
+            ))
+        else:
+            parsed_args["buildcfgs"].append(path)
+    return parsed_args
+
+
+def parse_args_cache_stats(args: list) -> dict:
+    if (len(args) != 2 or args[0] != "--cache-stats"):
+        return {}
+    return {"cache-dir" : args[1]}
+
+
+def parse_args_blob_gc(args: list) -> dict:
+    if (len(args) != 2 or args[0] != "--blob-gc"):
+        return {}
+    return {"blob-store" : args[1]}
+
+
+def walk_tree(roots: list, exclude: list = []) -> list:
+    '''
+    Walks the (path, name) pairs of roots (files or directories, followed if
+    they are symbolic links, like the build does) once with os.scandir(),
+    and returns an entry for every directory and file under them, in archive
+    order, in the form of the entries of a manifest (see parse_manifest()),
+    with their "src" path. Paths excluded by exclude (see is_excluded()) are
+    skipped without being descended into.
+    '''
+    entries: list = []
+
+    def walk(path: str, name: str, st: os.stat_result) -> None:
+        isdir: bool = stat.S_ISDIR(st.st_mode)
+        if (is_excluded(exclude, name, isdir)):
+            return
+        entries.append({
+            "type"  : "d" if isdir else "f",
+            "mode"  : stat.S_IMODE(st.st_mode),
+            "size"  : 0 if isdir else st.st_size,
+            "mtime" : st.st_mtime_ns,
+            "hash"  : "",
+            "path"  : name,
+            "src"   : path
+        })
+        if (not isdir):
+            return
+        with os.scandir(path) as it:
+            children: list = sorted(it, key = lambda child: child.name)
+        for child in children:
+            walk(child.path, name + "/" + child.name, child.stat())
+
+    for path, name in roots:
+        walk(path, name, os.stat(path))
+    return entries
+
+
+def manifest_line(entry: dict) -> str:
+    '''
+    Returns the line of a manifest entry (see parse_manifest()) in the
+    [MANIFEST] section.
+    '''
+    return f"{entry['type']} {entry['mode']:o} {entry['size']} " \
+        f"{entry['mtime']} {entry['hash'] or '-'} {entry['path']}\n"
+
+
+def mk_manifest(srcroot: str, names: list, algo: str,
+                exclude: list = []) -> list:
+    '''
+    Returns the lines of the [MANIFEST] section for the sources names under
+    srcroot: one "<type> <mode> <size> <mtime_ns> <hash> <path>" line per
+    directory ("d") and file ("f"), in archive order, with the path relative
+    to srcroot. The sources are walked once (see walk_tree()), skipping the
+    paths excluded by exclude. Files are hashed with hash_files() unless algo
+    is "none" (the hash is then "-").
+    '''
+    entries: list = walk_tree([(os.path.join(srcroot, name), name)
+                               for name in names], exclude)
+    if (algo != "none"):
+        digests: dict = hash_files([entry["src"] for entry in entries
+                                    if entry["type"] == "f"], (algo,))
+        for entry in entries:
+            if (entry["type"] == "f"):
+                entry["hash"] = f"{algo}:{digests[entry['src']][algo]}"
+    return [manifest_line(entry) for entry in entries]
+
+
+def cfg_sections(buildcfg: dict) -> list:
+    '''
+    Returns the sections of the build configuration as they are written in a
+    build config: a list of (key, text) pairs, in the order of CFG_SECTIONS,
+    leaving out empty sections.
+    '''
+    sections: list = []
+    for key in CFG_SECTIONS.values():
+        value = buildcfg[key]
+        if (key in CFG_SCALAR_KEYS):
+            text: str = value + "\n" if value != "" else ""
+        elif (key in {"sources", "exclude"}):
+            text = "".join(line + "\n" for line in value)
+        elif (key == "manifest"):
+            text = "".join(manifest_line(entry) for entry in value)
+        else:
+            text = value
+        if (text != ""):
+            sections.append((key, text))
+    return sections
+
+
+def write_text_cfg(path: str, sections: list) -> None:
+    '''
+    Writes the (key, text) pairs of sections to the text build config path,
+    each between its [SECTION] and [END] lines.
+    '''
+    headers: dict = {key : header.decode()
+                     for header, key in CFG_SECTIONS.items()}
+    with open(path, 'w') as spalconfig:
+        for key, text in sections:
+            spalconfig.writelines([headers[key] + "\n", text, "[END]\n",
+                                   "\n\n"])
+
+
+def write_packed_cfg(path: str, sections: list, files: list) -> None:
+    '''
+    Writes the packed build config path: the (key, text) pairs of sections,
+    and the entries of files (see walk_tree()) as embedded sources, read from
+    their "data" if present, else streamed from their "src" path. The records
+    are laid out as described along with PACK_HEADER; the header is written
+    last, once the offset of the record table is known.
+    '''
+    records: list = []
+    with open(path, "wb") as packfile:
+        packfile.write(bytes(PACK_HEADER.size))
+        for key, text in sections:
+            data: bytes = text.encode()
+            records.append((key, 0, 0, packfile.tell(), len(data)))
+            packfile.write(data)
+        for entry in files:
+            offset: int = packfile.tell()
+            if (entry["type"] == "d"):
+                mode: int = stat.S_IFDIR | entry["mode"]
+            elif (entry.get("data") is not None):
+                mode = stat.S_IFREG | entry["mode"]
+                packfile.write(entry["data"])
+            else:
+                mode = stat.S_IFREG | entry["mode"]
+                with open(entry["src"], "rb") as srcfile:
+                    shutil.copyfileobj(srcfile, packfile, COPY_BUFSIZE)
+            records.append((PACK_FILE_PREFIX + entry["path"], mode,
+                            entry["mtime"], offset, packfile.tell() - offset))
+        table: int = packfile.tell()
+        for name, mode, mtime, offset, size in records:
+            encoded: bytes = name.encode()
+            packfile.write(PACK_RECORD.pack(len(encoded), mode, mtime, offset,
+                                            size) + encoded)
+        packfile.seek(0)
+        packfile.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION,
+                                        len(records), table))
+
+
+def convert_cfg(parsed_args: dict) -> int:
+    '''
+    Converts the build config parsed_args["infile"] to parsed_args["outfile"]:
+    a packed build config if its name ends in .spalpack, else a text one.
+    Embedded sources are kept in packed build configs; with --embed-sources,
+    the other sources are embedded as well. When converting to text, they are
+    written out to <outfile>.sources (without the extension of outfile) and
+    listed from there. Returns -1 (setting errno and errdesc) on error.
+    '''
+    global cfgfile, errno, errdesc
+    buildcfg: dict = getcfg(parsed_args["infile"])
+    if (buildcfg == {}):
+        return -1
+    outfile: str = parsed_args["outfile"]
+    embedded: dict = buildcfg["embedded"]
+    exclude: list = compile_excludes(buildcfg["exclude"])
+    if (exclude == ()):
+        return -1
+    if (outfile.endswith(".spalpack")):
+        files: list = []
+        for src in buildcfg["sources"]:
+            name: str = os.path.basename(src)
+            if (name in embedded):
+                files.extend(embedded[name])
+            elif (parsed_args["embed-sources"]):
+                if (not os.path.exists(src)):
+                    errno = ERR_FILE_NOT_FOUND
+                    errdesc = f"Source \"{src}\" not found."
+                    return -1
+                files.extend(walk_tree([(src, name)], exclude))
+        write_packed_cfg(outfile, cfg_sections(buildcfg), files)
+    else:
+        if (embedded != {}):
+            srcdir: str = os.path.splitext(outfile)[0] + ".sources"
+            os.makedirs(srcdir, exist_ok = True)
+            write_embedded([(entry, os.path.join(srcdir, entry["path"]))
+                            for entries in embedded.values()
+                            for entry in entries])
+            buildcfg = dict(buildcfg, sources = [
+                os.path.join(srcdir, os.path.basename(src))
+                if os.path.basename(src) in embedded else src
+                for src in buildcfg["sources"]
+            ])
+        write_text_cfg(outfile, cfg_sections(buildcfg))
+    cfgfile = outfile
+    return 0
+
+
+def mk_cfg(parsed_args: dict) -> int:
+    global cfgfile, errno, errdesc
+    cfgformat: str = parsed_args["format"] or "text"
+    if (cfgformat not in CFG_FORMATS):
+        errno = ERR_BAD_CONFIG
+        errdesc = f"Unsupported build config format \"{cfgformat}\" " \
+            f"(expected one of {', '.join(CFG_FORMATS)})."
+        return -1
+    extension: str = CFG_EXTENSIONS[cfgformat != "text"]
+    cfgfile = os.path.basename(parsed_args["shellscript"]) + "." + \
+        parsed_args["pkgmgr"] + "." + parsed_args["dist"] + "." + \
+        parsed_args["comp"] + extension
+    if (parsed_args["outfile"] != ""):
+        cfgfile = parsed_args["outfile"]
+        cfgfile += extension if not cfgfile.endswith(extension) else ""
+
+    shfile: str = parsed_args["shellscript"]
+    if (not os.path.isfile(shfile)):
+        errno = ERR_FILE_NOT_FOUND
+        errdesc = f"File \"{shfile}\" not found."
+        return -1
+
+    ctrlfile: str = parsed_args["control"]
+    if (not os.path.isfile(ctrlfile)):
+        errno = ERR_FILE_NOT_FOUND
+        errdesc = f"File \"{ctrlfile}\" not found."
+        return -1
+
+    srcrootdir: str = parsed_args["srcroot"]
+    if (srcrootdir != "" and not os.path.isdir(srcrootdir)):
+        errno = ERR_FILE_NOT_FOUND
+        errdesc = f"Source root \"{srcrootdir}\" not found."
+        return -1
+
+    if (srcrootdir == "."):
+        errno = ERR_SRCROOT_IS_CWD
+        errdesc = f"Source root cannot be same as current working directory."
+        return -1
+
+    excluded_files: list = parsed_args["exclude"]
+    if (srcrootdir == "" and (excluded_files != [] or
+        parsed_args["exclude-pattern"] != [] or
+        parsed_args["exclude-from"] != "")):
+        errno = ERR_SRCROOT_UNSPECIFIED
+        errdesc = f"Attempted to exclude files without specifying source root."
+        return -1
+
+    patterns: list = []
+    excludefile: str = parsed_args["exclude-from"]
+    if (excludefile != ""):
+        if (not os.path.isfile(excludefile)):
+            errno = ERR_FILE_NOT_FOUND
+            errdesc = f"File \"{excludefile}\" not found."
+            return -1
+        with open(excludefile) as file:
+            patterns = [line for line in file.read().splitlines()
+                        if line.strip() != "" and not line.startswith("#")]
+    patterns += parsed_args["exclude-pattern"]
+    exclude: list = compile_excludes(patterns)
+    if (exclude == ()):
+        return -1
+
+    manfile: list = parsed_args["man"]
+    if (manfile != "" and not os.path.isfile(manfile)):
+        errno = ERR_FILE_NOT_FOUND
+        errdesc = f"Man file \"{manfile}\" not found."
+        return -1
+
+    copyrightfile: list = parsed_args["copyright"]
+    if (copyrightfile != "" and not os.path.isfile(copyrightfile)):
+        errno = ERR_FILE_NOT_FOUND
+        errdesc = f"Copyright file \"{copyrightfile}\" not found."
+        return -1
+
+    compression: str = parsed_args["compression"]
+    if (compression != "" and parse_compression(compression) == {}):
+        return -1
+
+    manifest: str = parsed_args["manifest"]
+    if (srcrootdir == "" and manifest != ""):
+        errno = ERR_SRCROOT_UNSPECIFIED
+        errdesc = f"Attempted to write a manifest without specifying source root."
+        return -1
+    if (manifest != "" and manifest not in MANIFEST_HASHES):
+        errno = ERR_BAD_MANIFEST
+        errdesc = f"Unsupported manifest hash \"{manifest}\" (expected one " \
+            f"of {', '.join(MANIFEST_HASHES)})."
+        return -1
+
+    sections: list = [
+        ("pkgmgr", parsed_args["pkgmgr"] + "\n"),
+        ("dist", parsed_args["dist"] + "\n"),
+        ("comp", parsed_args["comp"] + "\n")
+    ]
+    with open(shfile) as file:
+        sections.append(("shellscript", file.read()))
+    with open(ctrlfile) as file:
+        sections.append(("control", file.read()))
+
+    names: list = []
+    if (srcrootdir != ""):
+        names = [src for src in os.listdir(srcrootdir)
+                 if src not in excluded_files and not is_excluded(
+                     exclude, src, os.path.isdir(os.path.join(srcrootdir,
+                                                              src)))]
+        sections.append(("sources", "".join(os.path.join(srcrootdir, src) +
+                                            "\n" for src in names)))
+        if (patterns != []):
+            sections.append(("exclude", "".join(pattern + "\n"
+                                                for pattern in patterns)))
+        if (manifest != ""):
+            sections.append(("manifest", "".join(
+                mk_manifest(srcrootdir, names, manifest, exclude))))
+
+    if (manfile != ""):
+        with open(manfile) as file:
+            sections.append(("man", file.read()))
+
+    if (copyrightfile != ""):
+        with open(copyrightfile) as file:
+            sections.append(("copyright", file.read()))
+
+    if (compression != ""):
+        sections.append(("compression", compression + "\n"))
+
+    if (cfgformat == "text"):
+        write_text_cfg(cfgfile, sections)
+    else:
+        files: list = []
+        if (cfgformat == "packed+sources"):
+            files = walk_tree([(os.path.join(srcrootdir, name), name)
+                               for name in names], exclude)
+        write_packed_cfg(cfgfile, sections, files)
+    return 0
+
+
+def build_package(meta: dict, use_debstdname: bool = False) -> str:
+    global errno, errdesc
+    rootdir: str = meta["rootdir"]
+    compression: dict = meta["compression"]
+    with timed_stage("dpkg-deb"):
+        build_proc = subprocess.run(
+            ["dpkg-deb", f"-Z{compression['type']}",
+             f"-z{compression['level']}", "--build", rootdir],
+            stdout = subprocess.PIPE,
+            stderr = subprocess.STDOUT,
+            text = True
+        )
+
+    debname: str = rootdir + ".deb"
+    if (build_proc.returncode != 0):
+        errno = ERR_SUBPROCESS_FAILED
+        errdesc = build_proc.stdout
+        return ""
+
+    if (use_debstdname):
+        new_deb: str = get_debname(meta, True)
+        os.makedirs(meta["debdir"], exist_ok = True)
+        os.rename(debname, new_deb)
+        debname = new_deb
+
+    try:
+        if (meta["options"]["file-list"]):
+            write_file_list(debname, plan_tree(rootdir)[1])
+    except OSError as error:
+        errno = ERR_WRITE_FAILED
+        errdesc = f"Could not write \"{debname + FILES_SUFFIX}\": {error}"
+        return ""
+    return debname
+
+
+def hash_source(digest, src: str, name: str, exclude: list = []) -> None:
+    '''
+    Feeds the names, modes, mtimes (in whole seconds, as archived) and
+    contents of the source file or directory src (to be archived as name)
+    into digest, in the same order in which
+    plan_source() archives them, skipping the same excluded paths.
+    '''
+    st: os.stat_result = os.stat(src)
+    if (is_excluded(exclude, name, stat.S_ISDIR(st.st_mode))):
+        return
+    digest.update(f"{name}\0{stat.S_IMODE(st.st_mode):o}\0"
+                  f"{int(st.st_mtime)}\0".encode())
+    if (not stat.S_ISDIR(st.st_mode)):
+        with open(src, "rb") as srcfile:
+            digest.update(f"{os.fstat(srcfile.fileno()).st_size}\0".encode())
+            while (chunk := srcfile.read(COPY_BUFSIZE)):
+                digest.update(chunk)
+        return
+    with os.scandir(src) as it:
+        children: list = sorted(it, key = lambda child: child.name)
+    for child in children:
+        hash_source(digest, child.path, name + "/" + child.name, exclude)
+
+
+def get_cache_keys(buildcfg: dict, options: dict, pkgmgrs: list,
+                   manifest: dict = {}) -> list:
+    '''
+    Returns the build cache keys of a package for each of the package managers
+    pkgmgrs: a SHA-256 over everything that goes into the .deb file, i.e. the
+    build configuration, the contents and mtimes of the sources, the
+    compression settings and the build backend. The sources are hashed once
+    for all the keys; files with an unchanged hash in manifest (see
+    resolve_manifest()) are keyed by that hash instead of being read. Returns
+    an empty list if a source is missing.
+    '''
+    global errno, errdesc
+    exclude: list = compile_excludes(buildcfg["exclude"])
+    if (exclude == ()):
+        return []
+    digest = hashlib.sha256()
+    for src in buildcfg["sources"]:
+        name: str = os.path.basename(src)
+        if (name in manifest):
+            for entry in manifest[name]:
+                mtime: int = entry["mtime"] // 1000000000
+                if (entry["type"] == "f" and entry["src"] == ""):
+                    digest.update(f"{entry['path']}\0{entry['mode']:o}\0"
+                                  f"{mtime}\0{entry['size']}\0".encode())
+                    digest.update(entry["data"])
+                    continue
+                if (entry["type"] == "f" and entry["hash"] == ""):
+                    hash_source(digest, entry["src"], entry["path"])
+                    continue
+                digest.update(f"{entry['path']}\0{entry['mode']:o}\0"
+                              f"{mtime}\0".encode())
+                if (entry["type"] == "f"):
+                    digest.update(f"{entry['size']}\0{entry['hash']}\0"
+                                  .encode())
+            continue
+        if (not os.path.exists(src)):
+            errno = ERR_FILE_NOT_FOUND
+            errdesc = f"Source \"{src}\" not found."
+            return []
+        hash_source(digest, src, name, exclude)
+    return [hashlib.sha256(json.dumps({
+        "spal"        : VERSION,
+        "buildcfg"    : dict(buildcfg, pkgmgr = pkgmgr, embedded = {}),
+        "sources"     : digest.hexdigest(),
+        "compression" : options["compression"] or buildcfg["compression"] or
+                        DEFAULT_COMPRESSION,
+        "threads"     : options["compress-threads"],
+        "use-dpkg"    : options["use-dpkg"],
+        "precompile"  : importlib.util.MAGIC_NUMBER.hex()
+                        if options["precompile"] else "",
+        "sha256sums"  : options["sha256sums"],
+        "mtime"       : os.environ.get("SOURCE_DATE_EPOCH", "")
+    }, sort_keys = True).encode()).hexdigest() for pkgmgr in pkgmgrs]
+
+
+def get_cache_key(buildcfg: dict, options: dict,
+                  manifest: dict = {}) -> str:
+    '''
+    Returns the build cache key of a package (see get_cache_keys()), or an
+    empty string if a source is missing.
+    '''
+    keys: list = get_cache_keys(buildcfg, options, [buildcfg["pkgmgr"]],
+                                manifest)
+    return keys[0] if keys != [] else ""
+
+
+def cache_lock(cachedir: str):
+    '''
+    Returns the lock file of the build cache, opened and exclusively locked.
+    Closing it releases the lock. Serializes the stats updates and evictions
+    of concurrent builds (e.g. in batch mode).
+    '''
+    os.makedirs(cachedir, exist_ok = True)
+    lockfile = open(os.path.join(cachedir, "lock"), "w")
+    fcntl.flock(lockfile, fcntl.LOCK_EX)
+    return lockfile
+
+
+def cache_read_stats(cachedir: str) -> dict:
+    stats: dict = {"hits" : 0, "misses" : 0}
+    try:
+        with open(os.path.join(cachedir, "stats.json")) as statsfile:
+            stats.update(json.load(statsfile))
+    except (OSError, ValueError):
+        pass
+    return stats
+
+
+def cache_count(cachedir: str, hit: bool) -> None:
+    '''
+    Records a cache hit or miss in the stats file of the build cache.
+    '''
+    with cache_lock(cachedir):
+        stats: dict = cache_read_stats(cachedir)
+        stats["hits" if hit else "misses"] += 1
+        statspath: str = os.path.join(cachedir, "stats.json")
+        with open(statspath + ".tmp", "w") as statsfile:
+            json.dump(stats, statsfile)
+        os.replace(statspath + ".tmp", statspath)
+
+
+def cache_entries(cachedir: str) -> list:
+    '''
+    Returns the cached packages as a list of (path, size, mtime) tuples.
+    '''
+    entries: list = []
+    for dirpath, dirnames, filenames in os.walk(cachedir):
+        for filename in filenames:
+            if (filename.endswith(".deb")):
+                path: str = os.path.join(dirpath, filename)
+                st: os.stat_result = os.stat(path)
+                entries.append((path, st.st_size, st.st_mtime))
+    return entries
+
+
+def cache_evict(cachedir: str, max_size: int) -> None:
+    '''
+    Removes the least recently used cached packages until the build cache
+    holds at most max_size MiB. Cache hits refresh the mtime of a package, so
+    the mtime orders the packages by their last use.
+    '''
+    entries: list = sorted(cache_entries(cachedir), key = lambda e: e[2])
+    total: int = sum(entry[1] for entry in entries)
+    for path, size, mtime in entries:
+        if (total <= max_size * 1024 * 1024):
+            break
+        os.remove(path)
+        if (os.path.isfile(path + FILES_SUFFIX)):
+            os.remove(path + FILES_SUFFIX)
+        total -= size
+
+
+def cache_path(cachedir: str, key: str) -> str:
+    return os.path.join(cachedir, key[:2], key + ".deb")
+
+
+def clone_file(src: str, dest: str) -> None:
+    '''
+    Replaces dest with a copy of src: a copy-on-write clone where the
+    filesystem supports it (see reflink_file()), otherwise a full copy. The
+    copy is written to a temporary file next to dest, then renamed over it.
+    Unlike a hardlink, the copy never shares its inode with src, so writing
+    to one path later cannot change the other.
+    '''
+    fd, tmpdest = tempfile.mkstemp(dir = os.path.dirname(dest) or ".",
+                                   prefix = "." + os.path.basename(dest))
+    os.close(fd)
+    try:
+        try:
+            reflink_file(src, tmpdest)
+        except OSError:
+            copy_file(src, tmpdest)
+        os.replace(tmpdest, dest)
+    except OSError:
+        if (os.path.lexists(tmpdest)):
+            os.remove(tmpdest)
+        raise
+
+
+def cache_fetch(cachedir: str, key: str, debname: str,
+                file_list: bool = False) -> bool:
+    '''
+    Puts the cached package for key at debname, along with its file list
+    (see write_file_list()) if file_list is set and one was cached. Returns
+    False on a cache miss. Hits and misses are recorded in the cache stats.
+    '''
+    cached: str = cache_path(cachedir, key)
+    hit: bool = os.path.isfile(cached)
+    if (hit):
+        os.utime(cached)
+        os.makedirs(os.path.dirname(debname) or ".", exist_ok = True)
+        clone_file(cached, debname)
+        if (file_list and os.path.isfile(cached + FILES_SUFFIX)):
+            os.utime(cached + FILES_SUFFIX)
+            clone_file(cached + FILES_SUFFIX, debname + FILES_SUFFIX)
+        elif (os.path.isfile(debname + FILES_SUFFIX)):
+            # The package keeps its cached mtime: a list left by an earlier
+            # build could look newer than it (see read_file_list()).
+            os.remove(debname + FILES_SUFFIX)
+    cache_count(cachedir, hit)
+    return hit
+
+
+def cache_store(cachedir: str, key: str, debname: str, max_size: int) -> None:
+    '''
+    Adds the package debname to the build cache under key, along with its
+    file list, then evicts least recently used packages if the cache has
+    grown over max_size MiB.
+    '''
+    cached: str = cache_path(cachedir, key)
+    os.makedirs(os.path.dirname(cached), exist_ok = True)
+    clone_file(debname, cached)
+    if (os.path.isfile(debname + FILES_SUFFIX)):
+        clone_file(debname + FILES_SUFFIX, cached + FILES_SUFFIX)
+    with cache_lock(cachedir):
+        cache_evict(cachedir, max_size)
+
+
+def show_cache_stats(cachedir: str) -> None:
+    entries: list = cache_entries(cachedir)
+    stats: dict = cache_read_stats(cachedir)
+    lookups: int = stats["hits"] + stats["misses"]
+    ratio: float = 100 * stats["hits"] / lookups if lookups else 0.0
+    size: float = sum(entry[1] for entry in entries) / (1024 * 1024)
+    print(
+        f"Cache directory : {cachedir}\n"
+        f"Entries         : {len(entries)}\n"
+        f"Size            : {size:.2f} MiB\n"
+        f"Hits            : {stats['hits']}\n"
+        f"Misses          : {stats['misses']}\n"
+        f"Hit ratio       : {ratio:.1f}%"
+    )
+
+
+def blob_lock(store: str, operation: int):
+    '''
+    Returns the lock file of the blob store, opened and locked with operation
+    (fcntl.LOCK_SH or fcntl.LOCK_EX). Closing it releases the lock. Builds
+    share the lock while linking blobs; blob_gc() and index updates take it
+    exclusively.
+    '''
+    os.makedirs(store, exist_ok = True)
+    lockfile = open(os.path.join(store, "lock"), "w")
+    fcntl.flock(lockfile, operation)
+    return lockfile
+
+
+def blob_path(store: str, digest: str, mode: int, mtime: int) -> str:
+    return os.path.join(store, "blobs", digest[:2],
+                        f"{digest}.{mode:o}.{mtime}")
+
+
+def blob_read_index(store: str) -> dict:
+    try:
+        with open(os.path.join(store, "index.json")) as indexfile:
+            index: dict = json.load(indexfile)
+    except (OSError, ValueError):
+        return {}
+    return index if isinstance(index, dict) else {}
+
+
+def blob_write_index(store: str, index: dict) -> None:
+    '''
+    Merges index into the index file of the blob store.
+    '''
+    with blob_lock(store, fcntl.LOCK_EX):
+        merged: dict = blob_read_index(store)
+        merged.update(index)
+        indexpath: str = os.path.join(store, "index.json")
+        with open(indexpath + ".tmp", "w") as indexfile:
+            json.dump(merged, indexfile)
+        os.replace(indexpath + ".tmp", indexpath)
+
+
+def store_file(src: str, dest: str, meta: dict) -> bool:
+    '''
+    Stages the file src at dest as a hardlink to its blob in the blob store,
+    adding the blob first if the store has none. Blobs are named by the
+    SHA-256 of their contents, their permissions and their modification time
+    (which hardlinks share), so identical files are written once, whatever
+    the package, version or package manager staging them. The sums of sources
+    are kept in the index of the store, keyed by path and checked against
+    their size, mtime and inode number, so unchanged sources are not read
+    again, and are cached for mk_md5sums() (see cache_sums()).
+
+    Returns False if the store is on another filesystem than dest, or if the
+    blob is already linked elsewhere in the build tree, as the packages would
+    then store a hardlink where a copy stores a file.
+    '''
+    store: str = meta["options"]["blob-store"]
+    if (os.stat(store).st_dev != os.stat(os.path.dirname(dest)).st_dev):
+        return False
+    index: dict = meta.setdefault("blobindex", {})
+    st: os.stat_result = os.stat(src)
+    path: str = os.path.abspath(src)
+    stats: list = [st.st_size, st.st_mtime_ns, st.st_ino]
+    cached: list = index.get(path, [])
+    if (cached[:3] == stats):
+        digests: dict = cached[3]
+    else:
+        digests = hash_file(src, BLOB_HASHES)
+        index[path] = stats + [digests]
+    blob: str = blob_path(store, digests["sha256"], stat.S_IMODE(st.st_mode),
+                          st.st_mtime_ns)
+    if (meta.setdefault("blobsused", {}).setdefault(blob, dest) != dest):
+        return False
+    if (not os.path.exists(blob)):
+        os.makedirs(os.path.dirname(blob), exist_ok = True)
+        fd, tmpblob = tempfile.mkstemp(dir = os.path.dirname(blob),
+                                       prefix = ".")
+        os.close(fd)
+        try:
+            copy_file(src, tmpblob)
+            try:
+                os.link(tmpblob, blob)
+            except FileExistsError:
+                pass
+        finally:
+            os.remove(tmpblob)
+    os.link(blob, dest)
+    cache_sums(meta, dest, digests = {
+        algo : digests[algo] for algo in get_sum_algos(meta["options"])})
+    return True
+
+
+def blob_gc(store: str) -> tuple:
+    '''
+    Removes the blobs of the blob store that no build tree links to any more
+    (with a link count of 1), along with the temporary files of interrupted
+    builds, and the index entries of sources that are gone or have changed.
+    Returns the number and size of the blobs removed and kept.
+    '''
+    removed: int = 0
+    freed: int = 0
+    kept: int = 0
+    size: int = 0
+    with blob_lock(store, fcntl.LOCK_EX):
+        for dirpath, dirnames, filenames in os.walk(
+            os.path.join(store, "blobs")):
+            for filename in filenames:
+                path: str = os.path.join(dirpath, filename)
+                st: os.stat_result = os.lstat(path)
+                if (st.st_nlink == 1):
+                    os.remove(path)
+                    removed += 1
+                    freed += st.st_size
+                else:
+                    kept += 1
+                    size += st.st_size
+            if (dirpath != os.path.join(store, "blobs") and
+                not os.listdir(dirpath)):
+                os.rmdir(dirpath)
+        index: dict = blob_read_index(store)
+        for path, cached in list(index.items()):
+            try:
+                st = os.stat(path)
+                if ([st.st_size, st.st_mtime_ns, st.st_ino] == cached[:3]):
+                    continue
+            except OSError:
+                pass
+            del index[path]
+        indexpath: str = os.path.join(store, "index.json")
+        with open(indexpath + ".tmp", "w") as indexfile:
+            json.dump(index, indexfile)
+        os.replace(indexpath + ".tmp", indexpath)
+    return (removed, freed, kept, size)
+
+
+def show_blob_gc(store: str) -> None:
+    removed, freed, kept, size = blob_gc(store)
+    print(
+        f"Blob store : {store}\n"
+        f"Removed    : {removed} blobs ({freed / (1024 * 1024):.2f} MiB)\n"
+        f"Kept       : {kept} blobs ({size / (1024 * 1024):.2f} MiB)"
+    )
+
+
+def stage_buildtree(buildcfg: dict, meta: dict) -> int:
+    '''
+    Stages the whole build tree of the package at meta["rootdir"], running
+    every build stage in order. Returns 0 on success, or the return value of
+    the failed stage.
+    '''
+    calls: list = [
+        mk_buildtree,
+        mk_copyright,
+        mk_shwrapper,
+        mk_man,
+        cp_sources,
+        mk_bytecode,
+        mk_control,
+        mk_postrm,
+        mk_md5sums
+    ]
+    for call in calls:
+        with timed_stage(call.__name__):
+            result: int = call(buildcfg, meta)
+        if (result != 0):
+            return result
+    return 0
+
+
+def build(buildcfgfile: str, outdir: str, options: dict) -> str:
+    '''
+    Builds the package described by the build config file buildcfgfile into
+    outdir, and returns the path of the .deb file. options is a dictionary with
+    the "keep-buildtree", "use-debstdname" and "use-dpkg" keys, as returned by
+    parse_args_build(). With the "pkgmgrs" option, the package is built for
+    each of those package managers instead (see build_targets()), and the
+    paths of the .deb files are returned one per line. Returns an empty string
+    on error, with errno and errdesc set.
+    '''
+    with timed_stage("getcfg"):
+        buildcfg: dict = getcfg(buildcfgfile)
+    if (buildcfg == {}):
+        return ""
+    if (options["pkgmgrs"] != []):
+        return build_targets(buildcfg, outdir, options)
+    return build_target(buildcfg, outdir, options)
+
+
+def build_target(buildcfg: dict, outdir: str, options: dict) -> str:
+    '''
+    Builds the package described by the build configuration into outdir (see
+    build()), and returns the path of the .deb file.
+    '''
+    with timed_stage("get_buildmeta"):
+        meta: dict = get_buildmeta(buildcfg, outdir, options)
+    if (meta == {}):
+        return ""
+
+    cachedir: str = options["cache-dir"]
+    cachekey: str = ""
+    if (cachedir != ""):
+        debname: str = get_debname(meta, options["use-debstdname"])
+        with timed_stage("cache_fetch"):
+            cachekey = get_cache_key(buildcfg, options, meta["manifest"])
+            hit: bool = cachekey != "" and \
+                cache_fetch(cachedir, cachekey, debname,
+                            options["file-list"])
+        if (cachekey == ""):
+            return ""
+        if (hit):
+            return debname
+
+    stage: bool = options["keep-buildtree"] or options["use-dpkg"]
+    if (stage and stage_buildtree(buildcfg, meta) != 0):
+        return ""
+
+    debname: str = ""
+    if (not options["use-dpkg"]):
+        with timed_stage("write_package"):
+            debname = write_package(buildcfg, meta,
+                                    options["use-debstdname"], stage)
+    else:
+        with timed_stage("build_package"):
+            debname = build_package(meta, options["use-debstdname"])
+
+    if (debname != "" and stage and not options["keep-buildtree"]):
+        with timed_stage("rmtree"):
+            shutil.rmtree(meta["rootdir"])
+    if (debname != "" and cachekey != ""):
+        with timed_stage("cache_store"):
+            cache_store(cachedir, cachekey, debname, options["cache-size"])
+    return debname
+
+
+def build_targets(buildcfg: dict, outdir: str, options: dict) -> str:
+    '''
+    Builds the package described by the build configuration into outdir for
+    each of the package managers in options["pkgmgrs"], in place of its own,
+    and returns the paths of the .deb files, one per line. With the built-in
+    writer, the payload is planned, read and hashed once for all of them (see
+    write_packages()); with -k or -d, they are staged and built in turn.
+    Packages found in the build cache are not rebuilt. Returns an empty string
+    on error.
+    '''
+    pkgmgrs: list = options["pkgmgrs"]
+    if (options["keep-buildtree"] or options["use-dpkg"]):
+        debnames: list = []
+        for pkgmgr in pkgmgrs:
+            debname: str = build_target(dict(buildcfg, pkgmgr = pkgmgr),
+                                        outdir, options)
+            if (debname == ""):
+                return ""
+            debnames.append(debname)
+        return "\n".join(debnames)
+
+    metas: list = []
+    with timed_stage("get_buildmeta"):
+        for pkgmgr in pkgmgrs:
+            meta: dict = get_buildmeta(dict(buildcfg, pkgmgr = pkgmgr),
+                                       outdir, options)
+            if (meta == {}):
+                return ""
+            metas.append(meta)
+    debnames = [get_debname(meta, options["use-debstdname"])
+                for meta in metas]
+
+    cachedir: str = options["cache-dir"]
+    cachekeys: list = []
+    missing: list = list(range(len(metas)))
+    if (cachedir != ""):
+        with timed_stage("cache_fetch"):
+            cachekeys = get_cache_keys(buildcfg, options, pkgmgrs,
+                                       metas[0]["manifest"])
+            if (cachekeys == []):
+                return ""
+            missing = [i for i in missing
+                       if not cache_fetch(cachedir, cachekeys[i], debnames[i],
+                                          options["file-list"])]
+
+    if (missing != []):
+        with timed_stage("write_packages"):
+            built: list = write_packages(buildcfg,
+                                         [metas[i] for i in missing],
+                                         options["use-debstdname"])
+        if (built == []):
+            return ""
+    if (cachekeys != []):
+        with timed_stage("cache_store"):
+            for i in missing:
+                cache_store(cachedir, cachekeys[i], debnames[i],
+                            options["cache-size"])
+    return "\n".join(debnames)
+
+
+def build_worker(buildcfgfile: str, outdir: str, options: dict) -> tuple:
+    '''
+    Runs build() in a batch worker process. Returns the .deb file path along
+    with the error code and message of the build, if it failed, and the
+    seconds it took. Exceptions are returned as failed builds, so that they
+    do not abort the batch.
+    '''
+    start: float = time.perf_counter()
+    try:
+        debname: str = build(buildcfgfile, outdir, options)
+    except OSError as error:
+        return ("", ERR_WRITE_FAILED, str(error),
+                time.perf_counter() - start)
+    except ValueError as error:
+        # E.g. UnicodeDecodeError, for build configs that are not UTF-8.
+        return ("", ERR_BAD_CONFIG, f"Could not read \"{buildcfgfile}\": "
+                f"{error}", time.perf_counter() - start)
+    except Exception as error:
+        return ("", ERR_BUILD_FAILED, f"{type(error).__name__}: {error}",
+                time.perf_counter() - start)
+    error: tuple = get_last_error()
+    return (debname, error[0], error[1], time.perf_counter() - start)
+
+
+def parse_depends(value: str) -> list:
+    '''
+    Returns the package names in the value of a relationship field (e.g.,
+    "Depends"), alternatives included, without their version constraints,
+    architecture qualifiers and restrictions.
+    '''
+    return re.findall(r"(?:^|[,|])\s*([a-z0-9][a-z0-9+.-]+)", value)
+
+
+def batch_deps(buildcfgs: list) -> list:
+    '''
+    Returns the dependencies between the build configs of a batch, as a list
+    of sets: the set at index i holds the indexes of the build configs
+    building a package that the package of buildcfgs[i] names in its
+    DEPENDS_FIELDS (any of the alternatives). Only the control sections are
+    read. Build configs that cannot be read have no dependencies; building
+    them reports the error.
+    '''
+    names: list = []
+    fields: list = []
+    for buildcfgfile in buildcfgs:
+        try:
+            buildcfg: dict = getcfg(buildcfgfile, {"control"})
+        except (OSError, ValueError):
+            buildcfg = {}
+        control: dict = parse_control(buildcfg.get("control", ""))
+        names.append(control.get("Package", ""))
+        fields.append(" , ".join(control.get(field, "")
+                                 for field in DEPENDS_FIELDS))
+    providers: dict = {}
+    for i, name in enumerate(names):
+        if (name != ""):
+            providers.setdefault(name, set()).add(i)
+    return [{dep for name in parse_depends(value)
+             for dep in providers.get(name, ()) if dep != i}
+            for i, value in enumerate(fields)]
+
+
+def batch_cycle(deps: list) -> tuple:
+    '''
+    Sorts the dependency graph of a batch (see batch_deps()) topologically.
+    Returns the build configs (as indexes) in dependency order, and a
+    dependency cycle, from a build config back to itself, or an empty list
+    if there is none. The build configs in a cycle, or depending on one, are
+    left out of the order.
+    '''
+    waiting: list = [len(depset) for depset in deps]
+    dependents: list = [[] for _ in deps]
+    for i, depset in enumerate(deps):
+        for dep in depset:
+            dependents[dep].append(i)
+    order: list = [i for i, count in enumerate(waiting) if count == 0]
+    for i in order:
+        for dependent in dependents[i]:
+            waiting[dependent] -= 1
+            if (waiting[dependent] == 0):
+                order.append(dependent)
+    if (len(order) == len(deps)):
+        return (order, [])
+    # Every build config left has a dependency left: following them from
+    # any of these ends in a cycle.
+    left: set = set(range(len(deps))) - set(order)
+    path: list = []
+    seen: dict = {}
+    node: int = min(left)
+    while (node not in seen):
+        seen[node] = len(path)
+        path.append(node)
+        node = min(deps[node] & left)
+    return (order, path[seen[node] :] + [node])
+
+
+def show_critical_path(buildcfgs: list, deps: list, times: dict,
+                       wall: float) -> None:
+    '''
+    Prints on stderr the critical path of a batch: the chain of dependent
+    builds that took the longest in total, from the seconds each build took
+    (times, by index), which no number of jobs could have made shorter.
+    '''
+    finish: dict = {}
+    previous: dict = {}
+    for i in times:
+        built: list = [dep for dep in deps[i] if dep in finish]
+        previous[i] = max(built, key = finish.get) if built != [] else None
+        finish[i] = times[i] + (finish[previous[i]] if built != [] else 0.0)
+    path: list = []
+    node: int = max(finish, key = finish.get)
+    while (node is not None):
+        path.insert(0, node)
+        node = previous[node]
+    lines: list = [
+        f"Critical path: {len(path)} package(s), {finish[path[-1]]:.3f}s "
+        f"(batch: {wall:.3f}s)"
+    ]
+    for i in path:
+        lines.append(f"{times[i]:>10.3f}s  {buildcfgs[i]}")
+    print("\n".join(lines), file = sys.stderr)
+
+
+def build_batch(parsed_args: dict) -> int:
+    '''
+    Builds all the build configs of a batch over a pool of worker processes,
+    in the order of the dependencies between their packages (see
+    batch_deps()), printing the result of each build as soon as it finishes.
+    A package is built once the packages of the batch it depends on are.
+    Of the packages ready to build, those with the longest chain of
+    dependents waiting on them are started first.
+
+    A failed build only skips the packages that depend on it: the others are
+    still built. A dependency cycle fails the batch before anything is
+    built, unless parsed_args["keep-going"] is set, in which case only the
+    packages in the cycle or depending on it are not built. Prints the critical path of the batch at the end (see
+    show_critical_path()). Returns the number of packages that failed to
+    build or were not built.
+    '''
+    buildcfgs: list = parsed_args["buildcfgs"]
+    start: float = time.perf_counter()
+    deps: list = batch_deps(buildcfgs)
+    order, cycle = batch_cycle(deps)
+    failed: int = 0
+    if (cycle != []):
+        print(
+            f"spal: Error in building \"{buildcfgs[cycle[0]]}\" "
+            f"(errorcode: {ERR_DEPENDENCY_CYCLE}).\n"
+            f"Error message:\nDependency cycle: " +
+            " -> ".join(f"\"{buildcfgs[i]}\"" for i in cycle),
+            flush = True
+        )
+        if (not parsed_args["keep-going"]):
+            return len(buildcfgs)
+
+    dependents: list = [[] for _ in deps]
+    for i, depset in enumerate(deps):
+        for dep in depset:
+            dependents[dep].append(i)
+    heights: dict = {}
+    for i in reversed(order):
+        heights[i] = 1 + max((heights.get(dependent, 0)
+                              for dependent in dependents[i]), default = 0)
+    waiting: list = [len(depset) for depset in deps]
+    ready: list = [i for i in order if waiting[i] == 0]
+    times: dict = {}
+    finished: set = set()
+    jobs: int = min(parsed_args["jobs"], max(len(buildcfgs), 1))
+    with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as pool:
+        running: dict = {}
+        while (True):
+            ready.sort(key = lambda i: (heights[i], -i))
+            while (ready != [] and len(running) < jobs):
+                i: int = ready.pop()
+                running[pool.submit(build_worker, buildcfgs[i],
+                                    parsed_args["outdir"], parsed_args)] = i
+            if (running == {}):
+                break
+            done, _ = concurrent.futures.wait(
+                running, return_when = concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                finished.add(i)
+                debname, error_no, error_desc, seconds = future.result()
+                if (debname == ""):
+                    failed += 1
+                    print(
+                        f"spal: Error in building \"{buildcfgs[i]}\" "
+                        f"(errorcode: {error_no}).\n"
+                        f"Error message:\n{error_desc}",
+                        flush = True
+                    )
+                    continue
+                times[i] = seconds
+                print(debname, flush = True)
+                for dependent in dependents[i]:
+                    waiting[dependent] -= 1
+                    if (waiting[dependent] == 0):
+                        ready.append(dependent)
+
+    for i in range(len(buildcfgs)):
+        if (i in finished):
+            continue
+        failed += 1
+        if (i in cycle):
+            continue
+        print(
+            f"spal: Skipped \"{buildcfgs[i]}\": depends on " +
+            ", ".join(f"\"{buildcfgs[dep]}\"" for dep in sorted(deps[i])
+                      if dep not in times) + ", not built.",
+            flush = True
+        )
+    if (len(buildcfgs) > 1 and times != {}):
+        show_critical_path(buildcfgs, deps, times,
+                           time.perf_counter() - start)
+    return failed
+
+
+class _InotifyWatcher:
+    '''
+    Reports the paths changed under a set of watched files and directories,
+    with the inotify API of Linux (called through ctypes). Directories are
+    watched recursively, and files through their parent directory, so that
+    files replaced by a rename (as many editors do) are still reported.
+    Raises OSError if inotify is not available.
+    '''
+    def __init__(self) -> None:
+        self.libc: ctypes.CDLL = ctypes.CDLL(None, use_errno = True)
+        self.fd: int = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if (self.fd < 0):
+            raise OSError(ctypes.get_errno(), "inotify_init1() failed")
+        self.dirs: dict = {}
+
+    def add_dir(self, path: str) -> None:
+        wd: int = self.libc.inotify_add_watch(self.fd, os.fsencode(path),
+                                              INOTIFY_MASK)
+        if (wd >= 0):
+            self.dirs[wd] = path
+
+    def watch(self, path: str) -> None:
+        if (not os.path.isdir(path)):
+            self.add_dir(os.path.dirname(path) or ".")
+            return
+        self.add_dir(path)
+        with os.scandir(path) as it:
+            for child in it:
+                if (child.is_dir()):
+                    self.watch(child.path)
+
+    def read(self, timeout: float = None) -> set:
+        '''
+        Waits up to timeout seconds (forever if None) for changes, and returns
+        the changed paths. An empty path means that events were lost, and
+        that anything may have changed.
+        '''
+        if (select.select([self.fd], [], [], timeout)[0] == []):
+            return set()
+        try:
+            data: bytes = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set()
+        paths: set = set()
+        offset: int = 0
+        while (offset < len(data)):
+            wd, mask, _, namelen = struct.unpack_from("iIII", data, offset)
+            name: bytes = data[offset + 16 : offset + 16 + namelen]
+            offset += 16 + namelen
+            if (mask & IN_Q_OVERFLOW):
+                paths.add("")
+                continue
+            if (mask & IN_IGNORED):
+                self.dirs.pop(wd, None)
+                continue
+            if (wd not in self.dirs):
+                continue
+            path: str = os.path.join(self.dirs[wd],
+                                     os.fsdecode(name.rstrip(b"\0")))
+            if (mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO)):
+                self.watch(path)
+            paths.add(path)
+        return paths
 
-    if (args[-1].startswith("-") or
-        args[-2].startswith("-")):
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class _PollingWatcher:
+    '''
+    Reports the paths changed under a set of watched files and directories,
+    by comparing the status of every file every WATCH_POLL_INTERVAL seconds.
+    Used where inotify is not available.
+    '''
+    def __init__(self) -> None:
+        self.roots: list = []
+        self.files: dict = {}
+
+    def scan(self, path: str, files: dict) -> None:
+        try:
+            st: os.stat_result = os.stat(path)
+        except OSError:
+            return
+        files[path] = (st.st_mtime_ns, st.st_size, st.st_mode, st.st_ino)
+        if (stat.S_ISDIR(st.st_mode)):
+            with os.scandir(path) as it:
+                for child in it:
+                    self.scan(child.path, files)
+
+    def watch(self, path: str) -> None:
+        self.roots.append(path)
+        self.scan(path, self.files)
+
+    def read(self, timeout: float = None) -> set:
+        '''
+        Waits up to timeout seconds (forever if None) for changes, and returns
+        the changed paths.
+        '''
+        while (True):
+            time.sleep(WATCH_POLL_INTERVAL if timeout is None else timeout)
+            files: dict = {}
+            for root in self.roots:
+                self.scan(root, files)
+            paths: set = {path for path in files.keys() | self.files.keys()
+                          if files.get(path) != self.files.get(path)}
+            self.files = files
+            if (paths != set() or timeout is not None):
+                return paths
+
+    def close(self) -> None:
+        pass
+
+
+def mk_watcher(paths: list) -> object:
+    '''
+    Returns a watcher (see _InotifyWatcher and _PollingWatcher) for the given
+    files and directories, using inotify where available.
+    '''
+    try:
+        watcher: object = _InotifyWatcher()
+    except (OSError, AttributeError):
+        watcher = _PollingWatcher()
+    for path in paths:
+        watcher.watch(path)
+    return watcher
+
+
+def restage_sources(buildcfg: dict, meta: dict, paths: set) -> int:
+    '''
+    Restages the changed source paths in the build tree: changed files and new
+    directories are staged again, and deleted ones are removed from the tree.
+    The times and permissions of changed directories are copied again as well.
+    Returns the number of paths restaged; paths that are not under a source,
+    or are excluded, are ignored.
+    '''
+    destroot: str = os.path.join(meta["rootdir"], meta["libdir"])
+    mode: str = meta["options"]["stage-mode"]
+    count: int = 0
+    dirs: list = []
+    for src in buildcfg["sources"]:
+        srcpath: str = os.path.abspath(src)
+        dest: str = os.path.join(destroot, os.path.basename(src))
+        for path in sorted(paths):
+            if (path != srcpath and not path.startswith(srcpath + os.sep)):
+                continue
+            name: str = os.path.basename(src) + \
+                path[len(srcpath):].replace(os.sep, "/")
+            isdir: bool = os.path.isdir(path)
+            if (is_excluded(meta["exclude"], name, isdir, True)):
+                continue
+            count += 1
+            target: str = dest + path[len(srcpath):]
+            if (os.path.isdir(target) and not os.path.islink(target)):
+                if (isdir):
+                    # An existing directory: its changed contents are
+                    # reported on their own.
+                    dirs.append((path, target))
+                    continue
+                shutil.rmtree(target)
+            if (isdir):
+                files: list = []
+                walk_sources(path, target, files, dirs, meta["exclude"], name)
+                for file, filedest in files:
+                    stage_file(file, filedest, mode, meta)
+            elif (os.path.exists(path)):
+                os.makedirs(os.path.dirname(target), exist_ok = True)
+                stage_file(path, target, mode, meta)
+            elif (os.path.lexists(target)):
+                os.remove(target)
+                if (meta["options"]["precompile"] and
+                    target.endswith(".py") and
+                    os.path.lexists(bytecode_name(target))):
+                    os.remove(bytecode_name(target))
+            if (path != srcpath):
+                dirs.append((os.path.dirname(path), os.path.dirname(target)))
+    for src, dest in reversed(dirs):
+        if (os.path.isdir(src) and os.path.isdir(dest)):
+            shutil.copystat(src, dest)
+    return count
+
+
+def watch(buildcfgfile: str, outdir: str, options: dict) -> int:
+    '''
+    Builds the package like build() does with -k, then watches the build
+    config file and the sources, and rebuilds the package on every change
+    until interrupted. The build config is kept parsed in memory: when only
+    sources change, just the changed files are restaged in the build tree,
+    and the sums of the others are reused. When the build config changes,
+    it is parsed again and the whole tree is restaged. The build cache is not
+    used. Returns 1 if the first build fails, else 0.
+    '''
+    global errno, errdesc
+    options = dict(options, **{"keep-buildtree" : True, "cache-dir" : ""})
+    outpath: str = os.path.abspath(outdir) + os.sep
+    cfgpath: str = os.path.abspath(buildcfgfile)
+    sumcache: dict = {}
+    state: dict = {"buildcfg" : {}, "meta" : {}, "watcher" : None}
+
+    def report(debname: str) -> None:
+        if (debname != ""):
+            print(debname, flush = True)
+            return
+        error: tuple = get_last_error()
+        print(
+            f"spal: Error in building package (errorcode: {error[0]}).\n"
+            f"Error message:\n{error[1]}",
+            flush = True
+        )
+
+    def package() -> str:
+        meta: dict = state["meta"]
+        for call in (mk_bytecode, mk_control, mk_md5sums):
+            if (call(state["buildcfg"], meta) != 0):
+                return ""
+        if (options["use-dpkg"]):
+            return build_package(meta, options["use-debstdname"])
+        return write_package(state["buildcfg"], meta,
+                             options["use-debstdname"], True)
+
+    def full_build() -> str:
+        buildcfg: dict = getcfg(buildcfgfile)
+        meta: dict = get_buildmeta(buildcfg, outdir, options) \
+            if buildcfg != {} else {}
+        if (meta == {}):
+            return ""
+        if (state["watcher"] is not None):
+            state["watcher"].close()
+        state["watcher"] = mk_watcher([cfgpath] + [
+            os.path.abspath(src) for src in buildcfg["sources"]
+            if os.path.basename(src) not in buildcfg["embedded"]
+        ])
+        meta["sumcache"] = sumcache
+        state["buildcfg"] = buildcfg
+        state["meta"] = meta
+        if (os.path.isdir(meta["rootdir"])):
+            shutil.rmtree(meta["rootdir"])
+        if (stage_buildtree(buildcfg, meta) != 0):
+            return ""
+        return package()
+
+    debname: str = full_build()
+    report(debname)
+    if (debname == ""):
+        return 1
+
+    try:
+        while (True):
+            paths: set = state["watcher"].read()
+            while (True):
+                more: set = state["watcher"].read(WATCH_SETTLE_TIME)
+                if (more == set()):
+                    break
+                paths |= more
+            paths = {path for path in paths if not path.startswith(outpath)}
+            try:
+                if (cfgpath in paths or "" in paths):
+                    report(full_build())
+                elif (restage_sources(state["buildcfg"], state["meta"],
+                                      paths) != 0):
+                    report(package())
+            except OSError as error:
+                errno = ERR_WRITE_FAILED
+                errdesc = str(error)
+                report("")
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def parse_args_serve(args: list) -> dict:
+    if (args == [] or args[0] != "serve"):
         return {}
+    parsed_args: dict = {
+        "socket" : get_socket_path(),
+        "jobs"   : os.cpu_count() or 1,
+        "queue"  : SERVE_QUEUE_SIZE
+    }
+    i: int = 1
+    arg_count: int = len(args)
+    while (i < arg_count):
+        if (i + 1 == arg_count):
+            return {}
+        if (args[i] == "--socket" and not args[i + 1].startswith("-")):
+            parsed_args["socket"] = args[i + 1]
+        elif (args[i] in {"-j", "--jobs", "--queue"} and
+              args[i + 1].isdigit() and
+              (int(args[i + 1]) > 0 or args[i] == "--queue")):
+            parsed_args["queue" if args[i] == "--queue" else "jobs"] = \
+                int(args[i + 1])
+        else:
+            return {}
+        i += 2
+    return parsed_args
 
-    parsed_args["outdir"] = args[-1]
-    parsed_args["buildcfg"] = args[-2]
-    parsed_args["keep-buildtree"] = False
-    parsed_args["use-debstdname"] = False
 
-    valid_options: set = {"-k", "--keep-buildtree", "-s", "--use-debstdname"}
-    for arg in args[0:-2]:
-        if (arg in {"-k", "--keep-buildtree"}):
-            parsed_args["keep-buildtree"] = True
-        elif (arg in {"-s", "--use-debstdname"}):
-            parsed_args["use-debstdname"] = True
+def run_gencfg(parsed_args: dict) -> tuple:
+    '''
+    Generates a build config as the command line does, and returns the text
+    to print along with the exit status.
+    '''
+    if (mk_cfg(parsed_args) != 0):
+        error: tuple = get_last_error()
+        return (
+            f"spal: Error in generating build config (errorcode: {error[0]}).\n"
+            f"Error message:\n{error[1]}",
+            1
+        )
+    return (cfgfile, 0)
+
+
+def run_build(parsed_args: dict) -> tuple:
+    '''
+    Builds a package as the command line does, and returns the text to print
+    along with the exit status.
+    '''
+    debname: str = build(parsed_args["buildcfg"], parsed_args["outdir"],
+                         parsed_args)
+    if (debname == ""):
+        error: tuple = get_last_error()
+        return (
+            f"spal: Error in building package (errorcode: {error[0]}).\n"
+            f"Error message:\n{error[1]}",
+            1
+        )
+    return (debname, 0)
+
+
+def serve_request(request: dict) -> dict:
+    '''
+    Runs a request of the build daemon in a worker process, like main() would
+    run the same command line, from the same directory, with the same umask
+    and SERVE_ENV environment variables. Returns the text to print and the
+    exit status as a dictionary, or {"local" : True} if the command must be
+    run by the client instead.
+    '''
+    args: list = request["args"]
+    parsed_args_gencfg: dict = parse_args_gencfg(args)
+    parsed_args_build: dict = parse_args_build(args)
+    if (parsed_args_gencfg == {} and
+        (parsed_args_build == {} or parsed_args_build["watch"])):
+        return {"local" : True}
+    try:
+        os.chdir(request["cwd"])
+        os.umask(request["umask"])
+        for name in SERVE_ENV:
+            if (name in request["env"]):
+                os.environ[name] = request["env"][name]
+            else:
+                os.environ.pop(name, None)
+        output, exitcode = run_gencfg(parsed_args_gencfg) \
+            if parsed_args_gencfg != {} else run_build(parsed_args_build)
+    except OSError as error:
+        output = (
+            f"spal: Error in building package (errorcode: {ERR_WRITE_FAILED}).\n"
+            f"Error message:\n{error}"
+        )
+        exitcode = 1
+    return {"output" : output, "exitcode" : exitcode}
+
+
+def serve_connection(conn: socket.socket, pool: object,
+                     slots: threading.BoundedSemaphore) -> None:
+    '''
+    Serves a client connection of the build daemon: reads one JSON request
+    (see serve_client()), runs it on the worker pool, and sends back the JSON
+    response. When all the slots of the queue are taken, the client is told
+    right away to run the command itself. Errors raised by the request are
+    sent back as a failed build, so that the client does not run it again.
+    Connections from other users are closed unanswered.
+    '''
+    with conn:
+        creds: bytes = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                       struct.calcsize("3i"))
+        if (struct.unpack("3i", creds)[1] != os.getuid()):
+            return
+        try:
+            request: dict = json.loads(conn.makefile("rb").readline())
+        except (OSError, ValueError):
+            return
+        if (not isinstance(request, dict) or
+            not isinstance(request.get("args"), list) or
+            not isinstance(request.get("cwd"), str) or
+            not isinstance(request.get("umask"), int) or
+            not isinstance(request.get("env"), dict)):
+            return
+        response: dict = {"local" : True}
+        if (slots.acquire(blocking = False)):
+            try:
+                response = pool.submit(serve_request, request).result()
+            except concurrent.futures.process.BrokenProcessPool:
+                pass
+            except Exception as error:
+                response = {
+                    "output"   : f"spal: Error in building package "
+                                 f"(errorcode: {ERR_BUILD_FAILED}).\n"
+                                 f"Error message:\n"
+                                 f"{type(error).__name__}: {error}",
+                    "exitcode" : 1
+                }
+            finally:
+                slots.release()
+        try:
+            conn.sendall(json.dumps(response).encode() + b"\n")
+        except OSError:
+            pass
+
+
+def serve(parsed_args: dict) -> int:
+    '''
+    Runs the build daemon: listens on the Unix socket parsed_args["socket"]
+    (created with permissions 0600), and runs the build and build config
+    generation requests of spal clients on a pool of parsed_args["jobs"]
+    worker processes, with up to parsed_args["queue"] more requests waiting.
+    Prints the socket path once listening, and serves until interrupted.
+    Returns -1 if the socket cannot be created, with errno and errdesc set.
+    '''
+    global errno, errdesc
+    path: str = parsed_args["socket"]
+    server: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        if (os.path.exists(path)):
+            # A socket left behind by a daemon which is not running any more
+            # is replaced.
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                if (probe.connect_ex(path) == 0):
+                    errno = ERR_DAEMON_RUNNING
+                    errdesc = f"A build daemon is already listening on " \
+                              f"\"{path}\"."
+                    return -1
+            os.remove(path)
+        umask: int = os.umask(0o177)
+        try:
+            server.bind(path)
+        finally:
+            os.umask(umask)
+        server.listen(parsed_args["queue"] + parsed_args["jobs"])
+    except OSError as error:
+        server.close()
+        errno = ERR_WRITE_FAILED
+        errdesc = str(error)
+        return -1
+
+    print(path, flush = True)
+    slots: threading.BoundedSemaphore = threading.BoundedSemaphore(
+        parsed_args["jobs"] + parsed_args["queue"])
+    # Stop on SIGTERM as on Ctrl+C, which workers leave to the daemon. They
+    # are started from a fork server rather than forked from this process,
+    # which runs connection threads.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers = parsed_args["jobs"],
+            mp_context = multiprocessing.get_context("forkserver"),
+            initializer = signal.signal,
+            initargs = (signal.SIGINT, signal.SIG_IGN)
+        ) as pool:
+        try:
+            while (True):
+                conn, _ = server.accept()
+                threading.Thread(target = serve_connection,
+                                 args = (conn, pool, slots),
+                                 daemon = True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            os.remove(path)
+    return 0
+
+
+def parse_args_repo(args: list) -> dict:
+    if (args == [] or args[0] != "repo"):
+        return {}
+    parsed_args: dict = {"action" : "refresh", "dist" : "stable",
+                         "comp" : "main", "keep" : 0, "repodir" : "",
+                         "items" : []}
+    i: int = 1
+    if (i < len(args) and args[i] in {"add", "remove", "prune"}):
+        parsed_args["action"] = args[i]
+        i += 1
+    arg_count: int = len(args)
+    while (i < arg_count - 1 and args[i].startswith("-")):
+        if (args[i] == "--dist" and not args[i + 1].startswith("-")):
+            parsed_args["dist"] = args[i + 1]
+        elif (args[i] == "--comp" and parsed_args["action"] != "refresh" and
+              not args[i + 1].startswith("-")):
+            parsed_args["comp"] = args[i + 1]
+        elif (args[i] == "--keep" and parsed_args["action"] == "prune" and
+              args[i + 1].isdigit() and int(args[i + 1]) > 0):
+            parsed_args["keep"] = int(args[i + 1])
         else:
             return {}
+        i += 2
+    if (i == arg_count or args[i].startswith("-")):
+        return {}
+    parsed_args["repodir"] = args[i]
+    parsed_args["items"] = args[i + 1 :]
+    if ((parsed_args["action"] in {"add", "remove"}) !=
+        (parsed_args["items"] != []) or
+        (parsed_args["action"] == "prune") != (parsed_args["keep"] > 0)):
+        return {}
+    return parsed_args
+
 
+def parse_args_convert(args: list) -> dict:
+    if (args == [] or args[0] != "convert"):
+        return {}
+    parsed_args: dict = {"embed-sources" : False, "infile" : "",
+                         "outfile" : ""}
+    i: int = 1
+    if (i < len(args) and args[i] == "--embed-sources"):
+        parsed_args["embed-sources"] = True
+        i += 1
+    if (len(args) - i != 2 or args[i].startswith("-") or
+        args[i + 1].startswith("-")):
+        return {}
+    parsed_args["infile"] = args[i]
+    parsed_args["outfile"] = args[i + 1]
     return parsed_args
 
 
-def mk_cfg(parsed_args: dict) -> int:
-    global cfgfile, errno, errdesc
-    cfgfile = os.path.basename(parsed_args["shellscript"]) + "." + \
-        parsed_args["pkgmgr"] + "." + parsed_args["dist"] + "." + \
-        parsed_args["comp"] + ".spalcfg"
-    if (parsed_args["outfile"] != ""):
-        cfgfile = parsed_args["outfile"]
-        cfgfile += ".spalcfg" if not cfgfile.endswith(".spalcfg") else ""
+def parse_args_verify(args: list) -> dict:
+    if (args == [] or args[0] != "verify"):
+        return {}
+    parsed_args: dict = {"jobs" : 0, "package" : ""}
+    i: int = 1
+    arg_count: int = len(args)
+    while (i < arg_count - 1):
+        if (args[i] in {"-j", "--jobs"} and args[i + 1].isdigit() and
+            int(args[i + 1]) >= 1):
+            parsed_args["jobs"] = int(args[i + 1])
+            i += 2
+        else:
+            return {}
+    if (i != arg_count - 1 or args[i].startswith("-")):
+        return {}
+    parsed_args["package"] = args[i]
+    return parsed_args
 
-    shfile: str = parsed_args["shellscript"]
-    if (not os.path.isfile(shfile)):
-        errno = ERR_FILE_NOT_FOUND
-        errdesc = f"File \"{shfile}\" not found."
-        return -1
 
-    ctrlfile: str = parsed_args["control"]
-    if (not os.path.isfile(ctrlfile)):
-        errno = ERR_FILE_NOT_FOUND
-        errdesc = f"File \"{ctrlfile}\" not found."
-        return -1
+class _MemberReader:
+    '''
+    Read-only file object over a single member of an ar archive, so that the
+    member can be streamed (e.g. by tarfile) without being loaded in memory.
+    '''
+    def __init__(self, fileobj, size: int) -> None:
+        self.fileobj = fileobj
+        self.remaining: int = size
 
-    srcrootdir: str = parsed_args["srcroot"]
-    if (srcrootdir != "" and not os.path.isdir(srcrootdir)):
-        errno = ERR_FILE_NOT_FOUND
-        errdesc = f"Source root \"{srcrootdir}\" not found."
-        return -1
+    def read(self, size: int = -1) -> bytes:
+        if (size < 0 or size > self.remaining):
+            size = self.remaining
+        data: bytes = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
 
-    if (srcrootdir == "."):
-        errno = ERR_SRCROOT_IS_CWD
-        errdesc = f"Source root cannot be same as current working directory."
-        return -1
 
-    excluded_files: list = parsed_args["exclude"]
-    if (srcrootdir == "" and excluded_files != []):
-        errno = ERR_SRCROOT_UNSPECIFIED
-        errdesc = f"Attempted to exclude files without specifying source root."
-        return -1
+def deb_members(debfile) -> list:
+    '''
+    Returns the members of the ar archive of a .deb package opened as debfile,
+    as a list of (name, offset, size) tuples. Returns an empty list if debfile
+    is not an ar archive.
+    '''
+    debfile.seek(0)
+    if (debfile.read(len(AR_MAGIC)) != AR_MAGIC):
+        return []
+    members: list = []
+    while (len(header := debfile.read(60)) == 60):
+        name: str = header[0 : 16].decode().strip().rstrip("/")
+        size: int = int(header[48 : 58].decode().strip())
+        members.append((name, debfile.tell(), size))
+        debfile.seek(size + size % 2, os.SEEK_CUR)
+    return members
 
-    manfile: list = parsed_args["man"]
-    if (manfile != "" and not os.path.isfile(manfile)):
-        errno = ERR_FILE_NOT_FOUND
-        errdesc = f"Man file \"{manfile}\" not found."
-        return -1
 
-    copyrightfile: list = parsed_args["copyright"]
-    if (copyrightfile != "" and not os.path.isfile(copyrightfile)):
+def deb_tar_names(tarstream) -> list:
+    '''
+    Returns the names of the files and links (not directories) in the tar
+    stream, without their leading "./".
+    '''
+    names: list = []
+    with tarfile.open(fileobj = tarstream, mode = "r|*") as tar:
+        for tarinfo in tar:
+            if (not tarinfo.isdir()):
+                names.append(tarinfo.name[2:] if tarinfo.name.startswith("./")
+                             else tarinfo.name)
+    return names
+
+
+def deb_info(debname: str) -> dict:
+    '''
+    Returns the control text and the list of installed files of the .deb
+    package debname as a dictionary with the "control" and "files" keys. The
+    list of files is read from the sidecar written along with packages built
+    by spal (see read_file_list()), otherwise the headers of the data archive
+    are streamed through its decompressor; nothing is extracted to disk. Sets
+    errno and errdesc and returns an empty dictionary if debname is not a
+    valid .deb package.
+    '''
+    global errno, errdesc
+    info: dict = {"control" : "", "files" : read_file_list(debname)}
+    try:
+        with open(debname, "rb") as debfile:
+            for name, offset, size in deb_members(debfile):
+                debfile.seek(offset)
+                if (info["control"] != "" and info["files"] is not None):
+                    break
+                if (name.startswith("control.tar")):
+                    with tarfile.open(fileobj = _MemberReader(debfile, size),
+                                      mode = "r|*") as tar:
+                        for tarinfo in tar:
+                            if (tarinfo.name in {"./control", "control"}):
+                                info["control"] = tar.extractfile(
+                                    tarinfo).read().decode()
+                                break
+                elif (name.startswith("data.tar") and info["files"] is None):
+                    info["files"] = deb_tar_names(_MemberReader(debfile, size))
+    except (OSError, ValueError, tarfile.TarError) as error:
+        errno = ERR_BAD_PACKAGE
+        errdesc = f"Could not read \"{debname}\": {error}"
+        return {}
+    if (info["control"] == "" or info["files"] is None):
+        errno = ERR_BAD_PACKAGE
+        errdesc = f"\"{debname}\" is not a valid .deb package."
+        return {}
+    return info
+
+
+def parse_sums(text: str) -> dict:
+    '''
+    Parses the lines ("<digest>  <path>") of a sums file (see SUMS_FILES) into
+    a dictionary of digests keyed by path.
+    '''
+    sums: dict = {}
+    for line in text.splitlines():
+        digest, sep, path = line.partition("  ")
+        if (sep != ""):
+            sums[path] = digest
+    return sums
+
+
+def verify_deb(debname: str) -> tuple:
+    '''
+    Reads the sums files of the .deb package debname, then streams its data
+    archive (nothing is extracted to disk) and hashes every file with the
+    algorithms of the sums files, in a single pass. Returns a tuple of the
+    parsed sums files, keyed by algorithm, and of the digests of the files,
+    keyed by path. Sets errno and errdesc and returns an empty tuple if
+    debname is not a valid .deb package or has no md5sums.
+    '''
+    global errno, errdesc
+    sums: dict = {}
+    digests: dict = {}
+    try:
+        with open(debname, "rb") as debfile:
+            members: list = deb_members(debfile)
+            for name, offset, size in members:
+                debfile.seek(offset)
+                if (name.startswith("control.tar")):
+                    with tarfile.open(fileobj = _MemberReader(debfile, size),
+                                      mode = "r|*") as tar:
+                        for tarinfo in tar:
+                            for algo, sumsname in SUMS_FILES.items():
+                                if (tarinfo.name in {"./" + sumsname,
+                                                     sumsname}):
+                                    sums[algo] = parse_sums(tar.extractfile(
+                                        tarinfo).read().decode())
+                elif (name.startswith("data.tar") and "md5" in sums):
+                    with tarfile.open(fileobj = _MemberReader(debfile, size),
+                                      mode = "r|*") as tar:
+                        for tarinfo in tar:
+                            if (not tarinfo.isreg()):
+                                continue
+                            hashes: dict = {algo : hashlib.new(algo)
+                                            for algo in sums}
+                            fileobj = tar.extractfile(tarinfo)
+                            while (chunk := fileobj.read(COPY_BUFSIZE)):
+                                for digest in hashes.values():
+                                    digest.update(chunk)
+                            path: str = tarinfo.name[2:] \
+                                if tarinfo.name.startswith("./") \
+                                else tarinfo.name
+                            digests[path] = {algo : digest.hexdigest()
+                                             for algo, digest in
+                                             hashes.items()}
+    except (OSError, ValueError, tarfile.TarError) as error:
+        errno = ERR_BAD_PACKAGE
+        errdesc = f"Could not read \"{debname}\": {error}"
+        return ()
+    if (members == []):
+        errno = ERR_BAD_PACKAGE
+        errdesc = f"\"{debname}\" is not a valid .deb package."
+        return ()
+    if ("md5" not in sums):
+        errno = ERR_BAD_PACKAGE
+        errdesc = f"\"{debname}\" has no md5sums."
+        return ()
+    return (sums, digests)
+
+
+def verify_installed(package: str, jobs: int = 0) -> tuple:
+    '''
+    Reads the sums files of the installed package from the dpkg database
+    ($DPKG_ADMINDIR, or var/lib/dpkg under $DPKG_ROOT), then hashes its
+    installed files with their algorithms over a pool of jobs threads (see
+    hash_files()). Returns a tuple like verify_deb() does, without the files
+    that are missing. Sets errno and errdesc and returns an empty tuple if the
+    package has no md5sums in the database.
+    '''
+    global errno, errdesc
+    root: str = os.environ.get("DPKG_ROOT", "") or "/"
+    admindir: str = os.environ.get("DPKG_ADMINDIR", "") or \
+        os.path.join(root, DPKG_ADMINDIR)
+    sums: dict = {}
+    for algo, sumsname in SUMS_FILES.items():
+        sumspath: str = os.path.join(admindir, "info",
+                                     f"{package}.{sumsname}")
+        if (os.path.isfile(sumspath)):
+            with open(sumspath) as sumsfile:
+                sums[algo] = parse_sums(sumsfile.read())
+    if ("md5" not in sums):
         errno = ERR_FILE_NOT_FOUND
-        errdesc = f"Copyright file \"{copyrightfile}\" not found."
-        return -1
+        errdesc = f"Package \"{package}\" is not installed, or has no " \
+            f"md5sums."
+        return ()
+    paths: dict = {path : os.path.join(root, path)
+                   for algo in sums for path in sums[algo]}
+    paths = {path : fullpath for path, fullpath in paths.items()
+             if os.path.isfile(fullpath)}
+    hashed: dict = hash_files(list(paths.values()), tuple(sums), jobs)
+    return (sums, {path : hashed[fullpath]
+                   for path, fullpath in paths.items()})
 
-    spalconfig = open(cfgfile, 'w')
-    spalconfig.writelines([
-        "[PACKAGE-MANAGER]\n",
-        parsed_args["pkgmgr"] + "\n",
-        "[END]\n",
-        "\n\n",
-        "[DISTRIBUTION]\n",
-        parsed_args["dist"] + "\n",
-        "[END]\n",
-        "\n\n",
-        "[COMPONENT]\n",
-        parsed_args["comp"] + "\n",
-        "[END]\n",
-        "\n\n"
-    ])
 
-    shellscript: list = []
-    with open(shfile) as file:
-        shellscript = file.readlines()
-    spalconfig.writelines([
-        "[SHELLSCRIPT]\n"
-    ] + shellscript + ["[END]\n", "\n\n"])
-    
-    control: list = []
-    with open(ctrlfile) as file:
-        control = file.readlines()
-    spalconfig.writelines([
-        "[CONTROL]\n"
-    ] + control + ["[END]\n", "\n\n"])
+def verify_package(parsed_args: dict) -> list:
+    '''
+    Checks the files of a .deb package, or of an installed package if
+    parsed_args["package"] is not a file, against its sums files (see
+    verify_deb() and verify_installed()). Returns a list of (path, status)
+    tuples, where status is one of "OK", "FAILED (<algorithms>)", "MISSING",
+    or "UNLISTED" for files of a .deb that no sums file lists. Returns an
+    empty tuple (setting errno and errdesc) on error.
+    '''
+    package: str = parsed_args["package"]
+    checked: tuple = verify_deb(package) if os.path.isfile(package) else \
+        verify_installed(package, parsed_args["jobs"])
+    if (checked == ()):
+        return ()
+    sums, digests = checked
+    report: list = []
+    for path in dict.fromkeys(path for algo in sums for path in sums[algo]):
+        if (path not in digests):
+            report.append((path, "MISSING"))
+            continue
+        failed: list = [algo for algo in sums if path in sums[algo] and
+                        sums[algo][path] != digests[path][algo]]
+        report.append((path, f"FAILED ({', '.join(failed)})" if failed
+                       else "OK"))
+    for path in digests:
+        if (not any(path in sums[algo] for algo in sums)):
+            report.append((path, "UNLISTED"))
+    return report
 
-    if (srcrootdir != ""):
-        spalconfig.write("[SOURCES]\n")
-        for src in os.listdir(srcrootdir):
-            if (src not in excluded_files):
-                spalconfig.write(
-                    os.path.join(srcrootdir, src) + "\n"
-                )
-        spalconfig.writelines(["[END]\n", "\n\n"])
 
-    if (manfile != ""):
-        man: list = []
-        with open(manfile) as file:
-            man = file.readlines()
-        spalconfig.writelines([
-            "[MAN]\n"
-        ] + man + ["[END]\n", "\n\n"])
+def compare_versions(version1: str, version2: str) -> int:
+    '''
+    Compares two Debian package versions ([epoch:]upstream[-revision]) like
+    dpkg does. Returns a negative number, zero or a positive number if
+    version1 is older than, the same as or newer than version2.
+    '''
+    def split(version: str) -> tuple:
+        epoch, _, rest = version.partition(":") if ":" in version else \
+            ("0", "", version)
+        upstream, _, revision = rest.rpartition("-") if "-" in rest else \
+            (rest, "", "0")
+        return (int(epoch or "0"), upstream, revision)
+
+    def order(char: str) -> int:
+        if (char == "~"):
+            return -1
+        if (char.isalpha()):
+            return ord(char)
+        return ord(char) + 256
+
+    def compare(part1: str, part2: str) -> int:
+        while (part1 != "" or part2 != ""):
+            text1: str = re.match(r"\D*", part1).group()
+            text2: str = re.match(r"\D*", part2).group()
+            for i in range(max(len(text1), len(text2))):
+                order1: int = order(text1[i]) if i < len(text1) else 0
+                order2: int = order(text2[i]) if i < len(text2) else 0
+                if (order1 != order2):
+                    return order1 - order2
+            part1 = part1[len(text1) :]
+            part2 = part2[len(text2) :]
+            digits1: str = re.match(r"\d*", part1).group()
+            digits2: str = re.match(r"\d*", part2).group()
+            if (int(digits1 or "0") != int(digits2 or "0")):
+                return int(digits1 or "0") - int(digits2 or "0")
+            part1 = part1[len(digits1) :]
+            part2 = part2[len(digits2) :]
+        return 0
+
+    epoch1, upstream1, revision1 = split(version1)
+    epoch2, upstream2, revision2 = split(version2)
+    if (epoch1 != epoch2):
+        return epoch1 - epoch2
+    return compare(upstream1, upstream2) or compare(revision1, revision2)
 
-    if (copyrightfile != ""):
-        copyright: list = []
-        with open(copyrightfile) as file:
-            copyright = file.readlines()
-        spalconfig.writelines([
-            "[COPYRIGHT]\n"
-        ] + copyright + ["[END]\n", "\n\n"])
 
-    spalconfig.close()
+def repo_open_index(repodir: str):
+    '''
+    Opens the package index of the repository (REPO_INDEX_FILE, an SQLite
+    database created on first use), and returns the connection, in autocommit
+    mode: callers group their changes in a transaction of their own. The
+    index holds the metadata, hashes and file list of every package of the
+    repository, by path relative to repodir.
+    '''
+    db: sqlite3.Connection = sqlite3.connect(
+        os.path.join(repodir, REPO_INDEX_FILE), isolation_level = None)
+    db.executescript(
+        "CREATE TABLE IF NOT EXISTS packages ("
+        " filename TEXT PRIMARY KEY, dist TEXT, comp TEXT, package TEXT,"
+        " version TEXT, size INTEGER, mtime INTEGER, control TEXT,"
+        " hashes TEXT);"
+        "CREATE INDEX IF NOT EXISTS packages_comp ON packages (dist, comp,"
+        " package);"
+        "CREATE TABLE IF NOT EXISTS files (filename TEXT, path TEXT);"
+        "CREATE INDEX IF NOT EXISTS files_filename ON files (filename);"
+    )
+    return db
+
+
+def repo_index_debs(db, repodir: str, dist: str, comp: str, paths: list,
+                    infos: dict = None) -> int:
+    '''
+    Reads the .deb packages at paths (under the binary-all directory of comp)
+    and hashes them (see deb_info() and hash_files()), then adds them to the
+    package index db, replacing their previous entries. infos holds the
+    deb_info() of the packages already read, by path. Returns -1 on error,
+    with errno and errdesc set, before changing the index.
+    '''
+    infos = dict(infos or {})
+    for path in paths:
+        if (path in infos):
+            continue
+        info: dict = deb_info(path)
+        if (info == {}):
+            return -1
+        infos[path] = info
+    for path, hashes in hash_files(paths).items():
+        relpath: str = os.path.relpath(path, repodir)
+        fields: dict = parse_control(infos[path]["control"])
+        st: os.stat_result = os.stat(path)
+        db.execute("DELETE FROM files WHERE filename = ?", (relpath,))
+        db.execute(
+            "INSERT OR REPLACE INTO packages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (relpath, dist, comp, fields.get("Package", ""),
+             fields.get("Version", ""), st.st_size, st.st_mtime_ns,
+             infos[path]["control"], json.dumps(hashes)))
+        db.executemany("INSERT INTO files VALUES (?, ?)",
+                       [(relpath, name) for name in infos[path]["files"]])
     return 0
 
 
-def build_package(rootdir: str, buildcfg = {}) -> str:
-    build_proc = subprocess.run(
-        ["dpkg", "--build", rootdir],
-        stdout = subprocess.PIPE,
-        stderr = subprocess.STDOUT,
-        text = True
+def repo_unindex(db, relpaths: list) -> None:
+    for relpath in relpaths:
+        db.execute("DELETE FROM packages WHERE filename = ?", (relpath,))
+        db.execute("DELETE FROM files WHERE filename = ?", (relpath,))
+
+
+def repo_scan(db, repodir: str, dist: str, comp: str) -> int:
+    '''
+    Brings the entries of comp in the package index db in line with the .deb
+    packages in its binary-all directory: packages whose size or mtime have
+    changed, or that are new, are read and hashed again (see
+    repo_index_debs()), and the entries of packages that are gone are
+    removed. Returns -1 on error.
+    '''
+    debdir: str = os.path.join(repodir, "dists", dist, comp, "binary-all")
+    indexed: dict = {
+        relpath : (size, mtime) for relpath, size, mtime in db.execute(
+            "SELECT filename, size, mtime FROM packages"
+            " WHERE dist = ? AND comp = ?", (dist, comp))
+    }
+    changed: list = []
+    for name in sorted(os.listdir(debdir)):
+        if (not name.endswith(".deb")):
+            continue
+        path: str = os.path.join(debdir, name)
+        st: os.stat_result = os.stat(path)
+        if (indexed.pop(os.path.relpath(path, repodir), None) !=
+            (st.st_size, st.st_mtime_ns)):
+            changed.append(path)
+    repo_unindex(db, list(indexed))
+    return repo_index_debs(db, repodir, dist, comp, changed)
+
+
+def repo_packages(db, dist: str, comp: str) -> list:
+    '''
+    Returns the packages of comp in the package index db, as a list of
+    dictionaries (with the "filename", "package", "size", "control", "hashes"
+    and "files" keys) sorted by file name.
+    '''
+    packages: dict = {}
+    for filename, package, size, control, hashes in db.execute(
+        "SELECT filename, package, size, control, hashes FROM packages"
+        " WHERE dist = ? AND comp = ? ORDER BY filename", (dist, comp)):
+        packages[filename] = {"filename" : filename, "package" : package,
+                              "size" : size, "control" : control,
+                              "hashes" : json.loads(hashes), "files" : []}
+    for filename, path in db.execute(
+        "SELECT files.filename, files.path FROM files JOIN packages"
+        " USING (filename) WHERE dist = ? AND comp = ?"
+        " ORDER BY files.rowid", (dist, comp)):
+        packages[filename]["files"].append(path)
+    return list(packages.values())
+
+
+def repo_packages_text(packages: list) -> str:
+    paragraphs: list = []
+    for package in packages:
+        paragraph: str = package["control"].strip("\n") + "\n" + \
+            f"Filename: {package['filename']}\n" + \
+            f"Size: {package['size']}\n"
+        for field, algo in REPO_HASHES.items():
+            paragraph += f"{field}: {package['hashes'][algo]}\n"
+        paragraphs.append(paragraph + "\n")
+    return "".join(paragraphs)
+
+
+def repo_contents_text(packages: list) -> str:
+    '''
+    Returns the Contents index of the packages: every installed path, sorted,
+    followed by the (comma-separated) names of the packages providing it.
+    '''
+    contents: dict = {}
+    for package in packages:
+        name: str = package["package"]
+        for path in package["files"]:
+            owners: list = contents.setdefault(path, [])
+            if (name not in owners):
+                owners.append(name)
+    return "".join(
+        f"{path:<80} {','.join(owners)}\n"
+        for path, owners in sorted(contents.items())
     )
 
-    debname: str = rootdir + ".deb"
-    if (build_proc.returncode != 0):
-        errno = ERR_SUBPROCESS_FAILED
-        errdesc = build_proc.stdout
-        return ""
 
-    if (buildcfg != {}):
-        outdir: str = os.path.dirname(rootdir)
-        debdir_basename: str = buildcfg["pkgmgr"] + "." + \
-            buildcfg["dist"] + "." + buildcfg["comp"]
-        debdir: str = os.path.join(outdir, debdir_basename)
-        package: str = get_package_name(buildcfg["control"])
-        version: str = get_version(buildcfg["control"])
-        old_deb: str = rootdir + ".deb"
-        new_deb: str = os.path.join(debdir, package + "_" + \
-            version + "_all.deb")
-        os.makedirs(debdir, exist_ok = True)
-        os.rename(old_deb, new_deb)
-        debname = new_deb
+def write_index(path: str, text: str) -> None:
+    '''
+    Writes the index file at path along with its xz-compressed copy at
+    <path>.xz.
+    '''
+    data: bytes = text.encode()
+    with open(path, "wb") as index:
+        index.write(data)
+    with open(path + ".xz", "wb") as index:
+        index.write(lzma.compress(data, format = lzma.FORMAT_XZ))
+
+
+def repo_release_text(distdir: str, components: list) -> str:
+    '''
+    Returns the Release file of the distribution directory distdir, covering
+    the indexes of the given components. Fields of an existing Release file
+    are kept, except for the date, the components and the checksums.
+    '''
+    fields: dict = {}
+    releasepath: str = os.path.join(distdir, "Release")
+    if (os.path.isfile(releasepath)):
+        with open(releasepath) as release:
+            fields = parse_control(release.read())
+    for field in REPO_HASHES:
+        fields.pop(field, None)
+    dist: str = os.path.basename(os.path.normpath(distdir))
+    fields.setdefault("Suite", dist)
+    fields.setdefault("Codename", dist)
+    fields.setdefault("Architectures", "all")
+    fields["Components"] = " ".join(components)
+    fields["Date"] = time.strftime("%a, %d %b %Y %H:%M:%S UTC",
+                                   time.gmtime(get_build_mtime()))
+
+    indexes: list = []
+    for comp in components:
+        indexes += [
+            f"{comp}/binary-all/Packages",
+            f"{comp}/binary-all/Packages.xz",
+            f"{comp}/Contents-all",
+            f"{comp}/Contents-all.xz"
+        ]
+    hashes: dict = hash_files([os.path.join(distdir, index)
+                               for index in indexes])
+
+    text: str = "".join(f"{field}: {value}\n" for field, value in fields.items())
+    for field, algo in REPO_HASHES.items():
+        text += f"{field}:\n"
+        for index in indexes:
+            size: int = os.path.getsize(os.path.join(distdir, index))
+            digest: str = hashes[os.path.join(distdir, index)][algo]
+            text += f" {digest} {size} {index}\n"
+    return text
+
+
+def repo_add(db, parsed_args: dict) -> int:
+    '''
+    Publishes the .deb packages of parsed_args["items"] in the component:
+    they are copied (see clone_file()) into its binary-all directory, named
+    <package>_<version>_<arch>.deb (without the epoch), replacing the same
+    version, and only they are read and hashed. Returns -1 on error.
+    '''
+    global errno, errdesc
+    debdir: str = os.path.join(parsed_args["repodir"], "dists",
+                               parsed_args["dist"], parsed_args["comp"],
+                               "binary-all")
+    infos: dict = {}
+    for debname in parsed_args["items"]:
+        info: dict = deb_info(debname)
+        if (info == {}):
+            return -1
+        fields: dict = parse_control(info["control"])
+        if ("" in (fields.get("Package", ""), fields.get("Version", ""))):
+            errno = ERR_BAD_PACKAGE
+            errdesc = f"\"{debname}\" has no package name or version."
+            return -1
+        version: str = fields["Version"].partition(":")[2] \
+            if ":" in fields["Version"] else fields["Version"]
+        path: str = os.path.join(debdir,
+            f"{fields['Package']}_{version}_"
+            f"{fields.get('Architecture', 'all')}.deb")
+        clone_file(debname, path)
+        if (read_file_list(debname) is not None):
+            clone_file(debname + FILES_SUFFIX, path + FILES_SUFFIX)
+        elif (os.path.isfile(path + FILES_SUFFIX)):
+            os.remove(path + FILES_SUFFIX)
+        infos[path] = info
+    return repo_index_debs(db, parsed_args["repodir"], parsed_args["dist"],
+                           parsed_args["comp"], list(infos), infos)
+
+
+def repo_remove(db, parsed_args: dict) -> int:
+    '''
+    Removes the packages of parsed_args["items"] (<package> for all of its
+    versions, or <package>=<version>) from the component, along with their
+    .deb files. With parsed_args["keep"], removes every version of every
+    package of the component but the newest keep ones instead. Returns -1 on
+    error, if a package is not found, before removing anything.
+    '''
+    global errno, errdesc
+    rows: list = db.execute(
+        "SELECT filename, package, version FROM packages"
+        " WHERE dist = ? AND comp = ?",
+        (parsed_args["dist"], parsed_args["comp"])).fetchall()
+    removed: list = []
+    if (parsed_args["keep"] > 0):
+        versions: dict = {}
+        for filename, package, version in rows:
+            versions.setdefault(package, []).append((version, filename))
+        for package, entries in versions.items():
+            entries.sort(key = functools.cmp_to_key(
+                lambda a, b: compare_versions(b[0], a[0])))
+            removed += [filename for _, filename in
+                        entries[parsed_args["keep"] :]]
+    for item in parsed_args["items"]:
+        package, sep, version = item.partition("=")
+        matches: list = [filename for filename, name, ver in rows
+                         if name == package and (sep == "" or ver == version)]
+        if (matches == []):
+            errno = ERR_FILE_NOT_FOUND
+            errdesc = (f"Package \"{item}\" not found in "
+                       f"{parsed_args['dist']}/{parsed_args['comp']}.")
+            return -1
+        removed += matches
+    for relpath in removed:
+        path: str = os.path.join(parsed_args["repodir"], relpath)
+        for filepath in (path, path + FILES_SUFFIX):
+            if (os.path.isfile(filepath)):
+                os.remove(filepath)
+    repo_unindex(db, removed)
+    return 0
 
-    return debname
+
+def mk_repo(parsed_args: dict) -> int:
+    '''
+    Generates or refreshes the indexes of every component of the repository
+    distribution (see parse_args_repo()), after adding packages to, or
+    removing packages from, parsed_args["comp"] for the add, remove and prune
+    actions. The package index (see repo_open_index()) is kept in a
+    transaction for the whole run, so concurrent runs on the same repository
+    are serialized. Only the components changed are indexed again; a refresh
+    rescans them all (see repo_scan()). Returns -1 on error, with errno and
+    errdesc set.
+    '''
+    global errno, errdesc
+    repodir: str = parsed_args["repodir"]
+    distdir: str = os.path.join(repodir, "dists", parsed_args["dist"])
+    if (parsed_args["action"] == "add"):
+        os.makedirs(os.path.join(distdir, parsed_args["comp"], "binary-all"),
+                    exist_ok = True)
+    if (not os.path.isdir(distdir)):
+        errno = ERR_FILE_NOT_FOUND
+        errdesc = f"Distribution directory \"{distdir}\" not found."
+        return -1
+
+    components: list = sorted(
+        comp for comp in os.listdir(distdir)
+        if os.path.isdir(os.path.join(distdir, comp, "binary-all"))
+    )
+    db = repo_open_index(repodir)
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        if (parsed_args["action"] == "refresh"):
+            changed: list = components
+            for comp in components:
+                if (repo_scan(db, repodir, parsed_args["dist"], comp) != 0):
+                    db.execute("ROLLBACK")
+                    return -1
+        else:
+            changed = [parsed_args["comp"]]
+            update = repo_add if parsed_args["action"] == "add" else \
+                repo_remove
+            if (update(db, parsed_args) != 0):
+                db.execute("ROLLBACK")
+                return -1
+
+        for comp in changed:
+            packages: list = repo_packages(db, parsed_args["dist"], comp)
+            write_index(os.path.join(distdir, comp, "binary-all", "Packages"),
+                        repo_packages_text(packages))
+            write_index(os.path.join(distdir, comp, "Contents-all"),
+                        repo_contents_text(packages))
+        release_text: str = repo_release_text(distdir, components)
+        with open(os.path.join(distdir, "Release"), "w") as release:
+            release.write(release_text)
+        db.execute("COMMIT")
+    finally:
+        db.close()
+    return 0
 
 
 def show_help() -> None:
@@ -671,6 +5459,7 @@ def show_version() -> None:
 
 
 def main() -> None:
+    global timings
     args: list = sys.argv[1:]
 
     if (args == [] or args[0] in ("-h", "--help")):
@@ -683,8 +5472,19 @@ def main() -> None:
 
     parsed_args_gencfg: dict = parse_args_gencfg(args)
     parsed_args_build: dict = parse_args_build(args)
+    parsed_args_batch: dict = parse_args_batch(args)
+    parsed_args_cache_stats: dict = parse_args_cache_stats(args)
+    parsed_args_blob_gc: dict = parse_args_blob_gc(args)
+    parsed_args_repo: dict = parse_args_repo(args)
+    parsed_args_convert: dict = parse_args_convert(args)
+    parsed_args_verify: dict = parse_args_verify(args)
+    parsed_args_serve: dict = parse_args_serve(args)
 
-    if (parsed_args_gencfg == {} and parsed_args_build == {}):
+    if (parsed_args_gencfg == {} and parsed_args_build == {} and
+        parsed_args_batch == {} and parsed_args_cache_stats == {} and
+        parsed_args_repo == {} and parsed_args_convert == {} and
+        parsed_args_verify == {} and parsed_args_serve == {} and
+        parsed_args_blob_gc == {}):
         print(
             "spal: Invalid arguments or combination of arguments.\n"
             "Use \"spal -h\" to view help."
@@ -692,68 +5492,89 @@ def main() -> None:
         sys.exit(1)
 
     if (parsed_args_gencfg != {}):
-        if (mk_cfg(parsed_args_gencfg) != 0):
+        output, exitcode = run_gencfg(parsed_args_gencfg)
+        print(output)
+        sys.exit(exitcode)
+    if (parsed_args_serve != {}):
+        if (serve(parsed_args_serve) != 0):
             error: tuple = get_last_error()
             print(
-                f"spal: Error in generating build config (errorcode: {error[0]}).\n"
+                f"spal: Error in starting the build daemon "
+                f"(errorcode: {error[0]}).\n"
                 f"Error message:\n{error[1]}"
             )
             sys.exit(1)
-        else:
-            print(cfgfile)
-            sys.exit(0)
-    if (parsed_args_build != {}):
-        buildcfg = getcfg(parsed_args_build["buildcfg"])
-        outdir: str = parsed_args_build["outdir"]
-
-        if (buildcfg == {}):
+        sys.exit(0)
+    if (parsed_args_repo != {}):
+        if (mk_repo(parsed_args_repo) != 0):
             error: tuple = get_last_error()
             print(
-                f"spal: Error in pre-build process (errorcode: {error[0]})\n"
+                f"spal: Error in generating repository indexes "
+                f"(errorcode: {error[0]}).\n"
                 f"Error message:\n{error[1]}"
             )
             sys.exit(1)
-
-        rootdir: str = get_rootdir(buildcfg, outdir)
-
-        calls: list = [
-            mk_buildtree,
-            mk_control,
-            mk_copyright,
-            mk_shwrapper,
-            mk_man,
-            cp_sources
-        ]
-        for call in calls:
-            if (call(buildcfg, outdir) != 0):
-                error: tuple = get_last_error()
-                print(
-                    f"spal: Error in pre-build process (errorcode: {error[0]})\n"
-                    f"Error message:\n{error[1]}"
-                )
-                sys.exit(1)
-
-        debname: str = ""
-        if (parsed_args_build["use-debstdname"]):
-            debname = build_package(rootdir, buildcfg)
-        else:
-            debname = build_package(rootdir)
-
-        if (debname == ""):
+        print(os.path.join(parsed_args_repo["repodir"], "dists",
+                           parsed_args_repo["dist"], "Release"))
+        sys.exit(0)
+    if (parsed_args_convert != {}):
+        if (convert_cfg(parsed_args_convert) != 0):
             error: tuple = get_last_error()
             print(
-                f"spal: Error in building package (errorcode: {error[0]}).\n"
+                f"spal: Error in converting build config "
+                f"(errorcode: {error[0]}).\n"
                 f"Error message:\n{error[1]}"
             )
             sys.exit(1)
-        else:
-            print(debname)
-
-        if (not parsed_args_build["keep-buildtree"]):
-            shutil.rmtree(rootdir)
+        print(cfgfile)
+        sys.exit(0)
+    if (parsed_args_verify != {}):
+        report: list = verify_package(parsed_args_verify)
+        if (report == ()):
+            error: tuple = get_last_error()
+            print(
+                f"spal: Error in verifying package "
+                f"(errorcode: {error[0]}).\n"
+                f"Error message:\n{error[1]}"
+            )
+            sys.exit(1)
+        failed: list = [(path, status) for path, status in report
+                        if status != "OK"]
+        for path, status in failed:
+            print(f"{path}: {status}")
+        print(f"{parsed_args_verify['package']}: {len(report)} files "
+              f"checked, {len(failed)} failed.")
+        sys.exit(failed != [])
+    if (parsed_args_cache_stats != {}):
+        show_cache_stats(parsed_args_cache_stats["cache-dir"])
+        sys.exit(0)
+    if (parsed_args_blob_gc != {}):
+        show_blob_gc(parsed_args_blob_gc["blob-store"])
+        sys.exit(0)
+    if (parsed_args_batch != {}):
+        sys.exit(build_batch(parsed_args_batch) != 0)
+    if (parsed_args_build != {} and parsed_args_build["watch"]):
+        sys.exit(watch(parsed_args_build["buildcfg"],
+                       parsed_args_build["outdir"], parsed_args_build))
+    if (parsed_args_build != {}):
+        if (parsed_args_build["timings"] or
+            parsed_args_build["timings-trace"] != ""):
+            timings = []
+        profiler: cProfile.Profile = None
+        if (parsed_args_build["profile"] != ""):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        output, exitcode = run_build(parsed_args_build)
+        if (profiler is not None):
+            profiler.disable()
+            profiler.dump_stats(parsed_args_build["profile"])
+        print(output)
+        if (parsed_args_build["timings"]):
+            show_timings()
+        if (parsed_args_build["timings-trace"] != ""):
+            show_timings(parsed_args_build["timings-trace"])
+        sys.exit(exitcode)
 
-        sys.exit(debname == "")
-                
 
 if (__name__ == "__main__"):
     main()
@@ -0,0 +1,104 @@
+# File: ./tests/conftest.py
+#
+# Shared fixtures of the spal regression tests: writing build configs into a
+# temporary directory, and running spal on them as a separate process.
+#
+#
+# Copyright (C) 2025-Present Arijit Kumar Das <arijitkdgit.official@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+SPAL: str = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "..", "src", "spal.py")
+sys.path.insert(0, os.path.dirname(SPAL))
+
+CFG_TEXT = """[PACKAGE-MANAGER]
+{pkgmgr}
+[END]
+
+
+[DISTRIBUTION]
+stable
+[END]
+
+
+[COMPONENT]
+main
+[END]
+
+
+[SHELLSCRIPT]
+#!/bin/sh
+exec /usr/lib/{package}/lib/main.py "$@"
+[END]
+
+
+[CONTROL]
+Package: {package}
+Version: 1.0
+Architecture: all
+Maintainer: Test <test@localhost>
+{depends}Description: spal regression test package
+[END]
+
+
+[SOURCES]
+src/lib
+[END]
+"""
+
+
+@pytest.fixture
+def mkcfg(tmp_path):
+    '''
+    Returns a function writing the build config of a package under tmp_path,
+    with src/lib as its only source, and returning its path.
+    '''
+    srcdir = tmp_path / "src" / "lib"
+    srcdir.mkdir(parents = True, exist_ok = True)
+    (srcdir / "main.py").write_text("print('Hello, World!')\n")
+
+    def mkcfg(package: str, depends: str = "", pkgmgr: str = "apt",
+              newline: str = "\n") -> str:
+        path: str = str(tmp_path / f"{package}.spalcfg")
+        text: str = CFG_TEXT.format(
+            package = package, pkgmgr = pkgmgr,
+            depends = f"Depends: {depends}\n" if depends else "")
+        with open(path, "w", newline = newline) as cfgfile:
+            cfgfile.write(text)
+        return path
+    return mkcfg
+
+
+@pytest.fixture
+def run_spal(tmp_path):
+    '''
+    Returns a function running spal with the given arguments in tmp_path,
+    without the build daemon, and returning the completed process.
+    '''
+    def run_spal(*args: str) -> subprocess.CompletedProcess:
+        env: dict = dict(os.environ, SPAL_SOCKET = "",
+                         SOURCE_DATE_EPOCH = "1700000000")
+        return subprocess.run([sys.executable, SPAL] + list(args),
+                              cwd = tmp_path, env = env, text = True,
+                              stdout = subprocess.PIPE,
+                              stderr = subprocess.PIPE)
+    return run_spal
@@ -0,0 +1,72 @@
+# File: ./tests/test_batch.py
+#
+# Regression tests of the batch mode of spal (-b/--batch).
+#
+#
+# Copyright (C) 2025-Present Arijit Kumar Das <arijitkdgit.official@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+
+def test_cycle_with_buildable_packages(tmp_path, mkcfg, run_spal):
+    # cc and dd form a cycle, bb depends on it, aa does not.
+    mkcfg("aa", "libc6")
+    mkcfg("bb", "aa, cc")
+    mkcfg("cc", "dd")
+    mkcfg("dd", "cc")
+    proc = run_spal("-b", "--keep-going", "out", ".")
+    assert "Traceback" not in proc.stderr
+    assert "Dependency cycle" in proc.stdout
+    assert "Skipped \"./bb.spalcfg\"" in proc.stdout
+    assert proc.returncode != 0
+    debdir = tmp_path / "out" / "apt.stable.main"
+    assert sorted(path.name for path in debdir.iterdir()
+                  if path.suffix == ".deb") == ["aa_1.0_all.deb"]
+
+
+def test_failed_package_skips_only_its_dependents(tmp_path, mkcfg, run_spal):
+    # bb has a missing source, cc depends on it, aa and dd do not.
+    mkcfg("aa")
+    (tmp_path / "bb.spalcfg").write_text(
+        open(mkcfg("bb")).read().replace("src/lib\n", "src/missing\n"))
+    mkcfg("cc", "bb")
+    mkcfg("dd")
+    proc = run_spal("-b", "-j", "1", "out", ".")
+    assert "Traceback" not in proc.stderr
+    assert "Error in building \"./bb.spalcfg\"" in proc.stdout
+    assert "Skipped \"./cc.spalcfg\"" in proc.stdout
+    assert proc.returncode != 0
+    debdir = tmp_path / "out" / "apt.stable.main"
+    assert sorted(path.name for path in debdir.iterdir()
+                  if path.suffix == ".deb") == ["aa_1.0_all.deb",
+                                                "dd_1.0_all.deb"]
+
+
+def test_unreadable_config_fails_alone(tmp_path, mkcfg, run_spal):
+    # A build config that is not UTF-8 raises UnicodeDecodeError when read.
+    mkcfg("aa")
+    mkcfg("bb")
+    data: bytes = (tmp_path / "bb.spalcfg").read_bytes()
+    (tmp_path / "bb.spalcfg").write_bytes(
+        data.replace(b"Description: ", b"Description: \xff"))
+    mkcfg("cc")
+    proc = run_spal("-b", "out", ".")
+    assert "Traceback" not in proc.stderr
+    assert "Error in building \"./bb.spalcfg\" (errorcode: -14)" \
+        in proc.stdout
+    assert proc.returncode != 0
+    debdir = tmp_path / "out" / "apt.stable.main"
+    assert sorted(path.name for path in debdir.iterdir()
+                  if path.suffix == ".deb") == ["aa_1.0_all.deb",
+                                                "cc_1.0_all.deb"]
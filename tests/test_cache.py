@@ -0,0 +1,55 @@
+# File: ./tests/test_cache.py
+#
+# Regression tests of the build cache of spal (-c/--cache-dir).
+#
+#
+# Copyright (C) 2025-Present Arijit Kumar Das <arijitkdgit.official@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+
+
+def read_deb(tmp_path, outdir: str) -> bytes:
+    return (tmp_path / outdir / "aa_1.0_all.apt.stable.main.deb").read_bytes()
+
+
+def test_source_mtime_misses_cache(tmp_path, mkcfg, run_spal):
+    cfgpath: str = mkcfg("aa")
+    assert run_spal("-c", "cache", cfgpath, "cached").returncode == 0
+    os.utime(tmp_path / "src" / "lib" / "main.py", (978307200, 978307200))
+    assert run_spal("-c", "cache", cfgpath, "cached").returncode == 0
+    assert run_spal(cfgpath, "fresh").returncode == 0
+    assert read_deb(tmp_path, "cached") == read_deb(tmp_path, "fresh")
+
+
+def test_cached_package_is_not_shared(tmp_path, mkcfg, run_spal):
+    # Building other sources into the same outdir must not change what the
+    # cache holds for the first ones.
+    cfgpath: str = mkcfg("aa")
+    main = tmp_path / "src" / "lib" / "main.py"
+    os.utime(main, (1700000000, 1700000000))
+    assert run_spal("-c", "cache", cfgpath, "out").returncode == 0
+    first: bytes = read_deb(tmp_path, "out")
+    text: str = main.read_text()
+    main.write_text("print(2222222)\n")
+    assert run_spal("-c", "cache", cfgpath, "out").returncode == 0
+    main.write_text(text)
+    os.utime(main, (1700000000, 1700000000))
+    assert run_spal("-c", "cache", cfgpath, "out").returncode == 0
+    assert read_deb(tmp_path, "out") == first
+    for dirpath, _, filenames in os.walk(tmp_path / "cache"):
+        for filename in filenames:
+            assert os.stat(os.path.join(dirpath, filename)).st_nlink == 1
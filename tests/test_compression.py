@@ -0,0 +1,79 @@
+# File: ./tests/test_compression.py
+#
+# Regression tests of the payload compression of spal (-z/--compression and
+# --compress-threads).
+#
+#
+# Copyright (C) 2025-Present Arijit Kumar Das <arijitkdgit.official@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+
+import io
+import os
+import shutil
+import subprocess
+import zlib
+
+import pytest
+
+import spal
+
+
+@pytest.mark.parametrize("size", [0, 1, spal.COMPRESSION_BLOCKSIZE,
+                                  2 * spal.COMPRESSION_BLOCKSIZE + 1])
+def test_threaded_gzip_is_one_member(size):
+    data: bytes = os.urandom(size // 2) + b"a" * (size - size // 2)
+    out = io.BytesIO()
+    writer = spal.mk_compressed_writer(out, {"type" : "gzip", "level" : 1,
+                                             "threads" : 4})
+    writer.write(data)
+    writer.close()
+    assert writer.size == len(out.getvalue())
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert decompressor.decompress(out.getvalue()) == data
+    assert decompressor.eof and decompressor.unused_data == b""
+
+
+def test_threaded_gzip_package_reads_back(tmp_path, mkcfg, run_spal):
+    # More than one compression block of data, so that several threads
+    # compress it.
+    with open(tmp_path / "src" / "lib" / "data.bin", "wb") as datafile:
+        datafile.write(os.urandom(spal.COMPRESSION_BLOCKSIZE + 4096))
+    cfgpath: str = mkcfg("aa")
+    assert run_spal("-z", "gzip:1", "--compress-threads", "4", cfgpath,
+                    "out").returncode == 0
+    debname: str = str(tmp_path / "out" / "aa_1.0_all.apt.stable.main.deb")
+    if (os.path.exists(debname + spal.FILES_SUFFIX)):
+        os.remove(debname + spal.FILES_SUFFIX)
+
+    with open(debname, "rb") as debfile:
+        for name, offset, size in spal.deb_members(debfile):
+            if (name == "data.tar.gz"):
+                debfile.seek(offset)
+                member: bytes = debfile.read(size)
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    decompressor.decompress(member)
+    assert decompressor.eof and decompressor.unused_data == b""
+
+    info: dict = spal.deb_info(debname)
+    assert "usr/lib/aa/lib/data.bin" in info["files"]
+    proc = run_spal("verify", debname)
+    assert proc.returncode == 0, proc.stdout
+    if (shutil.which("gzip") is not None):
+        assert subprocess.run(["gzip", "-t"], input = member).returncode == 0
+    if (shutil.which("dpkg-deb") is not None):
+        listing: str = subprocess.run(["dpkg-deb", "-c", debname], text = True,
+                                      stdout = subprocess.PIPE).stdout
+        assert "./usr/lib/aa/lib/data.bin" in listing
@@ -0,0 +1,49 @@
+# File: ./tests/test_config.py
+#
+# Regression tests of the build config parser of spal (getcfg()).
+#
+#
+# Copyright (C) 2025-Present Arijit Kumar Das <arijitkdgit.official@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+
+import spal
+
+
+def test_crlf_config_parses_as_lf(tmp_path, mkcfg):
+    lf: dict = spal.getcfg(mkcfg("aa"))
+    os.rename(tmp_path / "aa.spalcfg", tmp_path / "lf.spalcfg")
+    crlf: dict = spal.getcfg(mkcfg("aa", newline = "\r\n"))
+    assert b"\r\n" in (tmp_path / "aa.spalcfg").read_bytes()
+    assert crlf == lf
+    assert "\r" not in crlf["control"] + crlf["shellscript"]
+
+
+def test_crlf_config_builds_as_lf(tmp_path, mkcfg, run_spal):
+    assert run_spal(mkcfg("aa"), "lf").returncode == 0
+    assert run_spal(mkcfg("aa", newline = "\r\n"), "crlf").returncode == 0
+    debname: str = "aa_1.0_all.apt.stable.main.deb"
+    assert (tmp_path / "crlf" / debname).read_bytes() == \
+        (tmp_path / "lf" / debname).read_bytes()
+
+
+def test_buildmeta_does_not_share_default_options(tmp_path, mkcfg):
+    defaults: dict = spal.BUILD_OPTIONS.copy()
+    meta: dict = spal.get_buildmeta(spal.getcfg(mkcfg("aa")),
+                                    str(tmp_path / "out"))
+    meta["options"]["precompile"] = True
+    assert spal.BUILD_OPTIONS == defaults
@@ -0,0 +1,49 @@
+# File: ./tests/test_file_list.py
+#
+# Regression tests of the file lists written along with packages by spal
+# (--file-list), and of the Contents index repo add builds from them.
+#
+#
+# Copyright (C) 2025-Present Arijit Kumar Das <arijitkdgit.official@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+
+import pytest
+
+DEBNAME = "aa_1.0_all.apt.stable.main.deb"
+
+
+@pytest.mark.parametrize("args", [[], ["-d"], ["-c", "cache"]])
+def test_no_file_list_by_default(tmp_path, mkcfg, run_spal, args):
+    cfgpath: str = mkcfg("aa")
+    assert run_spal(*args, cfgpath, "out").returncode == 0
+    assert run_spal(*args, cfgpath, "out").returncode == 0
+    assert sorted(path.name for path in (tmp_path / "out").iterdir()
+                  if path.is_file()) == [DEBNAME]
+
+
+@pytest.mark.parametrize("args", [[], ["-d"], ["-c", "cache"]])
+def test_file_list_indexes_contents(tmp_path, mkcfg, run_spal, args):
+    cfgpath: str = mkcfg("aa")
+    for _ in range(2):
+        assert run_spal("--file-list", *args, cfgpath, "out").returncode == 0
+        assert (tmp_path / "out" / (DEBNAME + ".files")).read_text() == \
+            "usr/bin/aa\nusr/lib/aa/lib/main.py\n"
+    assert run_spal("repo", "add", "repo",
+                    str(tmp_path / "out" / DEBNAME)).returncode == 0
+    contents: str = (tmp_path / "repo" / "dists" / "stable" / "main" /
+                     "Contents-all").read_text()
+    assert [line.split() for line in contents.splitlines()] == [
+        ["usr/bin/aa", "aa"], ["usr/lib/aa/lib/main.py", "aa"]]
@@ -0,0 +1,56 @@
+# File: ./tests/test_precompile.py
+#
+# Regression tests of the bytecode precompilation of spal (--precompile).
+#
+#
+# Copyright (C) 2025-Present Arijit Kumar Das <arijitkdgit.official@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+
+import io
+import shutil
+import tarfile
+
+import pytest
+
+import spal
+
+
+def read_postrm(debname: str) -> str:
+    with open(debname, "rb") as debfile:
+        for name, offset, size in spal.deb_members(debfile):
+            if (name.startswith("control.tar")):
+                debfile.seek(offset)
+                member: bytes = debfile.read(size)
+    with tarfile.open(fileobj = io.BytesIO(member), mode = "r:*") as tar:
+        return tar.extractfile("./postrm").read().decode()
+
+
+@pytest.mark.parametrize("use_dpkg", [False, True])
+def test_postrm_shebang(tmp_path, mkcfg, run_spal, use_dpkg):
+    if (use_dpkg and shutil.which("dpkg-deb") is None):
+        pytest.skip("dpkg-deb is not installed")
+    cfgpath: str = mkcfg("aa")
+    args: list = ["-d"] if use_dpkg else []
+    assert run_spal(*args, "--precompile", "--pkgmgrs", "apt,pkg", cfgpath,
+                    "out").returncode == 0
+    shebangs: dict = {
+        "apt" : "#!/bin/sh\n",
+        "pkg" : "#!/data/data/com.termux/files/usr/bin/sh\n"
+    }
+    for pkgmgr, shebang in shebangs.items():
+        postrm: str = read_postrm(
+            str(tmp_path / "out" / f"aa_1.0_all.{pkgmgr}.stable.main.deb"))
+        assert postrm.startswith(shebang)
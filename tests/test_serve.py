@@ -0,0 +1,95 @@
+# File: ./tests/test_serve.py
+#
+# Regression tests of the build daemon of spal (serve) and of its clients.
+#
+#
+# Copyright (C) 2025-Present Arijit Kumar Das <arijitkdgit.official@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from conftest import SPAL
+import spal
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    '''
+    Starts a build daemon with its socket in tmp_path, and yields the socket
+    path along with the daemon process, whose output goes to serve.log.
+    '''
+    sockpath: str = str(tmp_path / "spal.sock")
+    with open(tmp_path / "serve.log", "w") as log:
+        proc = subprocess.Popen([sys.executable, SPAL, "serve", "--socket",
+                                 sockpath, "-j", "1"],
+                                stdout = log, stderr = subprocess.STDOUT)
+    for _ in range(100):
+        if (os.path.exists(sockpath)):
+            break
+        time.sleep(0.05)
+    yield (sockpath, proc)
+    proc.terminate()
+    proc.wait()
+
+
+def test_request_error_is_answered(tmp_path, mkcfg, daemon):
+    # A build config that is not UTF-8 raises UnicodeDecodeError in getcfg().
+    cfgpath: str = mkcfg("aa")
+    with open(cfgpath, "rb") as cfgfile:
+        data: bytes = cfgfile.read()
+    with open(cfgpath, "wb") as cfgfile:
+        cfgfile.write(data.replace(b"Description: ", b"Description: \xff"))
+    env: dict = dict(os.environ, SPAL_SOCKET = daemon[0])
+    proc = subprocess.run([sys.executable, SPAL, cfgpath, "out"],
+                          cwd = tmp_path, env = env, text = True,
+                          stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    assert proc.returncode == 1
+    assert "UnicodeDecodeError" in proc.stdout
+    # The answer came from the daemon: the client did not build it again.
+    assert proc.stderr == ""
+    assert "Traceback" not in (tmp_path / "serve.log").read_text()
+
+
+@pytest.mark.parametrize("response", [b'{"output": "partial"}\n',
+                                      b'{"exitcode": 0}\n', b'{}\n',
+                                      b'[]\n', b'{"output"'])
+def test_malformed_response_falls_back(tmp_path, monkeypatch, response):
+    sockpath: str = str(tmp_path / "spal.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(sockpath)
+    server.listen(1)
+
+    def answer() -> None:
+        conn, _ = server.accept()
+        with conn:
+            conn.makefile("rb").readline()
+            conn.sendall(response)
+
+    thread = threading.Thread(target = answer)
+    thread.start()
+    monkeypatch.setenv("SPAL_SOCKET", sockpath)
+    try:
+        assert spal.serve_client(["aa.spalcfg", "out"]) == -1
+    finally:
+        thread.join()
+        server.close()